@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+"""
+Benchmark decoding query pages and holding the results in memory
+
+Builds synthetic 500 item ConfigurationItems pages with User Defined
+Fields and compares:
+ - json.loads on the decoded str (the old path) against the raw bytes,
+   and orjson when it is installed
+ - memory held by the records as dicts against CompactRecords
+
+python benchmarks/bench_decode.py [records]
+"""
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pyautotask.records import compact  # noqa: E402 pylint: disable=C0413
+
+PAGE_SIZE = 500
+UDF_COUNT = 20
+
+
+def make_page(start):
+	items = []
+	for ci_id in range(start, start + PAGE_SIZE):
+		items.append({
+			"id": ci_id,
+			"companyID": ci_id % 1500,
+			"configurationItemCategoryID": 3,
+			"configurationItemType": 1,
+			"dattoHostname": "host-%d" % ci_id,
+			"installDate": "2023-01-01T00:00:00Z",
+			"isActive": True,
+			"lastModifiedTime": "2024-05-01T12:00:00Z",
+			"productID": 29683000 + ci_id % 40,
+			"referenceTitle": "Device %d" % ci_id,
+			"serialNumber": "SN%08d" % ci_id,
+			"warrantyExpirationDate": None,
+			"userDefinedFields": [{"name": "Metric %d" % udf, "value": str(ci_id * udf)}
+								  for udf in range(UDF_COUNT)],
+		})
+	return json.dumps({"items": items, "pageDetails": {"count": PAGE_SIZE, "nextPageUrl": None}}).encode()
+
+
+def timed(label, func, pages):
+	start = time.perf_counter()
+	for page in pages:
+		func(page)
+	elapsed = time.perf_counter() - start
+	print("%-32s %8.1f ms" % (label, elapsed * 1000))
+
+
+def held(label, build, pages):
+	gc.collect()
+	tracemalloc.start()
+	records = []
+	for page in pages:
+		records.extend(build(page))
+	size, _peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	print("%-32s %8.1f MB  (%d records)" % (label, size / 2 ** 20, len(records)))
+	return size
+
+
+def main():
+	total = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+	pages = [make_page(start) for start in range(1, total + 1, PAGE_SIZE)]
+
+	print("Decode %d records" % (len(pages) * PAGE_SIZE))
+	timed("json.loads(bytes.decode())", lambda page: json.loads(page.decode("utf-8")), pages)
+	timed("json.loads(bytes)", json.loads, pages)
+	try:
+		import orjson
+	except ImportError:
+		print("%-32s %11s" % ("orjson.loads(bytes)", "not installed"))
+	else:
+		timed("orjson.loads(bytes)", orjson.loads, pages)
+
+	print("\nHold decoded records")
+	as_dicts = held("dicts", lambda page: json.loads(page)["items"], pages)
+	schemas = {}
+	as_compact = held("CompactRecords", lambda page: compact(json.loads(page)["items"], schemas), pages)
+	print("%-32s %8.1f x less" % ("", as_dicts / as_compact))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+"""
+Benchmark cold start: importing pyautotask and constructing an atSite
+
+Each step runs in fresh interpreters and reports the median wall time
+over the bare interpreter start, then checks the modules kept off the
+startup path (requests, sqlite3, urllib.request, orjson) are still not
+imported before the first request. Exits 1 when a check fails or a step
+is slower than --max-ms, so it can guard against regressions.
+
+python benchmarks/bench_import.py [--runs 15] [--max-ms 60]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+STEPS = [
+	("import pyautotask", "import pyautotask"),
+	("import pyautotask.atsite", "import pyautotask.atsite"),
+	("atSite(...)", "from pyautotask.atsite import atSite; atSite('host', 'user', 'secret', 'code')"),
+	("python -m pyautotask --help", None),
+]
+
+# must not be imported until the first request
+DEFERRED = ("requests", "sqlite3", "urllib.request", "orjson", "pyautotask.export", "pyautotask.mirror")
+
+
+def timed(argv, runs):
+	env = dict(os.environ, PYTHONPATH=ROOT)
+	times = []
+	for _run in range(runs):
+		start = time.perf_counter()
+		subprocess.run(argv, env=env, check=True, stdout=subprocess.DEVNULL)
+		times.append(time.perf_counter() - start)
+	return statistics.median(times)
+
+
+def loaded(code):
+	"""Return which DEFERRED modules running code imports"""
+	check = code + "; import sys; print(' '.join(m for m in %r if m in sys.modules))" % (DEFERRED,)
+	output = subprocess.run([sys.executable, "-c", check], env=dict(os.environ, PYTHONPATH=ROOT),
+							check=True, capture_output=True, text=True).stdout
+	return output.split()
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+	parser.add_argument("--runs", type=int, default=15)
+	parser.add_argument("--max-ms", type=float, default=None, help="fail when a step takes longer")
+	args = parser.parse_args()
+
+	# compile once so the runs time imports, not bytecode compilation
+	subprocess.run([sys.executable, "-m", "compileall", "-q", os.path.join(ROOT, "pyautotask")], check=True)
+
+	baseline = timed([sys.executable, "-c", "pass"], args.runs)
+	print("%-32s %8.1f ms" % ("python -c pass", baseline * 1000))
+	failed = False
+	for label, code in STEPS:
+		argv = [sys.executable, "-c", code] if code else [sys.executable, "-m", "pyautotask", "--help"]
+		extra = (timed(argv, args.runs) - baseline) * 1000
+		slow = args.max_ms is not None and extra > args.max_ms
+		failed = failed or slow
+		print("%-32s %+8.1f ms%s" % (label, extra, "  over --max-ms" if slow else ""))
+
+	for label, code in STEPS:
+		if code:
+			early = loaded(code)
+			failed = failed or bool(early)
+			print("%-32s %s" % (label, "imports " + ", ".join(early) if early else "defers " + ", ".join(DEFERRED)))
+	return 1 if failed else 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
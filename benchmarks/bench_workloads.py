@@ -0,0 +1,160 @@
+#!/usr/bin/python3
+"""
+Benchmark the main atSite workloads against a local MockAutotask
+
+Each scenario gets a fresh mock server with the given latency and
+throttling, and reports wall time, items a second, API requests, the
+p50/p95 request latency seen by the client and, with --memory, the peak
+memory traced while it ran. Workloads:
+ - ci-pull: every ConfigurationItem, serially and as id range shards
+ - pages: a paginated read consumed page by page, with and without prefetch
+ - upsert: create or update CIs with ci_push_by_serialNumber per device and
+   with bulk_upsert_cis
+ - alerts: an alert storm with duplicates through send_generic_alert_ticket
+   and through an AlertTicketEngine
+
+python benchmarks/bench_workloads.py [--cis 5000] [--latency 0.02] [--throttle 0.0] [--memory] [workload ...]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# pylint: disable=C0413
+from pyautotask.atsite import atSite  # noqa: E402
+from pyautotask.mockserver import MockAutotask  # noqa: E402
+from pyautotask.query import exist  # noqa: E402
+from pyautotask.scheduler import RequestScheduler  # noqa: E402
+
+WORKLOADS = ("ci-pull", "pages", "upsert", "alerts")
+
+
+def run(args, label, scenario, **mock_kwargs):
+	"""Run scenario(site) against a fresh mock and print a result line"""
+	options = dict(cis=args.cis, companies=args.companies, latency=args.latency, throttle_rate=args.throttle,
+				   retry_after=0)
+	options.update(mock_kwargs)
+	with MockAutotask(**options) as mock:
+		# the benchmarks measure the client, not the hourly pacing
+		site = atSite(None, "bench", "secret", "code", base_url=mock.url,
+					  scheduler=RequestScheduler(rate=None, max_concurrent=3, backoff=0.05))
+		if args.memory:
+			tracemalloc.start()
+		start = time.perf_counter()
+		items = scenario(site)
+		elapsed = time.perf_counter() - start
+		peak = tracemalloc.get_traced_memory()[1] if args.memory else None
+		if args.memory:
+			tracemalloc.stop()
+		site.close()
+	latencies = [stats for stats in site.metrics.summary()['endpoints'].values()]
+	p50 = max((stats['p50'] or 0 for stats in latencies), default=0)
+	p95 = max((stats['p95'] or 0 for stats in latencies), default=0)
+	print("%-34s %8.2f s %9.0f/s %6d req %4d 429 %7.1f ms %7.1f ms %s" % (
+		label, elapsed, items / elapsed if elapsed else 0, mock.requests, mock.throttled,
+		p50 * 1000, p95 * 1000, "%7.1f MB" % (peak / 2 ** 20) if peak is not None else ""))
+
+
+def ci_pull(args):
+	run(args, "get_cis(all_pages=True)", lambda site: len(site.get_cis(exist("id"), all_pages=True)))
+	run(args, "iter_query_sharded", lambda site: sum(
+		1 for _ci in site.iter_query_sharded("ConfigurationItems", args.cis, exist("id"))))
+	run(args, "iter_query_sharded, 3 fields", lambda site: sum(
+		1 for _ci in site.iter_query_sharded("ConfigurationItems", args.cis, exist("id"),
+											 include_fields=["id", "serialNumber", "companyID"])))
+
+
+def pages(args):
+	def consume(prefetch):
+		def scenario(site):
+			count = 0
+			for page in site.iter_pages("ConfigurationItems", exist("id"), prefetch=prefetch):
+				# stand-in for processing each page
+				time.sleep(args.latency)
+				count += len(page)
+			return count
+		return scenario
+	run(args, "iter_pages, prefetch=0", consume(0))
+	run(args, "iter_pages, prefetch=2", consume(2))
+
+
+def upsert_records(args):
+	"""A quarter unchanged, half changed, a quarter new"""
+	records = []
+	count = args.upserts
+	for index in range(1, count + 1):
+		# the values MockAutotask generates for CI index
+		record = {"serialNumber": "SN%08d" % index, "referenceTitle": "Device %d" % index,
+				  "companyID": index % args.companies + 1, "configurationItemType": 1,
+				  "configurationItemCategoryID": 3, "productID": index % 40 + 1}
+		if index > count * 3 // 4:
+			record.update(serialNumber="NEW%08d" % index, referenceTitle="New %d" % index)
+		elif index > count // 4:
+			record["referenceTitle"] = "Renamed %d" % index
+		records.append(record)
+	return records
+
+
+def upsert(args):
+	records = upsert_records(args)
+
+	def one_by_one(site):
+		# the per device helper bulk_upsert_cis replaces: a lookup, then a create or an update
+		for record in records:
+			site.ci_push_by_serialNumber(
+				record["configurationItemCategoryID"], record["companyID"], record["configurationItemType"],
+				record["productID"], record["referenceTitle"], record["serialNumber"], [])
+		return len(records)
+
+	def bulk(site):
+		return len(site.bulk_upsert_cis(records))
+	run(args, "ci_push_by_serialNumber each", one_by_one)
+	run(args, "bulk_upsert_cis", bulk)
+
+
+def alert_storm(args):
+	# every CI alerts several times, as when a site goes down
+	alerts = [("Network device Down!", "Device is not responding", ci_id % args.companies + 1, ci_id)
+			  for _repeat in range(4) for ci_id in range(1, args.alerts // 4 + 1)]
+
+	def lookups(site):
+		for alert in alerts:
+			site.send_generic_alert_ticket(*alert)
+		return len(alerts)
+
+	def engine(site):
+		alert_engine = site.alert_tickets()
+		with ThreadPoolExecutor(max_workers=8) as executor:
+			list(executor.map(lambda alert: alert_engine.send(*alert), alerts))
+		return len(alerts)
+	run(args, "send_generic_alert_ticket", lookups, tickets=args.alerts)
+	run(args, "AlertTicketEngine.send", engine, tickets=args.alerts)
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+	parser.add_argument("workloads", nargs="*", default=WORKLOADS, help=", ".join(WORKLOADS))
+	parser.add_argument("--cis", type=int, default=5000)
+	parser.add_argument("--companies", type=int, default=50)
+	parser.add_argument("--upserts", type=int, default=400)
+	parser.add_argument("--alerts", type=int, default=400)
+	parser.add_argument("--latency", type=float, default=0.02, help="seconds the mock takes per request")
+	parser.add_argument("--throttle", type=float, default=0.0, help="fraction of requests the mock answers 429")
+	parser.add_argument("--memory", action="store_true", help="trace peak memory, slows the runs down")
+	args = parser.parse_args()
+	for workload in args.workloads:
+		if workload not in WORKLOADS:
+			parser.error("unknown workload " + workload)
+
+	print("%-34s %10s %11s %10s %8s %10s %10s" % ("", "time", "items", "requests", "", "p50", "p95"))
+	for workload in args.workloads:
+		print(workload)
+		{"ci-pull": ci_pull, "pages": pages, "upsert": upsert, "alerts": alert_storm}[workload](args)
+
+
+if __name__ == "__main__":
+	main()
@@ -1,9 +1,49 @@
 """
 Python __init__ to interact with an Autotask site
+
+Submodules load on first use, so `import pyautotask` stays cheap for
+short-lived jobs:
+>>> import pyautotask
+>>> site = pyautotask.atSite(host, username, password, code)
 """
-import urllib3
+import importlib
+
+# public names and the submodule each one lives in
+_LAZY = {
+    "atSite": "atsite",
+    "atSiteBase": "atsite",
+    "APIError": "atsite",
+    "discover_zone": "atsite",
+    "AsyncAtSite": "aio",
+    "MemoryCache": "cache",
+    "DiskCache": "cache",
+    "Export": "export",
+    "Mirror": "mirror",
+    "MockAutotask": "mockserver",
+    "Picklist": "metadata",
+    "RequestMetrics": "metrics",
+    "Query": "query",
+    "RequestScheduler": "scheduler",
+    "WriteBehindQueue": "writes",
+}
+
+__all__ = sorted(_LAZY) + ["http_debug_log_stderr"]
+
+
+def __getattr__(name):
+    module = _LAZY.get(name)
+    if module is None:
+        raise AttributeError("module " + repr(__name__) + " has no attribute " + repr(name))
+    value = getattr(importlib.import_module("." + module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
 
 
 def http_debug_log_stderr():
     """Dump requests urllib3 debug messages to stderr"""
+    import urllib3  # pylint: disable=import-outside-toplevel
     urllib3.add_stderr_logger()
@@ -0,0 +1,122 @@
+"""
+Command line access to common Autotask queries
+
+Credentials come from the environment:
+ AUTOTASK_USERNAME, AUTOTASK_SECRET, AUTOTASK_INTEGRATION_CODE and
+ optionally AUTOTASK_BASE_URL or AUTOTASK_HOST, else the zone is looked up
+ (and cached) for the username.
+
+python -m pyautotask count Tickets --where status=1
+python -m pyautotask query ConfigurationItems --where serialNumber=ABC123 --fields id,referenceTitle
+python -m pyautotask get Companies 0
+python -m pyautotask export ConfigurationItems cis.csv
+python -m pyautotask --timing zone
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+STARTED = time.perf_counter()
+
+ENVIRONMENT = ("AUTOTASK_USERNAME", "AUTOTASK_SECRET", "AUTOTASK_INTEGRATION_CODE")
+
+
+def parse_args(argv):
+	parser = argparse.ArgumentParser(prog="python -m pyautotask", description="Query an Autotask site")
+	parser.add_argument("--timing", action="store_true", help="print import, startup and request times to stderr")
+	commands = parser.add_subparsers(dest="command", required=True)
+
+	def filtered(name, help_text):
+		command = commands.add_parser(name, help=help_text)
+		command.add_argument("entity", help="ie ConfigurationItems, Tickets, Companies")
+		command.add_argument("--where", action="append", default=[], metavar="FIELD=VALUE",
+							 help="only items where field equals value, repeatable")
+		command.add_argument("--filter", action="append", default=[], metavar="JSON",
+							 help='raw filter condition, ie \'{"op":"gt","field":"id","value":"0"}\'')
+		return command
+
+	query = filtered("query", "print matching items, one JSON object a line")
+	query.add_argument("--fields", help="comma separated fields to return")
+	query.add_argument("--all", action="store_true", help="follow every page instead of the first 500 items")
+	filtered("count", "print how many items match")
+	export = filtered("export", "stream matching items to an .ndjson, .csv or .parquet file")
+	export.add_argument("path")
+	export.add_argument("--fields", help="comma separated fields to return")
+	get = commands.add_parser("get", help="print one item by id")
+	get.add_argument("entity")
+	get.add_argument("id")
+	commands.add_parser("zone", help="print the REST url of the user's zone")
+	return parser, parser.parse_args(argv)
+
+
+def filter_fields(args):
+	"""Return the command's filters as create_filter strings, defaulting to every item like Export"""
+	conditions = []
+	for where in args.where:
+		field, _sep, value = where.partition("=")
+		conditions.append(json.dumps({"op": "eq", "field": field, "value": value}))
+	for condition in args.filter:
+		conditions.append(json.dumps(json.loads(condition)))
+	return ",".join(conditions) or json.dumps({"op": "exist", "field": "id"})
+
+
+def main(argv=None):
+	parser, args = parse_args(sys.argv[1:] if argv is None else argv)
+	missing = [name for name in ENVIRONMENT if not os.environ.get(name)]
+	if missing:
+		parser.error("set " + ", ".join(missing))
+	try:
+		conditions = filter_fields(args) if args.command in ("query", "count", "export") else None
+	except ValueError as err:
+		parser.error("--filter is not JSON: " + str(err))
+
+	# the client is only imported once the arguments are known to be usable
+	imported = time.perf_counter()
+	from .atsite import APIError, atSite  # pylint: disable=import-outside-toplevel
+	username, secret, code = (os.environ[name] for name in ENVIRONMENT)
+	base_url = os.environ.get("AUTOTASK_BASE_URL")
+	host = os.environ.get("AUTOTASK_HOST")
+	loaded = time.perf_counter()
+	timings = [("import", loaded - imported)]
+	try:
+		if base_url or host:
+			site = atSite(host, username, secret, code, base_url=base_url, cache=False)
+		else:
+			site = atSite.from_zone(username, secret, code, cache=False)
+		timings.append(("startup", time.perf_counter() - loaded))
+		requested = time.perf_counter()
+		if args.command == "zone":
+			print(site.url)
+		elif args.command == "count":
+			print(site.count(args.entity, conditions))
+		elif args.command == "get":
+			print(json.dumps(site._api_read(args.entity + "/" + args.id), default=str))  # pylint: disable=protected-access
+		elif args.command == "query":
+			fields = args.fields.split(",") if args.fields else None
+			items = site.iter_query(args.entity, conditions, include_fields=fields) if args.all else \
+				site.create_query(args.entity, conditions, fields, all_pages=False)
+			for item in items:
+				print(json.dumps(dict(item), default=str))
+		elif args.command == "export":
+			fields = args.fields.split(",") if args.fields else None
+			print(site.export(args.entity, args.path, conditions, fields))
+		timings.append(("requests", time.perf_counter() - requested))
+		site.close()
+	except APIError as err:
+		print("Autotask error: " + str(err), file=sys.stderr)
+		return 1
+	except OSError as err:
+		# requests' connection errors are OSErrors too
+		print("Request failed: " + str(err), file=sys.stderr)
+		return 1
+	finally:
+		if args.timing:
+			timings.append(("total", time.perf_counter() - STARTED))
+			print("  ".join("%s %.1f ms" % (label, seconds * 1000) for label, seconds in timings), file=sys.stderr)
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
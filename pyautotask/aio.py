@@ -0,0 +1,158 @@
+"""
+asyncio client to interact with Autotask API
+"""
+import asyncio
+import inspect
+import time
+
+from .atsite import IDEMPOTENT_METHODS, MIN_WINDOW, atSiteBase
+
+try:
+	import aiohttp
+except ImportError:
+	aiohttp = None
+
+
+class AsyncAtSite(atSiteBase):
+
+	"""Interact with a Autotask API from an asyncio event loop.
+
+	Has the same entity methods as atSite, they return coroutines instead.
+	>>> async with AsyncAtSite(host, username, password, code) as site:
+	...	 results = await asyncio.gather(*[
+	...		 site.ci_push_by_serialNumber(*device) for device in devices])
+
+	"""
+
+	def __init__(self, *args, max_concurrency=None, **kwargs):
+		"""
+		Takes the same arguments as atSite, plus
+		:param max_concurrency: requests in flight at once, defaults to max_threads.
+			Extra calls wait for a free slot, so any number can be gathered.
+		"""
+		if aiohttp is None:
+			raise ImportError("AsyncAtSite needs aiohttp, install pyautotask[async]")
+		super().__init__(*args, **kwargs)
+		self.max_concurrency = max_concurrency or self.max_threads
+		self.session = None
+		self._slots = None
+
+	async def __aenter__(self):
+		return self
+
+	async def __aexit__(self, *exc):
+		await self.close()
+
+	async def close(self):
+		"""Close the pooled connections"""
+		if self.session is not None:
+			await self.session.close()
+			self.session = None
+
+	def _open(self):
+		# aiohttp sessions have to be made inside the running loop
+		if self.session is None or self.session.closed:
+			connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+			connect, read = self.scheduler.timeout
+			timeout = aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+			self.session = aiohttp.ClientSession(connector=connector, headers=self.headers, timeout=timeout)
+			self._slots = asyncio.Semaphore(self.max_concurrency)
+		return self.session
+
+	@staticmethod
+	async def _run(flow_gen):
+		# await each call yielded by the flow and send its result back
+		try:
+			pending = flow_gen.send(None)
+			while True:
+				try:
+					value = await pending if inspect.isawaitable(pending) else pending
+				except Exception as err:  # pylint: disable=broad-except
+					pending = flow_gen.throw(err)
+				else:
+					pending = flow_gen.send(value)
+		except StopIteration as done:
+			return done.value
+
+	async def _request(self, method, url, decode, idempotent=None, **kwargs):
+		# same policy as RequestScheduler.call, with asyncio sleeps and slots
+		if idempotent is None:
+			idempotent = method in IDEMPOTENT_METHODS
+		session = self._open()
+		scheduler = self.scheduler
+		attempt = 0
+		while True:
+			await asyncio.sleep(scheduler.pace())
+			async with self._slots:
+				started = time.perf_counter()
+				try:
+					async with session.request(method, url, **kwargs) as response:
+						body = await response.read()
+				except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+					if self.metrics is not None:
+						self._record(method, url, None, time.perf_counter() - started, error=err)
+					if not idempotent or attempt >= scheduler.retries:
+						raise
+					delay = scheduler.delay(attempt)
+				else:
+					if self.metrics is not None:
+						self._record(method, url, response.status, time.perf_counter() - started, len(body))
+					delay = scheduler.check(response.status, response.headers, body, idempotent, attempt)
+					if delay is None:
+						return decode(body)
+			attempt += 1
+			scheduler.count_retry()
+			await asyncio.sleep(delay)
+
+	# deferred updates need atSite's write-behind thread, here they are always sent straight away
+	def update_ci_udf(self, ci_id, product_id, udf, current=None):
+		"""See atSite.update_ci_udf"""
+		return super().update_ci_udf(ci_id, product_id, udf, current)
+
+	def update_ci_just_udf(self, c_id, ci_id, udf):
+		"""See atSite.update_ci_just_udf"""
+		return super().update_ci_just_udf(c_id, ci_id, udf)
+
+	def update_company_udf(self, cid: str, udf, current=None):
+		"""See atSite.update_company_udf"""
+		return super().update_company_udf(cid, udf, current)
+
+	async def iter_pages(self, url, filter_fields=None, include_fields=None):
+		"""Lazily run a query, yielding each page of items as it arrives"""
+		items, next_url = await self._query_page(url, self._query_body(filter_fields, include_fields))
+		yield items
+		while next_url:
+			items, next_url = await self._read_page(next_url)
+			yield items
+
+	async def iter_query(self, url, filter_fields=None, include_fields=None):
+		"""Lazily run a query, yielding every item across all pages"""
+		async for page in self.iter_pages(url, filter_fields, include_fields):
+			for item in page:
+				yield item
+
+	async def query_windowed(  # pylint: disable=r0913
+			self, url, field, start, end, filter_fields=None, include_fields=None,
+			windows=None, min_window=MIN_WINDOW, start_op="gte"):
+		"""Run a date range query as concurrent time windows, see atSite.query_windowed
+
+		Windows run as tasks, the site's max_concurrency caps the requests in flight.
+		"""
+		def start_window(window, op):
+			return asyncio.ensure_future(
+				self._query_window(url, field, window, filter_fields, include_fields, min_window, op))
+
+		results = []
+		pending = {start_window(window, op)
+				   for window, op in self._windows(start, end, windows or self.max_concurrency, start_op)}
+		try:
+			while pending:
+				done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+				for task in done:
+					items, split = task.result()
+					results.append(items)
+					pending.update(start_window(window, op) for window, op in split)
+		finally:
+			for task in pending:
+				task.cancel()
+		return self._merge_windows(results, field)
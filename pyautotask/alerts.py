@@ -0,0 +1,142 @@
+"""
+Alert ticket creation without a duplicate lookup per alert
+"""
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime
+
+from .query import Param, Query, eq, gte, noteq
+
+# Autotask's built in Complete ticket status
+COMPLETE_STATUS = "5"
+
+# fields the index needs, keeps the loads small
+INDEX_FIELDS = ["id", "ticketNumber", "configurationItemID", "title", "status", "queueID", "lastActivityDate"]
+
+OPEN_TICKETS = Query(eq("queueID", Param("queue")), noteq("status", COMPLETE_STATUS), include_fields=INDEX_FIELDS)
+CHANGED_TICKETS = Query(eq("queueID", Param("queue")), gte("lastActivityDate", Param("since")),
+						include_fields=INDEX_FIELDS)
+
+
+class AlertTicketEngine:
+
+	"""Create alert tickets for a queue, at most one open ticket per CI and title
+
+	The open tickets of the queue are loaded once into an index keyed by
+	(configurationItemID, title), then kept current by fetching only the
+	tickets active since the last refresh. Alerts matching an open ticket
+	cost no API call, and duplicates arriving while their ticket is still
+	being created wait for that one create instead of making their own.
+	>>> engine = site.alert_tickets(queue_id="8")
+	>>> engine.send("Network device Down!", "Device is not responding", company_id, ci_id)
+
+	Safe to share between threads.
+	"""
+
+	def __init__(self, site, queue_id="8", refresh_interval=60, defaults=None):
+		"""
+		:param site: atSite to create the tickets on
+		:param queue_id: queue the alert tickets go in
+		:param refresh_interval: seconds the index is trusted before a refresh
+		:param defaults: ticket fields overriding the ones send_alert_ticket uses
+		"""
+		self.site = site
+		self.queue_id = str(queue_id)
+		self.refresh_interval = refresh_interval
+		self.defaults = {'issueType': "14", 'priority': "1", 'source': "8", 'status': "1"}
+		self.defaults.update(defaults or {})
+		# alerts answered without a create, and tickets created
+		self.coalesced = 0
+		self.created = 0
+		self._index = {}
+		self._pending = {}
+		self._lock = threading.Lock()
+		self._refresh_lock = threading.Lock()
+		self._watermark = None
+		self._refreshed = None
+
+	@staticmethod
+	def _key(ci_id, title):
+		return str(ci_id), title
+
+	def load(self):
+		"""Load every open ticket of the queue into the index"""
+		started = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.000Z")
+		index = {}
+		newest = None
+		for ticket in self.site.iter_query("Tickets", OPEN_TICKETS(queue=self.queue_id)):
+			index[self._key(ticket.get('configurationItemID'), ticket.get('title'))] = ticket
+			newest = max(filter(None, (newest, ticket.get('lastActivityDate'))), default=None)
+		with self._lock:
+			self._index = index
+			self._watermark = newest or started
+			self._refreshed = time.monotonic()
+
+	def refresh(self, force=False):
+		"""Apply tickets created, updated or completed since the last refresh"""
+		with self._refresh_lock:
+			if self._refreshed is None:
+				self.load()
+				return
+			if not force and time.monotonic() - self._refreshed < self.refresh_interval:
+				return
+			newest = self._watermark
+			changed = list(self.site.iter_query("Tickets", CHANGED_TICKETS(queue=self.queue_id, since=self._watermark)))
+			with self._lock:
+				for ticket in changed:
+					key = self._key(ticket.get('configurationItemID'), ticket.get('title'))
+					if str(ticket.get('status')) == COMPLETE_STATUS:
+						self._index.pop(key, None)
+					else:
+						self._index[key] = ticket
+					newest = max(filter(None, (newest, ticket.get('lastActivityDate'))))
+				self._watermark = newest
+				self._refreshed = time.monotonic()
+
+	def send(self, title, description, company_id, ci_id, **fields):
+		"""Create an alert ticket unless the CI already has one open with title
+		:param fields: extra ticket fields, overriding the defaults
+		:returns: the open ticket, either the existing one or the one created
+			with its id set
+		"""
+		self.refresh()
+		key = self._key(ci_id, title)
+		with self._lock:
+			ticket = self._index.get(key)
+			if ticket is not None:
+				self.coalesced += 1
+				return ticket
+			pending = self._pending.get(key)
+			if pending is None:
+				pending = self._pending[key] = Future()
+				owner = True
+			else:
+				self.coalesced += 1
+				owner = False
+		if not owner:
+			return pending.result()
+
+		params = dict(self.defaults)
+		params.update({
+			'companyID': company_id,
+			'configurationItemID': ci_id,
+			'description': description,
+			'queueID': self.queue_id,
+			'title': title,
+		})
+		params.update(fields)
+		try:
+			response = self.site.add_ticket(params)
+		except Exception as err:
+			with self._lock:
+				del self._pending[key]
+			pending.set_exception(err)
+			raise
+		ticket = dict(params, id=response.get('itemId'))
+		with self._lock:
+			self._index[key] = ticket
+			del self._pending[key]
+			self.created += 1
+		pending.set_result(ticket)
+		return ticket
@@ -2,13 +2,48 @@
 """
 Python package to interact with Autotask API
 """
-import shutil
 import time
-import warnings
 import json
+import contextvars
+import functools
 import logging
-import requests
-from datetime import datetime, timedelta
+import queue
+import threading
+import os
+import urllib.parse
+from .alerts import AlertTicketEngine
+from .cache import MISSING, DiskCache, MemoryCache
+from .metadata import Picklist
+from .metrics import RequestEvent, RequestMetrics
+from .records import compact
+from .query import BoundQuery, Filter, Param, Query, eq, exist
+from .scheduler import RequestScheduler
+from .writes import WriteBehindQueue
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+
+
+@functools.lru_cache(maxsize=None)
+def _json_decoder():
+	"""json.loads, or orjson's when it is installed, imported on the first response"""
+	try:
+		# optional, decodes large pages several times faster
+		import orjson  # pylint: disable=import-outside-toplevel
+		return orjson.loads
+	except ImportError:
+		return json.loads
+
+
+def _json_loads(data):
+	return _json_decoder()(data)
+
+
+@functools.lru_cache(maxsize=None)
+def _connection_errors():
+	"""requests' exceptions worth retrying a request after, imported on the first request"""
+	import requests  # pylint: disable=import-outside-toplevel
+	return (requests.ConnectionError, requests.Timeout)
+
 
 DEBUGGING = 0
 
@@ -33,28 +68,152 @@ logging.basicConfig(filename='pyunifi.log', level=logging.WARN,
 """  # pylint: disable=W0105
 CONS_LOG = logging.getLogger(__name__)
 
+# Autotask allows 3 concurrent threads per integration code per entity
+MAX_THREADS = 3
+
+# methods retried after errors, every PATCH here sets absolute values
+IDEMPOTENT_METHODS = ("GET", "PATCH")
+
+ACTIVE_FILTER = '{"op":"eq","field":"isActive","value":"1"}'
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# fields the CI push helpers write, and so all they need to fetch to diff against
+CI_PUSH_FIELDS = ["id", "configurationItemCategoryID", "companyID", "configurationItemType", "isActive",
+				  "productID", "referenceTitle", "serialNumber", "dattoHostname", "userDefinedFields"]
+
+# lookups made once per device or alert, compiled once
+CI_BY_SERIAL = Query(eq("serialNumber", Param("serial")))
+CI_BY_ID = Query(eq("id", Param("id")))
+CI_TO_PUSH_BY_SERIAL = Query(eq("serialNumber", Param("serial")), include_fields=CI_PUSH_FIELDS)
+# whole tickets, send_alert_ticket returns them to the caller
+TICKET_BY_CI_AND_TITLE = Query(eq("configurationItemID", Param("ci_id")), eq("title", Param("title")))
+
+# values per 'in' filter, keeps query urls well under server limits
+IN_FILTER_SIZE = 200
+
+_DONE = object()
+
+# narrowest window query_windowed splits a dense date range into
+MIN_WINDOW = timedelta(hours=1)
+
+# seconds reference data lookups stay cached, per entity
+CACHE_TTLS = {
+	"ConfigurationItemTypes": 24 * 3600,
+	"ConfigurationItemCategories": 24 * 3600,
+	"HolidaySets": 24 * 3600,
+	"Products": 6 * 3600,
+	"Roles": 6 * 3600,
+	"Resources": 3600,
+	"entityInformation": 24 * 3600,
+}
+DEFAULT_CACHE_TTL = 3600
+
+# answers which zone, and so which host, a user's database lives in
+ZONE_INFO_URL = "https://webservices.autotask.net/ATServicesRest/V1.0/zoneInformation"
+ZONE_CACHE_PATH = os.path.join(
+	os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+	"pyautotask", "zones.db")
+ZONE_CACHE_TTL = 7 * 24 * 3600
+
+
+def _put(buffer, item, stop):
+	"""Put item into a bounded buffer, giving up once stop is set"""
+	while not stop.is_set():
+		try:
+			buffer.put(item, timeout=0.1)
+			return True
+		except queue.Full:
+			continue
+	return False
+
+
+def _fill(pages, buffer, stop):
+	"""Move pages into buffer, ending with _DONE and any exception raised"""
+	try:
+		for page in pages:
+			if not _put(buffer, (page, None), stop):
+				return
+	except Exception as err:  # pylint: disable=broad-except
+		_put(buffer, (_DONE, err), stop)
+		return
+	_put(buffer, (_DONE, None), stop)
+
+
+def _drain(buffer):
+	"""Yield pages from a buffer filled by _fill, re-raising its errors"""
+	while True:
+		page, err = buffer.get()
+		if page is _DONE:
+			if err is not None:
+				raise err
+			return
+		yield page
+
+
+def _in_context(fn):
+	"""Return fn running in a copy of the caller's context, for worker threads
+
+	Keeps RequestMetrics.operation set in the threads doing the requests.
+	"""
+	context = contextvars.copy_context()
+	return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
+
 
 class APIError(Exception):
 	"""API Error exceptions"""
 
 
-class atSite:
+def flow(method):
+	"""Write an entity method once for both the sync and async clients
 
-	"""Interact with a Autotask API.
-
-	All this is stolen from pyUnifi. Any cleverness in this code is from them,
-	any mistakes are my own.
+	The method is a generator that yields every call it makes on the site
+	and is sent back the result. atSite runs the calls as they are made,
+	AsyncAtSite awaits them, so the control flow lives in one place.
+	"""
+	@functools.wraps(method)
+	def wrapper(self, *args, **kwargs):
+		return self._run(method(self, *args, **kwargs))
+	return wrapper
 
-	Will attempt to fix this example when I understand the code better
-	>>> from unifi.controller import Controller
-	>>> c = Controller('192.168.1.99', 'admin', 'p4ssw0rd')
-	>>> for ap in c.get_aps():
-	...	 print 'AP named %s with MAC %s' % (ap.get('name'), ap['mac'])
-	...
-	AP named Study with MAC dc:9f:db:1a:59:07
-	AP named Living Room with MAC dc:9f:db:1a:59:08
-	AP named Garage with MAC dc:9f:db:1a:59:0b
 
+def discover_zone(username, zone_url=ZONE_INFO_URL, cache_path=ZONE_CACHE_PATH, ttl=ZONE_CACHE_TTL):
+	"""Return the REST url of the zone username's database is in
+	:param cache_path: DiskCache file to keep answers in for ttl seconds, None to skip it
+	"""
+	cache = DiskCache(cache_path) if cache_path else None
+	key = "zoneInformation:" + zone_url + ":" + username
+	try:
+		if cache is not None:
+			base_url = cache.get(key)
+			if base_url is not MISSING:
+				return base_url
+		# only cold starts look zones up, keep urllib.request off the import path
+		import urllib.request  # pylint: disable=import-outside-toplevel
+		url = zone_url + "?" + urllib.parse.urlencode({"user": username})
+		try:
+			with urllib.request.urlopen(url, timeout=30) as response:
+				zone = json.loads(response.read())
+		except (OSError, ValueError) as err:
+			raise APIError("Zone lookup for " + username + " failed: " + str(err)) from err
+		if not zone.get("url"):
+			raise APIError("No zone for " + username + ": " + str(zone))
+		# zoneInformation gives the api root, ie https://webservices15.autotask.net/ATServicesRest/
+		base_url = zone["url"].rstrip("/") + "/V1.0/"
+		if cache is not None:
+			cache.set(key, base_url, ttl)
+		return base_url
+	finally:
+		if cache is not None:
+			cache.close()
+
+
+class atSiteBase:
+
+	"""Request building and entity methods shared by atSite and AsyncAtSite
+
+	Subclasses provide the transport with _request and run @flow methods
+	with _run.
 	"""
 
 	def __init__(  # pylint: disable=r0913
@@ -62,16 +221,38 @@ class atSite:
             host,
             username,
             password,
-            interactioncode
+            interactioncode,
+            all_pages=False,
+            max_threads=MAX_THREADS,
+            cache=None,
+            cache_ttls=None,
+            scheduler=None,
+            base_url=None,
+            compact_records=False,
+            metrics=None
 	):
 		"""
 		:param host: the site you are hosted on
 		:param username: api user created within Autotask
 		:param password: api password created within Autotask
 		:param interactioncode: API Interactioncode you get from within Autotask
+		:param all_pages: follow nextPageUrl in list returning queries by default
+		:param max_threads: cap on concurrent requests for the parallel helpers,
+			keep it within Autotask's per integration thread limit
+		:param cache: cache for reference data lookups, defaults to a MemoryCache,
+			pass a cache.DiskCache to keep it across restarts or False to disable
+		:param cache_ttls: dict of entity to seconds, overriding CACHE_TTLS
+		:param scheduler: RequestScheduler pacing and retrying every request,
+			defaults to one capped at max_threads concurrent requests
+		:param base_url: full REST url, ie "https://webservices15.autotask.net/ATServicesRest/V1.0/",
+			used instead of one built from host
+		:param compact_records: return query results as read-only CompactRecords,
+			which take a fraction of the memory of dicts for large result sets
+		:param metrics: metrics.RequestMetrics recording every request, defaults
+			to a new one, False to disable
 		"""
 
-		self.log = logging.getLogger(__name__ + ".atSite")
+		self.log = logging.getLogger(__name__ + "." + type(self).__name__)
 
 		self.host = host
 		self.headers = {"ApiIntegrationCode": interactioncode,
@@ -79,25 +260,66 @@ class atSite:
 		self.username = username
 		self.password = password
 		self.interactioncode = interactioncode
-		self.url = "https://" + host + "/ATServicesRest/V1.0/"
+		self.all_pages = all_pages
+		self.max_threads = max_threads
+		# writes left out because the record already matched
+		self.skipped_writes = 0
+		self._skipped_lock = threading.Lock()
+		if cache is None:
+			cache = MemoryCache()
+		self.cache = cache if cache is not False else None
+		self.cache_ttls = dict(CACHE_TTLS, **(cache_ttls or {}))
+		self.scheduler = scheduler or RequestScheduler(max_concurrent=max_threads)
+		self.compact_records = compact_records
+		self._schemas = {}
+		self._picklists = {}
+		if metrics is None:
+			metrics = RequestMetrics()
+		self.metrics = metrics if metrics is not False else None
+		if base_url:
+			self.url = base_url.rstrip("/") + "/"
+		else:
+			self.url = "https://" + host + "/ATServicesRest/V1.0/"
 		# I don't think we need an auth url
 		# self.auth_url = self.url + "api/login"
 
 		self.log.debug("Controller for %s", self.url)
 		# self._login()
-		self.session = requests.Session()
+
+	@classmethod
+	def from_zone(  # pylint: disable=r0913
+			cls, username, password, interactioncode,
+			zone_url=ZONE_INFO_URL, cache_path=ZONE_CACHE_PATH, ttl=ZONE_CACHE_TTL, **kwargs):
+		"""Create a site on the zone Autotask reports for username
+
+		The zone is cached on disk for ttl seconds, so later startups skip
+		the lookup.
+		:param zone_url: zoneInformation endpoint, override to point at a local stand-in
+		:param cache_path: zone cache file, None to always look it up
+		"""
+		base_url = discover_zone(username, zone_url, cache_path, ttl)
+		host = urllib.parse.urlsplit(base_url).netloc
+		return cls(host, username, password, interactioncode, base_url=base_url, **kwargs)
 
 	# This looks like an error detection fuction for returning data.
 	# need to adjust to fix AT
 	@staticmethod
-	def _jsondec(data):
-		obj = json.loads(data)
+	def _jsondec_obj(data):
+		# data is the raw response body, decoding it as bytes skips building a str first
+		try:
+			obj = _json_loads(data)
+		except ValueError:
+			# throttling and gateway errors can come back as html
+			if isinstance(data, bytes):
+				data = data.decode("utf-8", "replace")
+			raise APIError("Response is not JSON: " + data[:200]) from None
 		if "errors" in obj:
 			raise APIError(obj["errors"])
-# TODO Have to deal with multipages
-# 'pageDetails': {'count': 500, 'requestCount': 500, 'prevPageUrl': None, 'nextPageUrl': 'https://webservices15.autotask.net/ATServicesRest/V1.0/Companies/query/next?paging=%7b%22pageSize%22%3a500%2c%22previousIds%22%3a%5b-1%5d%2c%22nextIds%22%3a%5b725%5d%7d&search=%7b%27filter%27%3a%5b%7b%27op%27%3a%27exist%27%2c%27field%27%3a%27IsActive%27%7d%5d%7d'}}
-# if "pageDetails" in obj:
-# raise APIError(obj["pageDetails"]["nextPageUrl"])
+		return obj
+
+	@staticmethod
+	def _jsondec(data):
+		obj = atSiteBase._jsondec_obj(data)
 		if "items" in obj:
 			result = obj["items"]
 		else:
@@ -105,149 +327,506 @@ class atSite:
 
 		return result
 
+	@staticmethod
+	def _next_page_url(obj):
+		"""Return the nextPageUrl of a decoded query response, or None"""
+		page_details = obj.get("pageDetails") or {}
+		return page_details.get("nextPageUrl")
+
+	@staticmethod
+	def _jsondec_page(data):
+		"""Decode one page of a query
+		:returns: tuple of the page's items and the nextPageUrl (None on the last page)
+		"""
+		obj = atSiteBase._jsondec_obj(data)
+		return obj.get("items", []), atSiteBase._next_page_url(obj)
+
+	def _decode_items(self, data):
+		"""_jsondec for query results, applying compact_records"""
+		items = self._jsondec(data)
+		if self.compact_records and isinstance(items, list):
+			return compact(items, self._schemas)
+		return items
+
+	def _decode_page(self, data):
+		"""_jsondec_page applying compact_records"""
+		items, next_url = self._jsondec_page(data)
+		if self.compact_records:
+			items = compact(items, self._schemas)
+		return items, next_url
+
 	# This section is more direct API calls
 
+	def _request(self, method, url, decode, idempotent=None, **kwargs):
+		"""Send a request through the scheduler and return decode(response body)
+		:param idempotent: safe to retry after errors, defaults by method
+		"""
+		raise NotImplementedError
+
+	def _run(self, flow_gen):
+		"""Run a @flow generator to completion"""
+		raise NotImplementedError
+
+	def _record(self, method, url, status, latency, size=0, error=None):
+		"""Pass a RequestEvent for one HTTP attempt to the site's metrics"""
+		path = url[len(self.url):].split("?")[0] if url.startswith(self.url) else ""
+		parts = path.split("/")
+		if "query" in parts:
+			verb = "count" if parts[-1] == "count" else "query"
+		else:
+			verb = method
+		pages = 1 if verb == "query" and status is not None and status < 400 else 0
+		self.metrics.record(RequestEvent(parts[0], verb, method, url, status, latency, size, pages, error, None))
+
 	def _read(self, url):
-		# Try block to handle the unifi server being offline.
-		response = self.session.get(url, headers=self.headers)
-		return self._jsondec(response.text)
+		return self._request("GET", url, self._jsondec)
 
 	def _api_read(self, url):
 		return self._read(self.url + url)
 
+	def _read_page(self, url):
+		return self._request("GET", url, self._decode_page)
+
+	def _invalidate(self, url):
+		"""Drop cached lookups of the entity a write to url touches"""
+		if self.cache is not None and url.startswith(self.url):
+			self.cache.invalidate(url[len(self.url):].split("/")[0])
+
+	@flow
+	def _cached(self, entity, key, call):
+		"""Return the cached result of a lookup, or call() and cache it
+		:param entity: entity the lookup reads, writes to it invalidate the result
+		:param key: identifies the lookup within entity
+		"""
+		if self.cache is None:
+			return (yield call())
+		cache_key = entity + ":" + key
+		value = self.cache.get(cache_key)
+		if value is MISSING:
+			value = yield call()
+			self.cache.set(cache_key, value, self.cache_ttls.get(entity, DEFAULT_CACHE_TTL))
+		return value
+
 	def _write(self, url, params=None):
-		response = self.session.post(url, data=params, headers=self.headers)
-		return self._jsondec(response.text)
+		self._invalidate(url)
+		# the REST api only takes JSON bodies, like _update
+		return self._request("POST", url, self._jsondec, json=params)
 
 	def _api_write(self, url, params=None):
 		return self._write(self.url + url, params)
 
 	def _update(self, url, params=None):
+		self._invalidate(url)
 		# response = self.session.patch(url, data=params, headers=self.headers)
-		response = self.session.patch(url, json=params, headers=self.headers)
-		return self._jsondec(response.text)
+		return self._request("PATCH", url, self._jsondec, json=params)
 
 	def _api_update(self, url, params=None):
 		return self._update(self.url + url, params)
 
+	def write_behind(self, **kwargs):
+		"""Return the site's WriteBehindQueue, see atSite.write_behind"""
+		raise NotImplementedError(type(self).__name__ + " has no write-behind queue")
+
+	def _api_update_deferred(self, url, params, deferred=False):
+		"""_api_update, or queue it on write_behind() and return a Future when deferred"""
+		if deferred:
+			return self.write_behind().update(url, params)
+		return self._api_update(url, params)
+
+	@staticmethod
+	def _unchanged(item_id, deferred=False):
+		"""Response for an update left out because nothing changed"""
+		response = {'itemId': item_id}
+		if deferred:
+			future = Future()
+			future.set_result(response)
+			return future
+		return response
+
+	# Entity information
+	def get_entity_fields(self, entity):
+		"""Return the field definitions of entity, cached for the entityInformation ttl"""
+		return self._cached("entityInformation", entity + "/fields",
+							lambda: self._api_read(entity + "/entityInformation/fields"))
+
+	def get_entity_udfs(self, entity):
+		"""Return the User Defined Field definitions of entity, cached like get_entity_fields"""
+		return self._cached("entityInformation", entity + "/userDefinedFields",
+							lambda: self._api_read(entity + "/entityInformation/userDefinedFields"))
+
+	@flow
+	def picklist(self, entity, field, udf=False):
+		"""Return the Picklist of a field, built once per entityInformation ttl
+		:param udf: field is a User Defined Field
+		"""
+		key = (entity, field, udf)
+		cached = self._picklists.get(key)
+		if cached is not None and cached[0] > time.monotonic():
+			return cached[1]
+		fields = yield (self.get_entity_udfs(entity) if udf else self.get_entity_fields(entity))
+		picklist = Picklist.from_fields(entity, fields, field)
+		ttl = self.cache_ttls.get("entityInformation", DEFAULT_CACHE_TTL)
+		self._picklists[key] = (time.monotonic() + ttl, picklist)
+		return picklist
+
+	@flow
+	def picklist_value(self, entity, field, label, udf=False):
+		"""Return the value of the picklist entry labelled label"""
+		picklist = yield self.picklist(entity, field, udf)
+		return picklist.value(label)
+
+	def _picklist_id(self, entity, field, value):
+		"""Return value as is when it is already an id, else the value its label maps to"""
+		if str(value).isdigit():
+			# yielding a plain value hands it straight back in either client
+			return str(value)
+		return self.picklist_value(entity, field, value)
+
+	@flow
+	def picklist_label(self, entity, field, value, udf=False):
+		"""Return the label of the picklist entry with value"""
+		picklist = yield self.picklist(entity, field, udf)
+		return picklist.label(value)
+
 
 # Deprecated fuction
 
 
 	def _api_active(self, url):
-		return self._api_read(url + "/query?search={'filter':[{'op':'eq','field':'isActive','value': '1'}]}")
+		return self.create_query(url, ACTIVE_FILTER)
 
-	def create_query(self, url, filter_fields, include_fields=None):
+	@staticmethod
+	def _filter_string(filter_fields):
+		"""Return filters as comma separated JSON conditions, defaulting to active items"""
 		if filter_fields is None:
-			filter_fields = "{'op':'eq','field':'isActive','value': '1'}"
-		if include_fields is None:
-			return self._api_read(url + "/query?search={'filter':[" + filter_fields + "]}")
-		# Need to make something that can deal with the IncludeFields
-# else:
-# return self._api_read(url + "/query?search={'IncludeFields': [" + include_fields + "], 'filter':" + filter_fields + "}")
+			return ACTIVE_FILTER
+		if isinstance(filter_fields, Filter):
+			return filter_fields.render()
+		if isinstance(filter_fields, (list, tuple)):
+			return ",".join(atSiteBase._filter_string(item) for item in filter_fields)
+		if isinstance(filter_fields, (Query, BoundQuery)):
+			raise TypeError("A compiled Query can't be combined with other filters")
+		return filter_fields
+
+	@staticmethod
+	def _query_body(filter_fields, include_fields=None):
+		"""Return the JSON body of a query
+		:param filter_fields: a Query (bound if it has Params), Filters, or
+			create_filter strings joined with ","
+		:param include_fields: list of fields to return, ignored for a Query
+			which carries its own
+		"""
+		if isinstance(filter_fields, (Query, BoundQuery)):
+			return filter_fields.render()
+		body = '{"filter":[' + atSiteBase._filter_string(filter_fields) + ']'
+		if include_fields:
+			body += ',"IncludeFields":' + json.dumps(atSiteBase._field_list(include_fields))
+		return body + '}'
+
+	@staticmethod
+	def _field_list(include_fields):
+		"""Return include_fields as a list, it may be a comma separated string"""
+		if isinstance(include_fields, str):
+			return [field.strip() for field in include_fields.split(",")]
+		return list(include_fields)
+
+	def _query(self, url, body, decode=None):
+		"""POST a query body to entity url, returning the first page"""
+		return self._request("POST", self.url + url + "/query", decode or self._decode_items,
+							 idempotent=True, data=body.encode(), headers=JSON_HEADERS)
+
+	def _query_page(self, url, body):
+		return self._query(url, body, self._decode_page)
+
+	@flow
+	def _collect_pages(self, url, body):
+		"""Run a query and read every following page into one list"""
+		items, next_url = yield self._query_page(url, body)
+		while next_url:
+			page, next_url = yield self._read_page(next_url)
+			items.extend(page)
+		return items
+
+	@staticmethod
+	def _decode_count(data):
+		return int(atSiteBase._jsondec_obj(data).get("queryCount") or 0)
+
+	def count(self, url, filter_fields=None):
+		"""Return how many items of entity url match, without fetching any
+		:param filter_fields: see _query_body, None for active items
+		"""
+		return self._request("POST", self.url + url + "/query/count", self._decode_count,
+							 idempotent=True, data=self._query_body(filter_fields).encode(), headers=JSON_HEADERS)
+
+	@flow
+	def exists(self, url, filter_fields=None):
+		"""Return whether any item of entity url matches, see count"""
+		return (yield self.count(url, filter_fields)) > 0
+
+	def create_query(self, url, filter_fields, include_fields=None, all_pages=None):
+		"""Run a query and return the items as a list
+
+		The query is POSTed as JSON to the entity's /query endpoint.
+		:param filter_fields: see _query_body, None for active items
+		:param include_fields: only return these fields of each item
+		:param all_pages: follow nextPageUrl and return every page instead of
+			just the first 500 items, defaults to the site's all_pages setting
+		"""
+		if all_pages is None:
+			all_pages = self.all_pages
+		body = self._query_body(filter_fields, include_fields)
+		if all_pages:
+			return self._collect_pages(url, body)
+		return self._query(url, body)
 
 	def create_filter(self, op, field, value, udf=None):
+		"""Return one filter condition as JSON, value is escaped"""
 		if udf is None:
-			filter_fields = "{'op': '" + op + "', 'field': '" + \
-				field + "', 'value': '" + value + "'}"
+			filter_fields = {'op': op, 'field': field, 'value': value}
 		else:
-			filter_fields = "{'op': '" + op + "', 'field': '" + \
-				field + "', 'udf': true, 'value': '" + value + "'}"
-		return filter_fields
+			filter_fields = {'op': op, 'field': field, 'udf': True, 'value': value}
+		return json.dumps(filter_fields)
+
+	@staticmethod
+	def create_in_filter(field, values):
+		"""Filter on field matching any of values"""
+		return json.dumps({"op": "in", "field": field, "value": [str(value) for value in values]})
+
+	@staticmethod
+	def id_shards(max_id, shards, min_id=0):
+		"""Split (min_id, max_id] into contiguous id ranges
+		:returns: list of (gt, lte) tuples in ascending order
+		"""
+		step = max(1, -(-(max_id - min_id) // shards))
+		return [(low, min(low + step, max_id)) for low in range(min_id, max_id, step)]
+
+	@staticmethod
+	def parse_date(value):
+		"""Return a date filter value as a naive UTC datetime
+		:param value: datetime, date or ISO 8601 string, ie "2024-01-01" or "2024-01-01T08:00:00Z"
+		"""
+		if isinstance(value, str):
+			value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+		elif not isinstance(value, datetime):
+			value = datetime(value.year, value.month, value.day)
+		if value.tzinfo is not None:
+			value = value.astimezone(timezone.utc).replace(tzinfo=None)
+		return value
+
+	@staticmethod
+	def format_date(value):
+		"""Return a naive UTC datetime as an Autotask filter value"""
+		return value.strftime("%Y-%m-%dT%H:%M:%S.") + "%03dZ" % (value.microsecond // 1000)
+
+	@staticmethod
+	def time_windows(start, end, windows):
+		"""Split [start, end) into contiguous datetime windows
+		:returns: list of (gte, lt) tuples in ascending order
+		"""
+		step = (end - start) / max(1, windows)
+		bounds = [start + step * window for window in range(windows)] + [end]
+		return [(low, high) for low, high in zip(bounds, bounds[1:]) if low < high]
+
+	@flow
+	def _query_window(  # pylint: disable=r0913
+			self, url, field, window, filter_fields, include_fields, min_window, start_op):
+		"""Run the query for one window, or split it when it is too dense
+		:returns: (items, sub-windows), the window is split in two instead of
+			paged through when its first page is full and it is wider than min_window
+		"""
+		low, high = window
+		# like fan_out, no filters means no extra ones, not the active items default
+		extra = "" if filter_fields is None else self._filter_string(filter_fields) + ","
+		window_filter = extra + self.create_filter(start_op, field, self.format_date(low)) + "," + \
+			self.create_filter("lt", field, self.format_date(high))
+		if include_fields:
+			# _merge_windows orders the items by field and id
+			include_fields = list(dict.fromkeys(self._field_list(include_fields) + [field, "id"]))
+		items, next_url = yield self._query_page(url, self._query_body(window_filter, include_fields))
+		if next_url and high - low > min_window:
+			middle = low + (high - low) / 2
+			return [], [((low, middle), start_op), ((middle, high), "gte")]
+		while next_url:
+			page, next_url = yield self._read_page(next_url)
+			items.extend(page)
+		return items, []
+
+	@staticmethod
+	def _merge_windows(results, field):
+		"""Merge the items of every window, once per id, in field order"""
+		merged = {}
+		for items in results:
+			for item in items:
+				merged.setdefault(item.get("id"), item)
+		return sorted(merged.values(), key=lambda item: (item.get(field) or "", item.get("id") or 0))
+
+	def _windows(self, start, end, windows, start_op):
+		"""Return the first windows of a query_windowed call, each with its start op"""
+		start, end = self.parse_date(start), self.parse_date(end)
+		return [(window, start_op if window[0] == start else "gte")
+				for window in self.time_windows(start, end, windows or self.max_threads)]
+
+	@staticmethod
+	def _same_value(current, desired):
+		if current == desired:
+			return True
+
+		def norm(value):
+			if value is None:
+				return ""
+			if isinstance(value, bool):
+				return str(value).lower()
+			return str(value)
+		current, desired = norm(current), norm(desired)
+		if current == desired:
+			return True
+		try:
+			return float(current) == float(desired)
+		except ValueError:
+			return False
+
+	@staticmethod
+	def diff_fields(current, desired):
+		"""Return the entries of desired whose value differs from current"""
+		return {field: value for field, value in desired.items()
+				if field != 'userDefinedFields'
+				and not atSiteBase._same_value(current.get(field), value)}
+
+	@staticmethod
+	def diff_udfs(current, desired):
+		"""Return the desired User Defined Fields whose value differs from current
+		:param current: userDefinedFields list from a fetched record
+		:param desired: userDefinedFields list to push
+		"""
+		values = {udf['name']: udf.get('value') for udf in current or []}
+		return [udf for udf in desired
+				if udf['name'] not in values
+				or not atSiteBase._same_value(values[udf['name']], udf.get('value'))]
+
+	def _changed_params(self, current, params, udf=None):
+		"""Reduce params, and udf, to what differs from the fetched record current
+		:returns: params to PATCH including current's id, or None if nothing changed
+		"""
+		changes = self.diff_fields(current, params)
+		changes.pop('id', None)
+		if udf is not None:
+			udf_changes = self.diff_udfs(current.get('userDefinedFields'), udf)
+			if udf_changes:
+				changes['userDefinedFields'] = udf_changes
+		if not changes:
+			with self._skipped_lock:
+				self.skipped_writes += 1
+			return None
+		changes['id'] = current['id']
+		return changes
 
 	# end user fuctions
 
 	def get_product_by_name(self, name):
 		filter_fields = self.create_filter("eq", "name", name)
-		return self.get_products(filter_fields)
+		return self._cached("Products", "name=" + name, lambda: self.get_products(filter_fields))
 
 	def get_product_by_sku(self, sku):
-		return self._api_read("Products/query?search={'filter':[{'op':'eq','field':'sku', 'value': '" + sku + "'}]}")
+		filter_fields = self.create_filter("eq", "sku", sku)
+		return self._cached("Products", "sku=" + sku, lambda: self.get_products(filter_fields))
 
-	def get_products(self, filter_fields=None, include_fields=None):
+	def get_products(self, filter_fields=None, include_fields=None, all_pages=None):
 		"""Return a list of all active Products"""
-		return self.create_query("Products", filter_fields, include_fields)
+		return self.create_query("Products", filter_fields, include_fields, all_pages)
 
-	def get_all_todos(self):
+	def get_all_todos(self, all_pages=None):
 		"""Return a list of all Appointments, past, present and future"""
-		return self._api_read("Appointments" + "/query?search={'filter':[{'op':'exist','field':'startDateTime'}]}")
+		return self.create_query("Appointments", exist("startDateTime"), all_pages=all_pages)
 
-	def get_alerts(self):
+	def get_alerts(self, all_pages=None):
 		"""Return a list of all Alerts for Companies"""
-		return self._api_read("CompanyAlerts" + "/query?search={'filter':[{'op':'exist','field':'id'}]}")
+		return self.create_query("CompanyAlerts", exist("id"), all_pages=all_pages)
 
 	# Companies
-	def get_companies(self, filter_fields=None, include_fields=None):
+	def get_companies(self, filter_fields=None, include_fields=None, all_pages=None):
 		"""Return a list of all active Companies"""
-		return self.create_query("Companies", filter_fields, include_fields)
+		return self.create_query("Companies", filter_fields, include_fields, all_pages)
 
-	def update_company_udf(self, cid: str, udf):
+	@flow
+	def update_company_udf(self, cid: str, udf, current=None, deferred=False):
+		"""
+		:param current: the Company as already fetched, if given only changed
+			User Defined Fields are sent and nothing at all when none changed
+		:param deferred: queue the update on the site's write_behind() queue,
+			merging it with other pending updates of the Company, and return a Future
+		"""
 		params = {"id": cid, "isActive": True}
+		if current is not None:
+			params = self._changed_params(current, params, udf)
+			if params is None:
+				return self._unchanged(current['id'], deferred)
+			return (yield self._api_update_deferred("Companies", params, deferred))
 		params_udf = {"userDefinedFields": udf}
 		params.update(params_udf)
-		return self._api_update("Companies", params)
+		return (yield self._api_update_deferred("Companies", params, deferred))
 
-	def get_companies_alerts(self, filter_fields=None, include_fields=None):
-		return self.create_query("CompanyAlerts", filter_fields, include_fields)
+	def get_companies_alerts(self, filter_fields=None, include_fields=None, all_pages=None):
+		return self.create_query("CompanyAlerts", filter_fields, include_fields, all_pages)
 
 	def get_company_alerts(self, cid: str):
 		return self._api_read("Companies/" + str(cid) + "/Alerts")
 
+	@flow
 	def push_companies_alerts(self, cid, params):
-		test = self.get_company_alerts(cid)
+		test = yield self.exists("CompanyAlerts", eq("companyID", str(cid)))
 # print(test)
 		if test:
 			print("True")
 # return self._api_update("Companies/" + str(cid) + "/Alerts", params)
 		else:
 			print("False")
-			return self._api_write("Companies/" + str(cid) + "/Alerts", params)
+			return (yield self._api_write("Companies/" + str(cid) + "/Alerts", params))
 
 	# Configuration Items
 
 	def get_ci_by_serial(self, serial):
-		filter_fields = self.create_filter("eq", "serialNumber", serial)
-		return self.get_cis(filter_fields)
+		return self.get_cis(CI_BY_SERIAL(serial=serial))
 
 	def get_ci_by_id(self, ci_id):
-		filter_fields = self.create_filter("eq", "id", ci_id)
-		return self.get_cis(filter_fields)
+		return self.get_cis(CI_BY_ID(id=ci_id))
 
-	def get_cis(self, filter_fields=None, include_fields=None):
+	def get_cis(self, filter_fields=None, include_fields=None, all_pages=None):
 		"""Return a list of all ConfigurationItems"""
-		return self.create_query("ConfigurationItems", filter_fields, include_fields)
+		return self.create_query("ConfigurationItems", filter_fields, include_fields, all_pages)
 
 	def get_ci_type_by_name(self, name):
 		filter_fields = self.create_filter("eq", "name", name)
-		return self.get_ci_types(filter_fields)
+		return self._cached("ConfigurationItemTypes", "name=" + name, lambda: self.get_ci_types(filter_fields))
 
-	def get_ci_types(self, filter_fields=None, include_fields=None):
+	def get_ci_types(self, filter_fields=None, include_fields=None, all_pages=None):
 		"""Return a list of all active ConfigureationItem Types"""
-		return self.create_query("ConfigurationItemTypes", filter_fields, include_fields)
+		return self.create_query("ConfigurationItemTypes", filter_fields, include_fields, all_pages)
 
 	def get_ci_category_by_name(self, name):
 		filter_fields = self.create_filter("eq", "name", name)
-		return self.get_ci_categories(filter_fields)
+		return self._cached("ConfigurationItemCategories", "name=" + name, lambda: self.get_ci_categories(filter_fields))
 
-	def get_ci_categories(self, filter_fields=None, include_fields=None):
+	def get_ci_categories(self, filter_fields=None, include_fields=None, all_pages=None):
 		"""Return a list of all active ConfigureationItem Categories"""
-		return self.create_query("ConfigurationItemCategories", filter_fields, include_fields)
+		return self.create_query("ConfigurationItemCategories", filter_fields, include_fields, all_pages)
 
 	def get_ci_udf(self, filter_fields=None, include_fields=None):
 		"""Return a list of all active ConfigureationItems User Defined Fields"""
-		return self._api_read("ConfigurationItems/entityInformation/userDefinedFields")
+		return self.get_entity_udfs("ConfigurationItems")
 
+	@flow
 	def ci_push(self, params):
 		params.update({'isActive': True})
 		if ('id' not in params):
 			udf = params['userDefinedFields']
 			del params['userDefinedFields']
-			return_value = self._api_write("ConfigurationItems", params)
+			return_value = yield self._api_write("ConfigurationItems", params)
 			params.update({'id': return_value['itemId']})
 			params.update({'userDefinedFields': udf})
 
-		return self._api_update("ConfigurationItems", params)
+		return (yield self._api_update("ConfigurationItems", params))
 
+	@flow
 	def ci_push_by_hostname(self, configurationItemCategoryID, companyID, configurationItemType, productID, referenceTitle, hostname, udf):
 		# TODO add notes for "returns"
 		"""Add a ci to a Company
@@ -274,7 +853,7 @@ class atSite:
 		field = "dattoHostname"
 		value = hostname
 		filter_field = self.create_filter(op, field, value)
-		response = self.get_cis(filter_field)
+		response = yield self.get_cis(filter_field, CI_PUSH_FIELDS)
 
 		# if it doesn't have a DattoHostname, then check the udf field "name"
 		if not response:
@@ -282,23 +861,26 @@ class atSite:
 			field = "name"
 			value = hostname
 			filter_field = self.create_filter(op, field, value, 1)
-			response = self.get_cis(filter_field)
+			response = yield self.get_cis(filter_field, CI_PUSH_FIELDS)
 
 		# TODO The following will return an item with a item number if it works. We should check it for errors. example {'itemId': 1426}
 		if not response:
-			response = self._api_write("ConfigurationItems", params)
+			response = yield self._api_write("ConfigurationItems", params)
 			params_id = {'id': response['itemId']}
 			params.update(params_id)
 		else:
-			# TODO to be a little friendly on AT, we could compare everything and only push an update if things change.
-			params_id = {'id': response[0]['id']}
-			params.update(params_id)
+			# only push what changed, skip the PATCH if nothing did
+			params = self._changed_params(response[0], params, udf)
+			if params is None:
+				return {'itemId': response[0]['id']}
+			return (yield self._api_update("ConfigurationItems", params))
 		params_udf = {'userDefinedFields': udf}
 		params.update(params_udf)
-		return self._api_update("ConfigurationItems", params)
+		return (yield self._api_update("ConfigurationItems", params))
 
 	# This is the newer version of add_ci. fields are what they are called in Autotask
 
+	@flow
 	def ci_push_by_serialNumber(self, configurationItemCategoryID, companyID, configurationItemType, productID, referenceTitle, serialNumber, udf):
 		# TODO add notes for "returns"
 		"""Add a ci to a Company
@@ -319,29 +901,29 @@ class atSite:
                  			'productID': productID,
                  			'referenceTitle': referenceTitle,
                  			'serialNumber': serialNumber,
-                    'installDate': datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.000000Z")
                 }
 
 		# check if device already is in AT. Create a new CI if new. Update if it already in AT
-		op = "eq"
-		field = "serialNumber"
-		value = serialNumber
-		filter_field = self.create_filter(op, field, value)
-		response = self.get_cis(filter_field)
+		response = yield self.get_cis(CI_TO_PUSH_BY_SERIAL(serial=serialNumber))
 
 		# TODO The following will return an item with a item number if it works. We should check it for errors. example {'itemId': 1426}
 		if not response:
-			response = self._api_write("ConfigurationItems", params)
+			# installDate is only set on create, so it doesn't force every update
+			params['installDate'] = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.000000Z")
+			response = yield self._api_write("ConfigurationItems", params)
 			params_id = {'id': response['itemId']}
 			params.update(params_id)
 		else:
-			# TODO to be a little friendly on AT, we could compare everything and only push an update if things change.
-			params_id = {'id': response[0]['id']}
-			params.update(params_id)
+			# only push what changed, skip the PATCH if nothing did
+			params = self._changed_params(response[0], params, udf)
+			if params is None:
+				return {'itemId': response[0]['id']}
+			return (yield self._api_update("ConfigurationItems", params))
 		params_udf = {'userDefinedFields': udf}
 		params.update(params_udf)
-		return self._api_update("ConfigurationItems", params)
+		return (yield self._api_update("ConfigurationItems", params))
 
+	@flow
 	def add_ci(self, ci_cat, cid, ci_type, pid, name, ip, serial, udf):
 		# TODO add notes for "returns"
 		"""Add a ci to a Company
@@ -368,70 +950,118 @@ class atSite:
                 }
 
 		# check if device already is in AT. Create a new CI if new. Update if it already in AT
-		op = "eq"
-		field = "serialNumber"
-		value = serial
-		filter_field = self.create_filter(op, field, value)
-		response = self.get_cis(filter_field)
+		response = yield self.get_cis(CI_TO_PUSH_BY_SERIAL(serial=serial))
 
 		# TODO The following will return an item with a item number if it works. We should check it or errors. example {'itemId': 1426}
 		if not response:
 			print(params)
-			return self._api_write("ConfigurationItems", params)
+			return (yield self._api_write("ConfigurationItems", params))
 		else:
-			# TODO to be a little friendly on AT, we could compare everything and only push an update if things change.
-			params_id = {'id': response[0]['id']}
-			params.update(params_id)
-			return self._api_update("ConfigurationItems", params)
+			# only push what changed, skip the PATCH if nothing did
+			udf = params.pop('userDefinedFields')
+			params = self._changed_params(response[0], params, udf)
+			if params is None:
+				return {'itemId': response[0]['id']}
+			return (yield self._api_update("ConfigurationItems", params))
+
+	@flow
+	def _upsert_ci(self, record, current=None):
+		"""Create record as a CI, or update current with it
+		:returns: tuple of the CI id, 'created', 'updated' or 'unchanged' and
+			the error of a User Defined Field PATCH failing after a create, else None
+		"""
+		params = dict(record)
+		params['isActive'] = True
+		udf = params.pop('userDefinedFields', None)
+		if current is not None:
+			params = self._changed_params(current, params, udf)
+			if params is None:
+				return current['id'], 'unchanged', None
+			yield self._api_update("ConfigurationItems", params)
+			return current['id'], 'updated', None
+		response = yield self._api_write("ConfigurationItems", params)
+		ci_id = response['itemId']
+		if udf:
+			# like ci_push, User Defined Fields go in a PATCH after the create
+			try:
+				yield self._api_update("ConfigurationItems", {'id': ci_id, 'userDefinedFields': udf})
+			except Exception as err:  # pylint: disable=broad-except
+				# the CI exists now, its id must not be lost with the error
+				return ci_id, 'created', err
+		return ci_id, 'created', None
 
 	def update_ci(self, params):
 		return self._api_update("ConfigurationItems", params)
 
-	def update_ci_udf(self, ci_id, product_id, udf):
+	@flow
+	def update_ci_udf(self, ci_id, product_id, udf, current=None, deferred=False):
+		"""
+		:param current: the CI as already fetched, if given only changed fields
+			are sent and nothing at all when none changed
+		:param deferred: queue the update on the site's write_behind() queue,
+			merging it with other pending updates of the CI, and return a Future
+		"""
 		params = {"id": ci_id, "isActive": True, "productID": product_id}
+		if current is not None:
+			params = self._changed_params(current, params, udf)
+			if params is None:
+				return self._unchanged(current['id'], deferred)
+			return (yield self._api_update_deferred("ConfigurationItems", params, deferred))
 		params_udf = {"userDefinedFields": udf}
 		params.update(params_udf)
-		return self._api_update("ConfigurationItems", params)
+		return (yield self._api_update_deferred("ConfigurationItems", params, deferred))
 
-	def update_ci_just_udf(self, c_id, ci_id, udf):
+	def update_ci_just_udf(self, c_id, ci_id, udf, deferred=False):
+		"""
+		:param deferred: queue the update on the site's write_behind() queue and return a Future
+		"""
 		params = {"id": ci_id, "companyID": c_id}
 		params_udf = {"userDefinedFields": udf}
 		params.update(params_udf)
-		return self._api_update("ConfigurationItems", params)
+		return self._api_update_deferred("ConfigurationItems", params, deferred)
 
 	# Contacts
-	def get_contacts(self, filter_fields=None, include_fields=None):
+	def get_contacts(self, filter_fields=None, include_fields=None, all_pages=None):
 		"""Return a list of all Contacts"""
-		return self.create_query("Contacts", filter_fields, include_fields)
+		return self.create_query("Contacts", filter_fields, include_fields, all_pages)
 
-	def update_contact_udf(self, company_id, contact_id, udf):
+	@flow
+	def update_contact_udf(self, company_id, contact_id, udf, current=None):
+		"""
+		:param current: the Contact as already fetched, if given only changed
+			User Defined Fields are sent and nothing at all when none changed
+		"""
 		params = {"id": contact_id}
+		if current is not None:
+			params = self._changed_params(current, params, udf)
+			if params is None:
+				return {'itemId': current['id']}
+			return (yield self._api_update("Companies/" + str(company_id) + "/Contacts", params))
 		params_udf = {"userDefinedFields": udf}
 		params.update(params_udf)
-		return self._api_update("Companies/" + str(company_id) + "/Contacts", params)
+		return (yield self._api_update("Companies/" + str(company_id) + "/Contacts", params))
 
 	# Holidays
 
 	def get_holiday_sets(self):
-		filter_field = "/query?search={'filter':[{'op':'gt','field':'id','value': '0'}]}"
-		return self._api_read("HolidaySets" + filter_field)
+		filter_fields = self.create_filter("gt", "id", "0")
+		return self._cached("HolidaySets", "all", lambda: self.create_query("HolidaySets", filter_fields))
 
 	def get_holidays(self):
-		filter_field = "/query?search={'filter':[{'op':'gt','field':'id','value': '0'}]}"
-		return self._api_read("Holidays" + filter_field)
+		filter_fields = self.create_filter("gt", "id", "0")
+		return self.create_query("Holidays", filter_fields)
 
 	# Tickets
 	def add_ticket(self, params):
 		"""Create a new ticket"""
 		return self._api_write("Tickets", params)
     
+	@flow
 	def send_alert_ticket(self, company_id, ci_id):
 		ticket_title = "Network device Down! UniFi Controler reports the device is down."
 		# check if there is already a ticket
-		filter_fields1 = self.create_filter("eq", "configurationItemID", str(ci_id))
-		filter_fields2 = self.create_filter("eq", "title", str(ticket_title))
-		filter_fields = filter_fields1 + "," + filter_fields2
-		ticket = self.create_query("tickets", filter_fields)
+		filter_fields = TICKET_BY_CI_AND_TITLE(ci_id=str(ci_id), title=str(ticket_title))
+		ticket = yield self.create_query("tickets", filter_fields)
 		# TODO Check if other devices are on within the same network. Add that detail to the ticket
 		if not ticket:
 			# # Create ticket
@@ -447,17 +1077,20 @@ class atSite:
 				'queueID': "8",
 				'title': ticket_title
 			}
-			return self._api_write("Tickets", params)
+			return (yield self._api_write("Tickets", params))
 		else:
 			return ticket
 
-	def send_generic_alert_ticket(self, ticket_title, description, company_id, ci_id):
+	@flow
+	def send_generic_alert_ticket(self, ticket_title, description, company_id, ci_id, issue_type="14", queue="8"):
+		"""
+		:param issue_type: issueType value or label, ie "14" or "Alert"
+		:param queue: queueID value or label
+		"""
 		# ticket_title = "Network device Down! UniFi Controler reports the device is down."
 		# check if there is already a ticket
-		filter_fields1 = self.create_filter("eq", "configurationItemID", str(ci_id))
-		filter_fields2 = self.create_filter("eq", "title", str(ticket_title))
-		filter_fields = filter_fields1 + "," + filter_fields2
-		ticket = self.create_query("tickets", filter_fields)
+		filter_fields = TICKET_BY_CI_AND_TITLE(ci_id=str(ci_id), title=str(ticket_title))
+		ticket = yield self.create_query("tickets", filter_fields)
 		# TODO Check if other devices are on within the same network. Add that detail to the ticket
 		if not ticket:
 			# # Create ticket
@@ -466,14 +1099,14 @@ class atSite:
 				'companyID': company_id,
 				'configurationItemID': ci_id,
 				'description': description,
-				'issueType': "14",
+				'issueType': (yield self._picklist_id("Tickets", "issueType", issue_type)),
 				'priority': "1",
 				'source': "8",
 				'status': "1",
-				'queueID': "8",
+				'queueID': (yield self._picklist_id("Tickets", "queueID", queue)),
 				'title': ticket_title
 			}
-			return self._api_write("Tickets", params)
+			return (yield self._api_write("Tickets", params))
 		else:
 			return ticket
 
@@ -482,6 +1115,10 @@ class atSite:
 		tickets = self.create_query("Tickets", filter_fields)
 		return tickets
 
+	def count_new_unassigned_tickets(self):
+		"""Return how many tickets get_new_unassigned_tickets would, without fetching them"""
+		return self.count("Tickets", self.create_filter("eq", "status", "1"))
+
 	def get_ticket_by_id(self, t_id):
 		filter_fields = self.create_filter("eq", "id", str(t_id))
 		return self.create_query("Tickets", filter_fields)
@@ -490,28 +1127,43 @@ class atSite:
 		filter_fields = self.create_filter("eq", "ticketNumber", str(t_no))
 		return self.create_query("Tickets", filter_fields)
 	# Ticket attributes
-	def get_issueType_by_name(name):
-		return self._api_read("Tickets/entityInformation/fields")
+	def get_issueType_by_name(self, name):
+		"""Return the issueType value labelled name, ie "14" for "Alert" """
+		return self.picklist_value("Tickets", "issueType", name)
+
+	def get_queue_by_name(self, name):
+		"""Return the queueID value labelled name"""
+		return self.picklist_value("Tickets", "queueID", name)
 
 	# Resources
 	def get_resource_id_by_email(self, email):
+		return self._cached("Resources", "email=" + email, lambda: self._find_resource_by_email(email))
+
+	@flow
+	def _find_resource_by_email(self, email):
 		filter_fields = self.create_filter("eq", "email", email)
-		resource = self.create_query("Resources", filter_fields)
+		resource = yield self.create_query("Resources", filter_fields)
 		if not resource:
 			filter_fields = self.create_filter("eq", "email2", email)
-			resource = self.create_query("Resources", filter_fields)
+			resource = yield self.create_query("Resources", filter_fields)
 		return resource[0]
 
 	# Time Entries
-	def get_time_entries_by_resource_id(self, r_id, date):
+	def get_time_entries_by_resource_id(self, r_id, date, all_pages=None, windowed=False):
+		"""
+		:param windowed: fetch every entry up to now with query_windowed, split by day
+		"""
 		filter_fields1 = self.create_filter("eq", "resourceID", str(r_id))
+		if windowed:
+			return self.query_windowed("TimeEntries", "dateWorked", date, datetime.utcnow(), filter_fields1,
+									   min_window=timedelta(days=1), start_op="gt")
 		filter_fields2 = self.create_filter("gt", "dateWorked", date)
 		filter_fields = filter_fields1 + "," + filter_fields2
-		return self.create_query("TimeEntries", filter_fields)
+		return self.create_query("TimeEntries", filter_fields, all_pages=all_pages)
 
 	# Roles
 	def get_role_ids(self):
-		return self._api_active("Roles")
+		return self._cached("Roles", "active", lambda: self._api_active("Roles"))
 
 	# Contracts
 	def get_contracts_from_company_id(self, c_id):
@@ -519,28 +1171,443 @@ class atSite:
 		return self.create_query("Contracts", filter_fields)
 	# Contract Rates
 
-	def get_all_contracts(self):
-		filter_fields = "{'op': 'exist', 'field': 'id'}"
-		return self.create_query("Contracts", filter_fields)
+	def get_all_contracts(self, all_pages=None):
+		filter_fields = exist("id")
+		return self.create_query("Contracts", filter_fields, all_pages=all_pages)
 
 	# Contract Rates
 
-	def get_all_contract_rates(self):
-		filter_fields = "{'op': 'exist', 'field': 'id'}"
-		return self.create_query("ContractRates", filter_fields)
+	def get_all_contract_rates(self, all_pages=None):
+		filter_fields = exist("id")
+		return self.create_query("ContractRates", filter_fields, all_pages=all_pages)
 
 	# Dispatch Calendar
-	def get_appointments(self, start_date, end_date):
+	def get_appointments(self, start_date, end_date, windowed=False):
+		"""
+		:param windowed: fetch every appointment with query_windowed
+		"""
+		if windowed:
+			return self.query_windowed("Appointments", "startDateTime", start_date, end_date)
 		filter_fields = self.create_filter(
 			"gte", "startDateTime", start_date) + "," + self.create_filter("lt", "startDateTime", end_date)
 		return self.create_query("Appointments", filter_fields)
 
-	def get_servicecalls(self, start_date, end_date):
+	def get_servicecalls(self, start_date, end_date, windowed=False):
+		"""
+		:param windowed: fetch every service call with query_windowed
+		"""
+		if windowed:
+			return self.query_windowed("ServiceCalls", "startDateTime", start_date, end_date)
 		filter_fields = self.create_filter(
 			"gte", "startDateTime", start_date) + "," + self.create_filter("lt", "startDateTime", end_date)
 		return self.create_query("ServiceCalls", filter_fields)
 
-	def get_servicecalls_incomplete(self, year_ago):
+	def get_servicecalls_incomplete(self, year_ago, windowed=False):
+		"""
+		:param windowed: fetch every incomplete service call with query_windowed,
+			those scheduled more than a year ahead are left out
+		"""
+		if windowed:
+			return self.query_windowed("ServiceCalls", "startDateTime", year_ago,
+									   datetime.utcnow() + timedelta(days=366),
+									   self.create_filter("eq", "isComplete", "0"), start_op="gt")
 		filter_fields = self.create_filter(
 			"eq", "isComplete", "0") + "," + self.create_filter("gt", "startDateTime", year_ago)
 		return self.create_query("ServiceCalls", filter_fields)
+
+
+class atSite(atSiteBase):
+
+	"""Interact with a Autotask API.
+
+	All this is stolen from pyUnifi. Any cleverness in this code is from them,
+	any mistakes are my own.
+
+	Will attempt to fix this example when I understand the code better
+	>>> from unifi.controller import Controller
+	>>> c = Controller('192.168.1.99', 'admin', 'p4ssw0rd')
+	>>> for ap in c.get_aps():
+	...	 print 'AP named %s with MAC %s' % (ap.get('name'), ap['mac'])
+	...
+	AP named Study with MAC dc:9f:db:1a:59:07
+	AP named Living Room with MAC dc:9f:db:1a:59:08
+	AP named Garage with MAC dc:9f:db:1a:59:0b
+
+	"""
+
+	_shared = {}
+	_shared_lock = threading.Lock()
+
+	def __init__(self, *args, pool_maxsize=None, pool_connections=4, keep_alive=True, timeout=None, **kwargs):
+		"""
+		Takes the same arguments as atSiteBase, plus
+		:param pool_maxsize: connections kept open per host, defaults to at
+			least max_threads. Threads beyond it wait for a free connection
+			instead of opening throwaway ones.
+		:param pool_connections: hosts to keep connection pools for
+		:param keep_alive: reuse connections between requests
+		:param timeout: (connect, read) seconds for each request, overriding
+			the scheduler's
+		"""
+		super().__init__(*args, **kwargs)
+		if timeout is not None:
+			self.scheduler.timeout = timeout
+		self.pool_maxsize = pool_maxsize or max(10, self.max_threads)
+		self.pool_connections = pool_connections
+		self.keep_alive = keep_alive
+		self._session = None
+		self._session_lock = threading.Lock()
+		self._alert_engines = {}
+		self._write_behind = None
+
+	@property
+	def session(self):
+		"""requests Session, made on the first request so short jobs failing
+		before any call never import requests or open a pool
+		"""
+		if self._session is None:
+			with self._session_lock:
+				if self._session is None:
+					self._session = self._make_session()
+		return self._session
+
+	@session.setter
+	def session(self, session):
+		self._session = session
+
+	def _make_session(self):
+		# pylint: disable=import-outside-toplevel
+		import requests
+		from requests.adapters import HTTPAdapter
+		# one session shared by every thread using this site, its pools are thread-safe
+		session = requests.Session()
+		session.headers.update(self.headers)
+		if not self.keep_alive:
+			session.headers["Connection"] = "close"
+		adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize,
+							  pool_block=True)
+		session.mount("https://", adapter)
+		session.mount("http://", adapter)
+		return session
+
+	@classmethod
+	def shared(cls, host, username, password, interactioncode, **kwargs):
+		"""Return the process wide site for these credentials, creating it once
+
+		Long running processes can call this from every job to reuse one
+		site, and with it the warm connection pool and cache.
+		"""
+		key = (host, username, password, interactioncode)
+		with cls._shared_lock:
+			site = cls._shared.get(key)
+			if site is None:
+				site = cls._shared[key] = cls(host, username, password, interactioncode, **kwargs)
+			return site
+
+	def close(self):
+		"""Send any queued writes and close the pooled connections"""
+		if self._write_behind is not None:
+			self._write_behind.close()
+		if self._session is not None:
+			self._session.close()
+
+	def export(  # pylint: disable=r0913
+			self, entity, path, filter_fields=None, include_fields=None, fmt=None, flatten_udfs=None, resume=True):
+		"""Stream every item of entity to an NDJSON, CSV or Parquet file, see export.Export
+		:param resume: continue an interrupted export of the same query to path
+		:returns: number of items written
+		"""
+		from .export import Export  # pylint: disable=import-outside-toplevel
+		return Export(self, entity, path, filter_fields, include_fields, fmt, flatten_udfs).run(resume)
+
+	def write_behind(self, **kwargs):
+		"""Return the site's WriteBehindQueue, made on first use
+
+		Used by the update methods called with deferred=True, close() sends
+		what is still queued.
+		:param kwargs: passed to WriteBehindQueue when it is made
+		"""
+		with self._shared_lock:
+			if self._write_behind is None:
+				self._write_behind = WriteBehindQueue(self, **kwargs)
+			return self._write_behind
+
+	def alert_tickets(self, queue_id="8", **kwargs):
+		"""Return the site's AlertTicketEngine for queue_id, made on first use
+
+		Prefer it over send_generic_alert_ticket when many alerts arrive at
+		once, it checks for open tickets without a query per alert.
+		:param kwargs: passed to AlertTicketEngine when it is made
+		"""
+		with self._shared_lock:
+			engine = self._alert_engines.get(str(queue_id))
+			if engine is None:
+				engine = self._alert_engines[str(queue_id)] = AlertTicketEngine(self, queue_id, **kwargs)
+			return engine
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	@staticmethod
+	def _run(flow_gen):
+		# each call yielded by the flow has already run, send its result back
+		value = None
+		try:
+			while True:
+				value = flow_gen.send(value)
+		except StopIteration as done:
+			return done.value
+
+	def _request(self, method, url, decode, idempotent=None, **kwargs):
+		if idempotent is None:
+			idempotent = method in IDEMPOTENT_METHODS
+		session = self.session
+
+		def send():
+			if self.metrics is None:
+				return session.request(method, url, timeout=self.scheduler.timeout, **kwargs)
+			started = time.perf_counter()
+			try:
+				response = session.request(method, url, timeout=self.scheduler.timeout, **kwargs)
+			except Exception as err:
+				self._record(method, url, None, time.perf_counter() - started, error=err)
+				raise
+			self._record(method, url, response.status_code, time.perf_counter() - started, len(response.content))
+			return response
+
+		# not tied to _make_session, so a session set from outside is retried too
+		response = self.scheduler.call(send, idempotent, _connection_errors())
+		return decode(response.content)
+
+	def iter_pages(self, url, filter_fields=None, prefetch=0, include_fields=None):
+		"""Lazily run a query, yielding each page of items as it arrives
+
+		Only one page is held in memory at a time; the next page is not
+		requested until the consumer asks for it.
+		:param url: entity to query, ie "ConfigurationItems"
+		:param filter_fields: filters as taken by create_query, defaults to active items
+		:param prefetch: if set, follow nextPageUrl in a background thread and
+			keep up to this many pages buffered ahead of the consumer
+		:param include_fields: only return these fields of each item
+		"""
+		if prefetch:
+			yield from self._prefetch(self.iter_pages(url, filter_fields, 0, include_fields), prefetch)
+			return
+		items, next_url = self._query_page(url, self._query_body(filter_fields, include_fields))
+		yield items
+		while next_url:
+			items, next_url = self._read_page(next_url)
+			yield items
+
+	def iter_query(self, url, filter_fields=None, prefetch=0, include_fields=None):
+		"""Lazily run a query, yielding every item across all pages"""
+		for page in self.iter_pages(url, filter_fields, prefetch, include_fields):
+			yield from page
+
+	@staticmethod
+	def _prefetch(pages, size):
+		buffer = queue.Queue(maxsize=size)
+		stop = threading.Event()
+		worker = threading.Thread(target=_in_context(_fill), args=(pages, buffer, stop), daemon=True)
+		worker.start()
+		try:
+			yield from _drain(buffer)
+		finally:
+			stop.set()
+
+	def iter_pages_sharded(  # pylint: disable=r0913
+			self, url, max_id, filter_fields=None, shards=None, max_workers=None, prefetch=2, include_fields=None):
+		"""Run a query as parallel id range shards, yielding pages in id order
+
+		Each shard adds 'gt'/'lte' filters on id and follows its own
+		nextPageUrl chain. Shards are fetched concurrently, but pages are
+		yielded shard by shard so the output order matches iter_pages.
+		:param max_id: highest id to fetch, items above it are not returned
+		:param shards: number of id ranges, defaults to twice max_workers
+		:param max_workers: concurrent shards, capped at the site's max_threads
+		:param prefetch: pages buffered per shard ahead of the consumer
+		"""
+		max_workers = min(max_workers or self.max_threads, self.max_threads)
+		shards = shards or max_workers * 2
+		filter_fields = self._filter_string(filter_fields)
+		stop = threading.Event()
+		buffers = []
+		executor = ThreadPoolExecutor(max_workers=max_workers)
+		fill = _in_context(_fill)
+		try:
+			for low, high in self.id_shards(max_id, shards):
+				shard_filter = filter_fields + "," + self.create_filter("gt", "id", str(low)) + \
+					"," + self.create_filter("lte", "id", str(high))
+				buffer = queue.Queue(maxsize=max(1, prefetch))
+				# shards start in submission order, so the shard being drained
+				# is always running or finished and a full buffer can't deadlock
+				executor.submit(fill, self.iter_pages(url, shard_filter, 0, include_fields), buffer, stop)
+				buffers.append(buffer)
+			for buffer in buffers:
+				yield from _drain(buffer)
+		finally:
+			stop.set()
+			executor.shutdown(wait=False, cancel_futures=True)
+
+	def iter_query_sharded(  # pylint: disable=r0913
+			self, url, max_id, filter_fields=None, shards=None, max_workers=None, prefetch=2, include_fields=None):
+		"""Like iter_pages_sharded, yielding every item in id order"""
+		for page in self.iter_pages_sharded(url, max_id, filter_fields, shards, max_workers, prefetch, include_fields):
+			yield from page
+
+	def query_windowed(  # pylint: disable=r0913
+			self, url, field, start, end, filter_fields=None, include_fields=None,
+			windows=None, min_window=MIN_WINDOW, max_workers=None, start_op="gte"):
+		"""Run a date range query as concurrent time windows, returning every item
+
+		[start, end) is split into windows on field, and any window whose first
+		page comes back full is split in half again until it is no wider than
+		min_window, so dense stretches get narrow windows and quiet ones a single
+		request. The items of all windows are merged once per id in field order.
+		:param field: datetime field the range is on, ie "startDateTime"
+		:param filter_fields: filters besides the range, none by default
+		:param windows: windows to start with, defaults to max_workers
+		:param min_window: timedelta below which a dense window is paged through
+			instead of split
+		:param max_workers: concurrent windows, capped at the site's max_threads
+		:param start_op: "gt" to leave out items exactly at start
+		"""
+		max_workers = min(max_workers or self.max_threads, self.max_threads)
+		results = []
+		query_window = _in_context(self._query_window)
+		with ThreadPoolExecutor(max_workers=max_workers) as executor:
+			pending = {executor.submit(query_window, url, field, window, filter_fields,
+									   include_fields, min_window, op)
+					   for window, op in self._windows(start, end, windows or max_workers, start_op)}
+			while pending:
+				done, pending = wait(pending, return_when=FIRST_COMPLETED)
+				for future in done:
+					items, split = future.result()
+					results.append(items)
+					pending.update(executor.submit(query_window, url, field, window, filter_fields,
+												   include_fields, min_window, op)
+								   for window, op in split)
+		return self._merge_windows(results, field)
+
+	def bulk_upsert_cis(self, records, key="serialNumber", max_workers=None):
+		"""Create or update many ConfigurationItems at once
+
+		Existing CIs are found with a few 'in' queries on key rather than one
+		lookup per record, then the creates and updates run on a pool of
+		worker threads. A failing record does not stop the others.
+		:param records: CI dicts as they are sent to Autotask, each with key set.
+			userDefinedFields is optional and is PATCHed after a create.
+		:param key: CI field identifying a device, ie "serialNumber" or "dattoHostname"
+		:param max_workers: concurrent writes, capped at the site's max_threads
+		:returns: list with a report per record, in the same order as records:
+			{'key': value, 'id': CI id, 'action': 'created', 'updated' or
+			'unchanged', 'error': None} or with 'error' set to the exception
+			raised for that record. A CI created whose User Defined Fields then
+			failed to PATCH has its id, 'created' and the error. Updates only
+			send fields that changed.
+		"""
+		max_workers = min(max_workers or self.max_threads, self.max_threads)
+		report = [{'key': record.get(key), 'id': None, 'action': None, 'error': None}
+				for record in records]
+
+		# records sharing a key are written in order by one worker, so a
+		# device listed twice is created once and then updated
+		groups = {}
+		for index, record in enumerate(records):
+			if record.get(key) in (None, ""):
+				report[index]['error'] = KeyError(key)
+			else:
+				groups.setdefault(self._match_key(record[key]), []).append(index)
+
+		# existing CIs are only diffed against, so fetch just the fields being written
+		include_fields = {"id", key, "isActive"}
+		for record in records:
+			include_fields.update(record)
+		existing = {}
+		keys = list(groups)
+		for start in range(0, len(keys), IN_FILTER_SIZE):
+			filter_fields = self.create_in_filter(key, keys[start:start + IN_FILTER_SIZE])
+			for ci in self.iter_query("ConfigurationItems", filter_fields, include_fields=sorted(include_fields)):
+				existing.setdefault(self._match_key(ci.get(key)), ci)
+
+		def upsert_group(value, indexes):
+			current = existing.get(value)
+			for index in indexes:
+				try:
+					ci_id, action, error = self._upsert_ci(records[index], current)
+				except Exception as err:  # pylint: disable=broad-except
+					report[index]['error'] = err
+					continue
+				report[index].update({'id': ci_id, 'action': action, 'error': error})
+				# later records with this key are diffed against what was written
+				written = dict(records[index])
+				if error is not None:
+					written.pop('userDefinedFields', None)
+				current = dict(current or {}, **written)
+				current['id'] = ci_id
+
+		with ThreadPoolExecutor(max_workers=max_workers) as executor:
+			upsert = _in_context(upsert_group)
+			for value, indexes in groups.items():
+				executor.submit(upsert, value, indexes)
+		return report
+
+	@staticmethod
+	def _match_key(value):
+		"""Return value as compared by Autotask's eq and in filters, strings ignore case"""
+		return str(value).casefold()
+
+	def fan_out(self, company_ids, entity, field="companyID", filter_fields=None, include_fields=None):
+		"""Return the entity items of many companies in a few queries
+
+		Rather than one query per company, ids are collapsed into 'in'
+		filters on field of IN_FILTER_SIZE ids each, run in parallel.
+		:param company_ids: ids of the parents, ie from get_companies()
+		:param entity: child entity to query, ie "Contracts" or "CompanyAlerts"
+		:param field: child field holding the parent id
+		:param filter_fields: extra filters for the children
+		:returns: dict of every company id in company_ids to its list of items
+		"""
+		keys = {str(company_id): company_id for company_id in company_ids}
+		result = {company_id: [] for company_id in keys.values()}
+		ids = list(keys)
+		extra = "" if filter_fields is None else self._filter_string(filter_fields) + ","
+
+		def fetch(chunk):
+			return list(self.iter_query(entity, extra + self.create_in_filter(field, chunk),
+										include_fields=include_fields))
+
+		with ThreadPoolExecutor(max_workers=self.max_threads) as executor:
+			chunks = [ids[start:start + IN_FILTER_SIZE] for start in range(0, len(ids), IN_FILTER_SIZE)]
+			for items in executor.map(_in_context(fetch), chunks):
+				for item in items:
+					company_id = keys.get(str(item.get(field)))
+					if company_id is not None:
+						result[company_id].append(item)
+		return result
+
+	def fan_out_children(self, company_ids, child, parent="Companies"):
+		"""GET parent/{id}/child for many ids at once, max_threads at a time
+		:param child: child collection, ie "Alerts" or "Contacts"
+		:returns: dict of every id in company_ids to what its read returned
+		"""
+		company_ids = list(company_ids)
+		with ThreadPoolExecutor(max_workers=self.max_threads) as executor:
+			results = executor.map(_in_context(
+				lambda company_id: self._api_read(parent + "/" + str(company_id) + "/" + child)), company_ids)
+			return dict(zip(company_ids, results))
+
+	def get_contracts_by_company_ids(self, company_ids):
+		"""Return the Contracts of many companies, keyed by company id"""
+		return self.fan_out(company_ids, "Contracts")
+
+	def get_alerts_by_company_ids(self, company_ids):
+		"""Return the CompanyAlerts of many companies, keyed by company id"""
+		return self.fan_out(company_ids, "CompanyAlerts")
+
+	def get_contacts_by_company_ids(self, company_ids, filter_fields=None):
+		"""Return the Contacts of many companies, keyed by company id"""
+		return self.fan_out(company_ids, "Contacts", filter_fields=filter_fields)
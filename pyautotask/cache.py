@@ -0,0 +1,151 @@
+"""
+Bounded caches for Autotask reference data lookups
+"""
+import copy
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from .records import jsonable
+
+# returned by get() on a miss, None is a valid cached value
+MISSING = object()
+
+
+class BaseCache:
+
+	"""Hit/miss counting shared by the cache backends.
+
+	Keys are "Entity:lookup" strings, so invalidate("Products") drops every
+	cached Products lookup.
+	"""
+
+	def __init__(self):
+		self.hits = 0
+		self.misses = 0
+		self._lock = threading.RLock()
+
+	def _count(self, value):
+		if value is MISSING:
+			self.misses += 1
+		else:
+			self.hits += 1
+		return value
+
+	def get(self, key):
+		"""Return the cached value for key, or MISSING"""
+		raise NotImplementedError
+
+	def set(self, key, value, ttl):
+		"""Cache value under key for ttl seconds"""
+		raise NotImplementedError
+
+	def invalidate(self, entity=None):
+		"""Drop the cached lookups of entity, or everything"""
+		raise NotImplementedError
+
+	def __len__(self):
+		raise NotImplementedError
+
+	def stats(self):
+		return {'hits': self.hits, 'misses': self.misses, 'size': len(self)}
+
+
+class MemoryCache(BaseCache):
+
+	"""In-memory LRU cache whose entries expire after their TTL"""
+
+	def __init__(self, max_entries=1024):
+		super().__init__()
+		self.max_entries = max_entries
+		self._entries = OrderedDict()
+
+	def get(self, key):
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is None:
+				return self._count(MISSING)
+			expires, value = entry
+			if expires < time.monotonic():
+				del self._entries[key]
+				return self._count(MISSING)
+			self._entries.move_to_end(key)
+			# callers get their own copy so they can't change the cached one
+			return self._count(copy.deepcopy(value))
+
+	def set(self, key, value, ttl):
+		with self._lock:
+			self._entries[key] = (time.monotonic() + ttl, copy.deepcopy(value))
+			self._entries.move_to_end(key)
+			while len(self._entries) > self.max_entries:
+				self._entries.popitem(last=False)
+
+	def invalidate(self, entity=None):
+		with self._lock:
+			if entity is None:
+				self._entries.clear()
+				return
+			for key in [key for key in self._entries if key.startswith(entity + ":")]:
+				del self._entries[key]
+
+	def __len__(self):
+		return len(self._entries)
+
+
+class DiskCache(BaseCache):
+
+	"""SQLite backed LRU cache with TTLs that survives restarts
+
+	Values have to be JSON serializable, CompactRecords are stored and
+	come back as plain dicts.
+	"""
+
+	def __init__(self, path, max_entries=10000):
+		super().__init__()
+		self.max_entries = max_entries
+		directory = os.path.dirname(os.path.abspath(path))
+		os.makedirs(directory, exist_ok=True)
+		import sqlite3  # pylint: disable=import-outside-toplevel
+		self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+		self._db.execute(
+			"CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires REAL, used REAL)")
+		self._db.execute("CREATE INDEX IF NOT EXISTS cache_used ON cache (used)")
+
+	def get(self, key):
+		now = time.time()
+		with self._lock:
+			row = self._db.execute("SELECT value, expires FROM cache WHERE key = ?", (key,)).fetchone()
+			if row is None:
+				return self._count(MISSING)
+			if row[1] < now:
+				self._db.execute("DELETE FROM cache WHERE key = ?", (key,))
+				return self._count(MISSING)
+			self._db.execute("UPDATE cache SET used = ? WHERE key = ?", (now, key))
+			return self._count(json.loads(row[0]))
+
+	def set(self, key, value, ttl):
+		now = time.time()
+		with self._lock:
+			self._db.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)",
+							 (key, json.dumps(value, default=jsonable), now + ttl, now))
+			extra = len(self) - self.max_entries
+			if extra > 0:
+				self._db.execute(
+					"DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY used LIMIT ?)", (extra,))
+
+	def invalidate(self, entity=None):
+		with self._lock:
+			if entity is None:
+				self._db.execute("DELETE FROM cache")
+			else:
+				self._db.execute("DELETE FROM cache WHERE substr(key, 1, ?) = ?",
+								 (len(entity) + 1, entity + ":"))
+
+	def __len__(self):
+		with self._lock:
+			return self._db.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+	def close(self):
+		self._db.close()
@@ -0,0 +1,238 @@
+"""
+Stream Autotask entities to NDJSON, CSV or Parquet files
+"""
+import csv
+import io
+import json
+import os
+
+from .query import exist
+
+FORMATS = {".ndjson": "ndjson", ".jsonl": "ndjson", ".csv": "csv", ".parquet": "parquet"}
+
+# column name prefix of flattened User Defined Fields, ie "udf.Serial Number"
+UDF_PREFIX = "udf."
+
+
+def flatten(item):
+	"""Return a record as a flat dict, each User Defined Field in its own column"""
+	row = {field: value for field, value in item.items() if field != "userDefinedFields"}
+	for udf in item.get("userDefinedFields") or ():
+		row[UDF_PREFIX + udf["name"]] = udf.get("value")
+	return row
+
+
+class NDJSONWriter:
+
+	"""One JSON record a line, appends cleanly after a resume"""
+
+	resumable = True
+
+	def __init__(self, file, state):
+		self.file = io.TextIOWrapper(file, encoding="utf-8", newline="\n", write_through=True)
+
+	def write(self, rows):
+		self.file.write("".join(json.dumps(row, default=str) + "\n" for row in rows))
+
+	def state(self):
+		return {}
+
+	def close(self):
+		self.file.flush()
+		self.file.detach()
+
+
+class CSVWriter:
+
+	"""CSV with the columns of the first page, later unknown fields are dropped"""
+
+	resumable = True
+
+	def __init__(self, file, state):
+		self.file = io.TextIOWrapper(file, encoding="utf-8", newline="", write_through=True)
+		self.fieldnames = state.get("fieldnames")
+		self.writer = None
+		if self.fieldnames:
+			self.writer = csv.DictWriter(self.file, self.fieldnames, extrasaction="ignore")
+
+	def write(self, rows):
+		if not rows:
+			return
+		if self.writer is None:
+			self.fieldnames = list(dict.fromkeys(field for row in rows for field in row))
+			self.writer = csv.DictWriter(self.file, self.fieldnames, extrasaction="ignore")
+			self.writer.writeheader()
+		self.writer.writerows(
+			{field: json.dumps(value) if isinstance(value, (list, dict)) else value for field, value in row.items()}
+			for row in rows)
+
+	def state(self):
+		return {"fieldnames": self.fieldnames}
+
+	def close(self):
+		self.file.flush()
+		self.file.detach()
+
+
+class ParquetWriter:
+
+	"""Parquet, a row group a page with the schema of the first page
+
+	Parquet files can't be appended to, so an interrupted export starts over.
+	"""
+
+	resumable = False
+
+	def __init__(self, file, state):
+		try:
+			# pylint: disable=import-outside-toplevel
+			import pyarrow
+			import pyarrow.parquet
+		except ImportError:
+			raise ImportError("Parquet exports need pyarrow, install pyautotask[parquet]") from None
+		self.pyarrow = pyarrow
+		self.file = file
+		self.writer = None
+		self.schema = None
+
+	def write(self, rows):
+		pyarrow = self.pyarrow
+		if not rows:
+			return
+		if self.writer is None:
+			inferred = pyarrow.Table.from_pylist(rows).schema
+			# columns empty on the first page could hold anything later
+			self.schema = pyarrow.schema(
+				[field.with_type(pyarrow.string()) if pyarrow.types.is_null(field.type) else field
+				 for field in inferred])
+			self.writer = pyarrow.parquet.ParquetWriter(self.file, self.schema)
+		strings = [field.name for field in self.schema if pyarrow.types.is_string(field.type)]
+		rows = [dict(row, **{name: str(row[name]) for name in strings
+							if row.get(name) is not None and not isinstance(row[name], str)}) for row in rows]
+		self.writer.write_table(pyarrow.Table.from_pylist(rows, schema=self.schema))
+
+	def state(self):
+		return {}
+
+	def close(self):
+		if self.writer is not None:
+			self.writer.close()
+
+
+WRITERS = {"ndjson": NDJSONWriter, "csv": CSVWriter, "parquet": ParquetWriter}
+
+
+class Export:
+
+	"""Write every item of an entity query to a file, a page at a time
+
+	Pages are written as they arrive, so memory stays at about one page
+	however large the entity. The output is built in path + ".part" and
+	renamed to path when complete, so path never holds a partial export.
+	After each page path + ".state" records the nextPageUrl and how much of
+	the .part file is complete, running the same export again continues
+	from there.
+	>>> Export(site, "ConfigurationItems", "cis.csv").run()
+	"""
+
+	def __init__(  # pylint: disable=r0913
+			self, site, entity, path, filter_fields=None, include_fields=None, fmt=None, flatten_udfs=None):
+		"""
+		:param site: atSite to read from
+		:param filter_fields: filters as taken by create_query, defaults to every item
+		:param fmt: "ndjson", "csv" or "parquet", defaults by the extension of path
+		:param flatten_udfs: give each User Defined Field its own column,
+			defaults to True except for NDJSON
+		"""
+		self.site = site
+		self.entity = entity
+		self.path = path
+		self.filter_fields = exist("id") if filter_fields is None else filter_fields
+		self.include_fields = include_fields
+		self.format = fmt or FORMATS.get(os.path.splitext(path)[1].lower())
+		if self.format not in WRITERS:
+			raise ValueError("Unknown export format for " + path + ", pass fmt")
+		self.flatten_udfs = self.format != "ndjson" if flatten_udfs is None else flatten_udfs
+		self.body = site._query_body(self.filter_fields, include_fields)  # pylint: disable=protected-access
+		self.part_path = path + ".part"
+		self.state_path = path + ".state"
+		# records written, including those of earlier runs
+		self.records = 0
+
+	def _load_state(self):
+		"""Return the state of an interrupted run of this export, or None"""
+		try:
+			with open(self.state_path, encoding="utf-8") as file:
+				state = json.load(file)
+		except (OSError, ValueError):
+			return None
+		if state.get("body") != self.body or state.get("format") != self.format or \
+				not os.path.exists(self.part_path):
+			return None
+		return state
+
+	def _save_state(self, file, writer, next_url, last_id):
+		file.flush()
+		os.fsync(file.fileno())
+		state = dict(writer.state(), body=self.body, format=self.format, next_url=next_url,
+					 last_id=last_id, offset=file.tell(), records=self.records)
+		with open(self.state_path + ".tmp", "w", encoding="utf-8") as state_file:
+			json.dump(state, state_file)
+		os.replace(self.state_path + ".tmp", self.state_path)
+
+	def _resume_page(self, state):
+		"""Return the first page after a resume, from its nextPageUrl or the last id written"""
+		try:
+			return self.site._read_page(state["next_url"])  # pylint: disable=protected-access
+		except Exception:  # pylint: disable=broad-except
+			# paging urls expire, items come in id order so carry on after the last one
+			if state.get("last_id") is None:
+				raise
+			# added to the rendered body, which also covers compiled Queries
+			body = json.loads(self.body)
+			body["filter"].append({"op": "gt", "field": "id", "value": str(state["last_id"])})
+			return self.site._query_page(self.entity, json.dumps(body))  # pylint: disable=protected-access
+
+	def run(self, resume=True):
+		"""Export every item, returning how many were written
+		:param resume: continue an interrupted run instead of starting over
+		"""
+		state = self._load_state() if resume and WRITERS[self.format].resumable else None
+		if state is None:
+			file = open(self.part_path, "w+b")  # pylint: disable=consider-using-with
+			state = {}
+			self.records = 0
+		else:
+			file = open(self.part_path, "r+b")  # pylint: disable=consider-using-with
+			file.truncate(state["offset"])
+			file.seek(state["offset"])
+			self.records = state["records"]
+		try:
+			writer = WRITERS[self.format](file, state)
+			try:
+				if state:
+					items, next_url = self._resume_page(state)
+				else:
+					items, next_url = self.site._query_page(self.entity, self.body)  # pylint: disable=protected-access
+				last_id = state.get("last_id")
+				while True:
+					rows = [flatten(item) if self.flatten_udfs else dict(item) for item in items]
+					writer.write(rows)
+					self.records += len(rows)
+					if rows:
+						last_id = rows[-1].get("id", last_id)
+					if not next_url:
+						break
+					if writer.resumable:
+						self._save_state(file, writer, next_url, last_id)
+					items, next_url = self.site._read_page(next_url)  # pylint: disable=protected-access
+			finally:
+				writer.close()
+			file.flush()
+			os.fsync(file.fileno())
+		finally:
+			file.close()
+		os.replace(self.part_path, self.path)
+		if os.path.exists(self.state_path):
+			os.remove(self.state_path)
+		return self.records
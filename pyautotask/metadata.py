@@ -0,0 +1,64 @@
+"""
+Indexes over Autotask entity field and User Defined Field definitions
+"""
+
+
+class Picklist:
+
+	"""Label to value and value to label lookups for one picklist field
+
+	Built once from the field definitions, after that every lookup is a
+	dict access. Labels also match case-insensitively.
+	"""
+
+	def __init__(self, entity, field, values):
+		"""
+		:param values: the field's picklistValues from entityInformation
+		"""
+		self.entity = entity
+		self.field = field
+		self.values = values
+		self._by_label = {}
+		self._by_folded_label = {}
+		self._by_value = {}
+		# inactive entries go first so an active one with the same label wins
+		for entry in sorted(values, key=lambda entry: bool(entry.get("isActive", True))):
+			value, label = str(entry["value"]), entry.get("label")
+			self._by_value[value] = label
+			if label is not None:
+				self._by_label[label] = value
+				self._by_folded_label[label.casefold()] = value
+
+	@classmethod
+	def from_fields(cls, entity, fields, field):
+		"""Build the Picklist of field from an entityInformation response
+		:param fields: response of entityInformation/fields or /userDefinedFields
+		"""
+		for definition in fields.get("fields", []):
+			if definition.get("name") == field:
+				if not definition.get("isPickList"):
+					raise KeyError(entity + "." + field + " is not a picklist")
+				return cls(entity, field, definition.get("picklistValues") or [])
+		raise KeyError(entity + " has no field " + field)
+
+	def value(self, label):
+		"""Return the value stored for label, ie "14" for issueType "Alert" """
+		value = self._by_label.get(label)
+		if value is None:
+			value = self._by_folded_label.get(str(label).casefold())
+		if value is None:
+			raise KeyError(self.entity + "." + self.field + " has no value labelled " + repr(label))
+		return value
+
+	def label(self, value):
+		"""Return the label shown for value"""
+		try:
+			return self._by_value[str(value)]
+		except KeyError:
+			raise KeyError(self.entity + "." + self.field + " has no value " + repr(value)) from None
+
+	def labels(self):
+		return list(self._by_label)
+
+	def __contains__(self, label):
+		return label in self._by_label or str(label).casefold() in self._by_folded_label
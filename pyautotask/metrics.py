@@ -0,0 +1,187 @@
+"""
+Per request instrumentation: counters, latency percentiles and hooks
+"""
+import contextlib
+import contextvars
+import logging
+import threading
+import time
+from collections import deque, namedtuple
+
+CONS_LOG = logging.getLogger(__name__)
+
+# one HTTP attempt, retries of a request are separate events
+RequestEvent = namedtuple("RequestEvent", [
+	"entity",  # ie "ConfigurationItems", "" when the url isn't under the site's
+	"verb",  # "query", "count" or the HTTP method for other endpoints
+	"method",
+	"url",
+	"status",  # None when the request failed without a response
+	"latency",  # seconds
+	"bytes",  # response body size
+	"pages",  # 1 for a page of query results, else 0
+	"error",  # exception raised instead of a response
+	"operation",  # name given with RequestMetrics.operation, or None
+])
+
+_operation = contextvars.ContextVar("pyautotask_operation", default=None)
+
+
+def percentile(samples, fraction):
+	"""Return the nearest rank percentile of sorted samples"""
+	if not samples:
+		return None
+	return samples[min(len(samples) - 1, max(0, int(round(fraction * len(samples))) - 1))]
+
+
+class EndpointStats:
+
+	"""Counters and a rolling latency window for one entity and verb"""
+
+	def __init__(self, window):
+		self.calls = 0
+		self.errors = 0
+		self.throttled = 0
+		self.bytes = 0
+		self.pages = 0
+		self.latencies = deque(maxlen=window)
+
+	def add(self, event):
+		self.calls += 1
+		if event.status is None or event.status >= 400:
+			self.errors += 1
+		if event.status == 429:
+			self.throttled += 1
+		self.bytes += event.bytes
+		self.pages += event.pages
+		self.latencies.append(event.latency)
+
+	def summary(self):
+		latencies = sorted(self.latencies)
+		return {
+			'calls': self.calls,
+			'errors': self.errors,
+			'throttled': self.throttled,
+			'bytes': self.bytes,
+			'pages': self.pages,
+			'p50': percentile(latencies, 0.5),
+			'p95': percentile(latencies, 0.95),
+			'max': latencies[-1] if latencies else None,
+		}
+
+
+class RequestMetrics:
+
+	"""Collects a RequestEvent for every HTTP attempt a site makes
+
+	Keeps call, error, byte and page counters per entity and verb with the
+	latencies of the last window calls for percentiles, and per operation
+	call counts to see what spends the hourly quota.
+	>>> with site.metrics.operation("nightly ci sync"):
+	...	 site.get_cis(all_pages=True)
+	>>> site.metrics.summary()["endpoints"]["ConfigurationItems query"]["p95"]
+
+	Safe to share between threads.
+	"""
+
+	def __init__(self, window=1024, exporter=None, export_interval=60):
+		"""
+		:param window: latencies kept per endpoint
+		:param exporter: called with summary() every export_interval seconds,
+			ie log_exporter()
+		:param export_interval: seconds between exports, checked as requests finish
+		"""
+		self.window = window
+		self.exporter = exporter
+		self.export_interval = export_interval
+		self.hooks = []
+		self._endpoints = {}
+		self._operations = {}
+		self._lock = threading.Lock()
+		self._exported = time.monotonic()
+
+	def add_hook(self, hook):
+		"""Call hook(event) for every RequestEvent, from the thread that made the request"""
+		self.hooks.append(hook)
+
+	def remove_hook(self, hook):
+		self.hooks.remove(hook)
+
+	@staticmethod
+	@contextlib.contextmanager
+	def operation(name):
+		"""Attribute requests made inside the block to name
+
+		Tasks inherit it, and so do the worker threads of the site's
+		concurrent helpers and write-behind queue. Other threads don't.
+		"""
+		token = _operation.set(name)
+		try:
+			yield
+		finally:
+			_operation.reset(token)
+
+	def record(self, event):
+		"""Count event and pass it to the hooks"""
+		event = event._replace(operation=_operation.get())
+		key = event.entity + " " + event.verb
+		with self._lock:
+			stats = self._endpoints.get(key)
+			if stats is None:
+				stats = self._endpoints[key] = EndpointStats(self.window)
+			stats.add(event)
+			if event.operation is not None:
+				self._operations[event.operation] = self._operations.get(event.operation, 0) + 1
+			export = self.exporter is not None and \
+				time.monotonic() - self._exported >= self.export_interval
+			if export:
+				self._exported = time.monotonic()
+		for hook in list(self.hooks):
+			try:
+				hook(event)
+			except Exception:  # pylint: disable=broad-except
+				CONS_LOG.exception("Request hook %r failed", hook)
+		if export:
+			self.export()
+
+	def summary(self):
+		"""Return the counters as a dict
+
+		{'calls': n, 'endpoints': {"Entity verb": {...}}, 'operations': {name: calls}}
+		"""
+		with self._lock:
+			endpoints = {key: stats.summary() for key, stats in sorted(self._endpoints.items())}
+			operations = dict(self._operations)
+		return {
+			'calls': sum(stats['calls'] for stats in endpoints.values()),
+			'endpoints': endpoints,
+			'operations': operations,
+		}
+
+	def export(self):
+		"""Hand the summary to the exporter now"""
+		if self.exporter is not None:
+			try:
+				self.exporter(self.summary())
+			except Exception:  # pylint: disable=broad-except
+				CONS_LOG.exception("Metrics exporter %r failed", self.exporter)
+
+	def reset(self):
+		with self._lock:
+			self._endpoints.clear()
+			self._operations.clear()
+
+
+def log_exporter(logger=CONS_LOG, level=logging.INFO):
+	"""Return an exporter logging a line per endpoint, busiest first"""
+	def export(summary):
+		endpoints = sorted(summary['endpoints'].items(), key=lambda item: -item[1]['calls'])
+		for key, stats in endpoints:
+			logger.log(level, "%s: %d calls, %d errors, %d throttled, %d pages, %d bytes, p50 %s p95 %s",
+					   key, stats['calls'], stats['errors'], stats['throttled'], stats['pages'], stats['bytes'],
+					   _ms(stats['p50']), _ms(stats['p95']))
+	return export
+
+
+def _ms(seconds):
+	return "-" if seconds is None else "%.0fms" % (seconds * 1000)
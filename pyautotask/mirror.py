@@ -0,0 +1,151 @@
+"""
+Local SQLite mirror of Autotask entities, kept current by incremental syncs
+"""
+import json
+import re
+import sqlite3
+import threading
+import time
+
+from .query import exist
+from .records import jsonable
+
+# field holding the last change time of each entity, used as the sync watermark.
+# Entities not listed are fully reloaded by every sync.
+MODIFIED_FIELDS = {
+	"Companies": "lastTrackedModifiedDateTime",
+	"ConfigurationItems": "lastModifiedTime",
+	"Contacts": "lastModifiedDate",
+	"Contracts": "lastModifiedDateTime",
+	"Tickets": "lastActivityDate",
+}
+
+# fields with their own indexed column, other fields are read from the JSON
+INDEXED_FIELDS = ("serialNumber", "companyID", "dattoHostname")
+
+
+class Mirror:
+
+	"""Keep a local copy of Autotask entities and answer queries from it
+
+	The first sync of an entity loads every record, later syncs only fetch
+	records changed since the newest change seen so far.
+	>>> mirror = Mirror(site, "autotask.db")
+	>>> mirror.sync("ConfigurationItems")
+	>>> mirror.find("ConfigurationItems", serialNumber="ABC123")
+
+	Incremental syncs can't see deleted records, sync(entity, full=True)
+	reloads the entity from scratch.
+	"""
+
+	def __init__(self, site, path, modified_fields=None):
+		"""
+		:param site: atSite to sync from
+		:param path: SQLite database file
+		:param modified_fields: dict of entity to watermark field, overriding MODIFIED_FIELDS
+		"""
+		self.site = site
+		self.modified_fields = dict(MODIFIED_FIELDS, **(modified_fields or {}))
+		self._db = sqlite3.connect(path, check_same_thread=False)
+		self._lock = threading.RLock()
+		self._tables = set()
+		with self._lock, self._db:
+			self._db.execute(
+				"CREATE TABLE IF NOT EXISTS watermarks (entity TEXT PRIMARY KEY, modified TEXT, synced REAL)")
+
+	def close(self):
+		self._db.close()
+
+	def _table(self, entity):
+		if entity in self._tables:
+			return entity
+		if not re.match(r"^[A-Za-z]+$", entity):
+			raise ValueError("Not an entity name: " + entity)
+		columns = "".join(", " + field + " TEXT" for field in INDEXED_FIELDS)
+		with self._db:
+			self._db.execute("CREATE TABLE IF NOT EXISTS " + entity
+							 + " (id INTEGER PRIMARY KEY" + columns + ", data TEXT)")
+			for field in INDEXED_FIELDS:
+				self._db.execute("CREATE INDEX IF NOT EXISTS " + entity + "_" + field
+								 + " ON " + entity + " (" + field + ")")
+		self._tables.add(entity)
+		return entity
+
+	def watermark(self, entity):
+		"""Return the newest change time synced for entity, or None"""
+		with self._lock:
+			row = self._db.execute("SELECT modified FROM watermarks WHERE entity = ?", (entity,)).fetchone()
+		return row[0] if row else None
+
+	def sync(self, entity, full=False):
+		"""Bring the local copy of entity up to date
+		:param full: reload every record instead of just the changed ones
+		:returns: number of records fetched
+		"""
+		field = self.modified_fields.get(entity)
+		watermark = None if full or field is None else self.watermark(entity)
+		if watermark is None:
+			filter_fields = exist("id")
+		else:
+			# gte, records changed in the same instant as the watermark are refetched
+			filter_fields = self.site.create_filter("gte", field, watermark)
+
+		fetched = 0
+		newest = watermark
+		with self._lock:
+			table = self._table(entity)
+			# one transaction, a failed sync leaves the previous copy in place
+			with self._db:
+				if watermark is None:
+					self._db.execute("DELETE FROM " + table)
+				for page in self.site.iter_pages(entity, filter_fields):
+					self._db.executemany(
+						"INSERT OR REPLACE INTO " + table + " VALUES (?" + ", ?" * (len(INDEXED_FIELDS) + 1) + ")",
+						[self._row(item) for item in page])
+					fetched += len(page)
+					if field is not None:
+						modified = [item[field] for item in page if item.get(field)]
+						if modified:
+							newest = max(modified + ([newest] if newest else []))
+				self._db.execute("INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?)",
+								 (entity, newest, time.time()))
+		return fetched
+
+	@staticmethod
+	def _row(item):
+		keys = tuple(None if item.get(field) is None else str(item[field]) for field in INDEXED_FIELDS)
+		return (item["id"],) + keys + (json.dumps(item, default=jsonable),)
+
+	def _where(self, criteria):
+		clauses, values = [], []
+		for field, value in criteria.items():
+			if field == "id":
+				clauses.append("id = ?")
+				values.append(value)
+			elif field in INDEXED_FIELDS:
+				clauses.append(field + " = ?")
+				values.append(str(value))
+			elif re.match(r"^[A-Za-z0-9_]+$", field):
+				clauses.append("json_extract(data, '$." + field + "') = ?")
+				values.append(value)
+			else:
+				raise ValueError("Not a field name: " + field)
+		return (" WHERE " + " AND ".join(clauses) if clauses else ""), values
+
+	def find(self, entity, **criteria):
+		"""Return the local records of entity whose fields equal criteria"""
+		where, values = self._where(criteria)
+		with self._lock:
+			rows = self._db.execute("SELECT data FROM " + self._table(entity) + where, values).fetchall()
+		return [json.loads(row[0]) for row in rows]
+
+	def get(self, entity, item_id):
+		"""Return the local record of entity with item_id, or None"""
+		found = self.find(entity, id=int(item_id))
+		return found[0] if found else None
+
+	def count(self, entity, **criteria):
+		"""Return how many local records of entity match criteria"""
+		where, values = self._where(criteria)
+		with self._lock:
+			return self._db.execute("SELECT COUNT(*) FROM " + self._table(entity) + where, values).fetchone()[0]
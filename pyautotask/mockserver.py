@@ -0,0 +1,558 @@
+"""
+Local stand-in for the Autotask REST API, for benchmarks and offline runs
+
+Serves the endpoints atSite uses from an in-memory, generated dataset:
+queries with pageDetails/nextPageUrl paging and query counts, record reads,
+creates and updates, parent/child urls, entityInformation and
+zoneInformation, with configurable latency and throttling.
+>>> with MockAutotask(cis=5000, latency=0.02) as mock:
+...	 site = atSite(None, "user", "secret", "code", base_url=mock.url)
+...	 len(site.get_cis(all_pages=True))
+5000
+
+python -m pyautotask.mockserver --port 8000 --cis 5000 --latency 0.05
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+API_PATH = "/ATServicesRest/V1.0/"
+
+# largest page Autotask returns
+PAGE_SIZE = 500
+
+# nextPageUrls kept alive at once
+MAX_CURSORS = 1000
+
+# field linking a child to its parent in parent/child urls, ie Companies/5/Contacts
+PARENT_FIELDS = {
+	"Companies": "companyID",
+	"Contracts": "contractID",
+	"Tickets": "ticketID",
+	"ConfigurationItems": "configurationItemID",
+}
+
+# entities behind parent/child urls named differently from the child, ie Companies/5/Alerts
+CHILD_ENTITIES = {
+	("Companies", "Alerts"): "CompanyAlerts",
+	("Companies", "Notes"): "CompanyNotes",
+	("Tickets", "Notes"): "TicketNotes",
+}
+
+THREAD_THRESHOLD_ERROR = "The request was rejected because the thread threshold for this integration has been exceeded"
+
+TICKET_PICKLISTS = {
+	"issueType": [("14", "Alert"), ("5", "Request"), ("8", "Incident")],
+	"queueID": [("8", "Monitoring Alert"), ("5", "Client Portal"), ("6", "Level I Support")],
+	"status": [("1", "New"), ("5", "Complete"), ("8", "In Progress")],
+	"priority": [("1", "High"), ("2", "Medium"), ("3", "Low")],
+	"source": [("8", "Monitoring Alert"), ("4", "Phone"), ("2", "Email")],
+}
+
+_FIRST_DATE = datetime(2023, 1, 1)
+
+
+def _date(value):
+	return value.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def _now():
+	return _date(datetime.utcnow())
+
+
+def _coerce(value, like):
+	"""Return a filter value as the type of the record field it is compared with"""
+	if isinstance(like, bool):
+		return str(value).lower() in ("1", "true")
+	if isinstance(like, (int, float)) and not isinstance(value, bool):
+		try:
+			return float(value)
+		except (TypeError, ValueError):
+			return value
+	return value if isinstance(value, str) or value is None else str(value)
+
+
+def _field_value(record, condition):
+	if condition.get("udf"):
+		for udf in record.get("userDefinedFields") or ():
+			if udf.get("name") == condition.get("field"):
+				return udf.get("value")
+		return None
+	return record.get(condition.get("field"))
+
+
+def _compare(op, actual, expected):  # pylint: disable=r0911
+	if op in ("exist", "notExist"):
+		return (actual not in (None, "")) == (op == "exist")
+	if op in ("in", "notIn"):
+		# prepare() turned the values into a set of casefolded strings
+		return (str(actual).casefold() in expected) == (op == "in")
+	if actual is None:
+		return op == "noteq" and expected is not None
+	expected = _coerce(expected, actual)
+	if isinstance(actual, str) and isinstance(expected, str) and op in ("eq", "noteq"):
+		# Autotask compares strings case-insensitively
+		actual, expected = actual.casefold(), expected.casefold()
+	try:
+		if op == "eq":
+			return actual == expected
+		if op == "noteq":
+			return actual != expected
+		if op == "gt":
+			return actual > expected
+		if op == "gte":
+			return actual >= expected
+		if op == "lt":
+			return actual < expected
+		if op == "lte":
+			return actual <= expected
+	except TypeError:
+		return False
+	if op == "beginsWith":
+		return str(actual).lower().startswith(str(expected).lower())
+	if op == "endsWith":
+		return str(actual).lower().endswith(str(expected).lower())
+	if op == "contains":
+		return str(expected).lower() in str(actual).lower()
+	raise ValueError("Unsupported filter op " + str(op))
+
+
+def prepare(conditions):
+	"""Return filter conditions ready for matches, sets for 'in' values"""
+	prepared = []
+	for condition in conditions:
+		condition = dict(condition)
+		if condition.get("op") in ("and", "or"):
+			condition["items"] = prepare(condition.get("items") or [])
+		elif condition.get("op") in ("in", "notIn"):
+			condition["value"] = frozenset(str(value).casefold() for value in condition.get("value") or ())
+		prepared.append(condition)
+	return prepared
+
+
+def matches(record, conditions, grouping="and"):
+	"""Return whether record passes a list of Autotask filter conditions"""
+	results = (
+		matches(record, condition.get("items") or [], condition["op"])
+		if condition.get("op") in ("and", "or") else
+		_compare(condition.get("op"), _field_value(record, condition), condition.get("value"))
+		for condition in conditions)
+	return any(results) if grouping == "or" else all(results)
+
+
+class MockError(Exception):
+
+	"""Answered as an Autotask {"errors": [...]} response"""
+
+	def __init__(self, status, message):
+		super().__init__(message)
+		self.status = status
+
+
+class MockAutotask:
+
+	"""In-memory Autotask tenant served over HTTP on localhost
+
+	Records are dicts per entity keyed by id. Any entity name can be queried,
+	those not generated start out empty and fill up as they are created.
+	"""
+
+	def __init__(  # pylint: disable=r0913
+			self,
+			cis=1000,
+			companies=50,
+			tickets=0,
+			service_calls=0,
+			udfs=5,
+			latency=0.0,
+			jitter=0.0,
+			throttle_rate=0.0,
+			retry_after=None,
+			max_concurrent=None,
+			page_size=PAGE_SIZE,
+			host="127.0.0.1",
+			port=0,
+			seed=0
+	):
+		"""
+		:param cis: ConfigurationItems to generate, spread over the companies
+		:param companies: Companies to generate, each with two Contacts
+		:param tickets: Tickets to generate, a quarter of them Complete
+		:param service_calls: ServiceCalls to generate over the year from 2023-01-01
+		:param udfs: User Defined Fields on each CI
+		:param latency: seconds each request takes before it is answered
+		:param jitter: extra random seconds up to this much on top of latency
+		:param throttle_rate: fraction of requests rejected with a 429
+		:param retry_after: Retry-After header of 429s, None to leave it out
+		:param max_concurrent: requests served at once before the rest get
+			Autotask's thread threshold error, None for no limit
+		:param page_size: items per page of query results
+		:param port: port to listen on, 0 picks a free one
+		:param seed: seed of the generated data and of throttling
+		"""
+		self.latency = latency
+		self.jitter = jitter
+		self.throttle_rate = throttle_rate
+		self.retry_after = retry_after
+		self.max_concurrent = max_concurrent
+		self.page_size = page_size
+		self.host = host
+		self.port = port
+		# requests answered, and those rejected by throttling
+		self.requests = 0
+		self.throttled = 0
+		self.data = {}
+		self.udf_names = ["UDF %d" % udf for udf in range(udfs)]
+		self._random = random.Random(seed)
+		self._lock = threading.Lock()
+		self._in_flight = 0
+		self._cursors = OrderedDict()
+		self._next_ids = {}
+		self._server = None
+		self._thread = None
+		self._generate(cis, companies, tickets, service_calls)
+
+	# Dataset
+	def _generate(self, cis, companies, tickets, service_calls):
+		rand = self._random
+		self.data["Companies"] = {}
+		self.data["Contacts"] = {}
+		for company_id in range(1, companies + 1):
+			self.data["Companies"][company_id] = {
+				"id": company_id, "companyName": "Company %d" % company_id, "companyType": 1,
+				"isActive": True, "lastActivityDate": _date(_FIRST_DATE), "userDefinedFields": []}
+			for contact in range(2):
+				contact_id = company_id * 2 - 1 + contact
+				self.data["Contacts"][contact_id] = {
+					"id": contact_id, "companyID": company_id, "firstName": "Contact", "lastName": str(contact_id),
+					"emailAddress": "contact%d@company%d.example" % (contact_id, company_id), "isActive": 1,
+					"userDefinedFields": []}
+		self.data["ConfigurationItemTypes"] = {1: {"id": 1, "name": "Network Device", "isActive": True}}
+		self.data["ConfigurationItemCategories"] = {3: {"id": 3, "name": "Standard", "isActive": True}}
+		self.data["Products"] = {
+			product_id: {"id": product_id, "name": "Product %d" % product_id, "sku": "SKU-%d" % product_id,
+						 "isActive": True}
+			for product_id in range(1, 41)}
+		self.data["Resources"] = {
+			resource_id: {"id": resource_id, "email": "tech%d@example.com" % resource_id, "isActive": True}
+			for resource_id in range(1, 11)}
+		self.data["ConfigurationItems"] = {}
+		for ci_id in range(1, cis + 1):
+			self.data["ConfigurationItems"][ci_id] = {
+				"id": ci_id,
+				"companyID": ci_id % max(1, companies) + 1,
+				"configurationItemCategoryID": 3,
+				"configurationItemType": 1,
+				"dattoHostname": "host-%d" % ci_id,
+				"installDate": _date(_FIRST_DATE),
+				"isActive": True,
+				"lastModifiedTime": _date(_FIRST_DATE + timedelta(minutes=ci_id)),
+				"productID": ci_id % 40 + 1,
+				"referenceTitle": "Device %d" % ci_id,
+				"serialNumber": "SN%08d" % ci_id,
+				"userDefinedFields": [{"name": name, "value": str(rand.randint(0, 1000))} for name in self.udf_names],
+			}
+		self.data["Tickets"] = {}
+		for ticket_id in range(1, tickets + 1):
+			created = _FIRST_DATE + timedelta(minutes=rand.randint(0, 525600))
+			self.data["Tickets"][ticket_id] = {
+				"id": ticket_id, "ticketNumber": "T%08d" % ticket_id,
+				"companyID": ticket_id % max(1, companies) + 1,
+				"configurationItemID": rand.randint(1, cis) if cis else None,
+				"title": "Alert %d" % (ticket_id % 20), "description": "",
+				"issueType": 14, "priority": 1, "source": 8, "queueID": 8,
+				"status": 5 if ticket_id % 4 == 0 else 1, "assignedResourceID": None,
+				"createDate": _date(created), "lastActivityDate": _date(created)}
+		self.data["ServiceCalls"] = {}
+		for call_id in range(1, service_calls + 1):
+			start = _FIRST_DATE + timedelta(minutes=rand.randint(0, 525600))
+			self.data["ServiceCalls"][call_id] = {
+				"id": call_id, "companyID": call_id % max(1, companies) + 1, "isComplete": call_id % 3 == 0,
+				"startDateTime": _date(start), "endDateTime": _date(start + timedelta(hours=1))}
+
+	def _records(self, entity):
+		# entity names are case insensitive in urls
+		for name, records in self.data.items():
+			if name.lower() == entity.lower():
+				return name, records
+		return entity, self.data.setdefault(entity, {})
+
+	def _next_id(self, name, records):
+		next_id = max(self._next_ids.get(name, 0), max(records, default=0)) + 1
+		self._next_ids[name] = next_id
+		return next_id
+
+	# Requests
+	def _page(self, name, items, include_fields, size, offset=0):
+		page = items[offset:offset + size]
+		if include_fields:
+			fields = set(include_fields) | {"id"}
+			page = [{field: value for field, value in item.items() if field in fields} for item in page]
+		next_url = None
+		if offset + size < len(items):
+			token = "%x" % random.getrandbits(64)
+			self._cursors[token] = (items, include_fields, size)
+			while len(self._cursors) > MAX_CURSORS:
+				self._cursors.popitem(last=False)
+			next_url = self.url + name + "/query/next?" + urllib.parse.urlencode(
+				{"paging": token, "offset": offset + size})
+		return {"items": page, "pageDetails": {"count": len(page), "requestCount": size,
+											   "prevPageUrl": None, "nextPageUrl": next_url}}
+
+	def _search(self, entity, query):
+		name, records = self._records(entity)
+		conditions = prepare(query.get("filter") or query.get("Filter") or [])
+		items = [record for _id, record in sorted(records.items()) if matches(record, conditions)]
+		include_fields = query.get("IncludeFields") or query.get("includeFields")
+		size = min(self.page_size, int(query.get("MaxRecords") or query.get("maxRecords") or self.page_size))
+		return name, items, include_fields, size
+
+	def query(self, entity, query):
+		"""Answer a query body, returning the first page"""
+		name, items, include_fields, size = self._search(entity, query)
+		return self._page(name, items, include_fields, size)
+
+	def count(self, entity, query):
+		"""Answer a query/count body"""
+		return {"queryCount": len(self._search(entity, query)[1])}
+
+	def next_page(self, entity, params):
+		cursor = self._cursors.get(params.get("paging", [""])[0])
+		if cursor is None:
+			raise MockError(404, "Paging token expired or unknown")
+		items, include_fields, size = cursor
+		return self._page(entity, items, include_fields, size, int(params.get("offset", ["0"])[0]))
+
+	def get(self, entity, item_id):
+		record = self._records(entity)[1].get(int(item_id))
+		return {"item": record}
+
+	def create(self, entity, body, parent=None):
+		"""Create a record, returning its itemId"""
+		name, records = self._records(entity)
+		record = dict(body)
+		if parent is not None:
+			record[PARENT_FIELDS.get(parent[0], parent[0].rstrip("s") + "ID")] = int(parent[1])
+		record["id"] = self._next_id(name, records)
+		record.setdefault("userDefinedFields", [])
+		record["lastModifiedTime"] = record["lastActivityDate"] = record.setdefault("createDate", _now())
+		records[record["id"]] = record
+		return {"itemId": record["id"]}
+
+	def update(self, entity, body):
+		"""PATCH a record, User Defined Fields are merged by name"""
+		name, records = self._records(entity)
+		record = records.get(int(body.get("id") or 0))
+		if record is None:
+			raise MockError(404, "No " + name + " with id " + str(body.get("id")))
+		for field, value in body.items():
+			if field == "userDefinedFields":
+				udfs = {udf["name"]: udf for udf in record.get("userDefinedFields") or ()}
+				for udf in value or ():
+					udfs[udf["name"]] = dict(udf)
+				record["userDefinedFields"] = list(udfs.values())
+			else:
+				record[field] = value
+		record["lastModifiedTime"] = record["lastActivityDate"] = _now()
+		return {"itemId": record["id"]}
+
+	def entity_fields(self, entity):
+		name, records = self._records(entity)
+		picklists = TICKET_PICKLISTS if name == "Tickets" else {}
+		fields = set(picklists)
+		for record in list(records.values())[:10]:
+			fields.update(field for field in record if field != "userDefinedFields")
+		return {"fields": [
+			{"name": field, "isPickList": field in picklists, "isReadOnly": field == "id",
+			 "picklistValues": [{"value": value, "label": label, "isActive": True, "sortOrder": order}
+								for order, (value, label) in enumerate(picklists.get(field, ()))] or None}
+			for field in sorted(fields)]}
+
+	def entity_udfs(self, entity):
+		names = self.udf_names if self._records(entity)[0] == "ConfigurationItems" else []
+		return {"fields": [{"name": name, "dataType": 1, "isPickList": False, "isActive": True} for name in names]}
+
+	def zone(self):
+		return {"zoneName": "Mock", "url": "http://%s:%d/ATServicesRest/" % (self.host, self.port),
+				"webUrl": "http://%s:%d/" % (self.host, self.port), "ci": 0}
+
+	def handle(self, method, path, params, body):  # pylint: disable=r0911,r0912
+		"""Route one request, returning the response object"""
+		parts = [urllib.parse.unquote(part) for part in path[len(API_PATH):].split("/") if part]
+		if parts == ["zoneInformation"]:
+			return self.zone()
+		if not parts:
+			raise MockError(404, "Not found")
+		entity, rest = parts[0], parts[1:]
+		if rest[:1] == ["entityInformation"]:
+			if rest[1:] == ["fields"]:
+				return self.entity_fields(entity)
+			if rest[1:] == ["userDefinedFields"]:
+				return self.entity_udfs(entity)
+			return {"name": entity, "canCreate": True, "canQuery": True, "canUpdate": True}
+		if rest[:1] == ["query"]:
+			query = body if method == "POST" else json.loads(params.get("search", ["{}"])[0])
+			if rest[1:] == ["count"]:
+				return self.count(entity, query)
+			if rest[1:] == ["next"]:
+				return self.next_page(entity, params)
+			return self.query(entity, query)
+		if len(rest) >= 2:
+			# Parent/{id}/Child
+			child = CHILD_ENTITIES.get((self._records(entity)[0], rest[1]), rest[1])
+			if len(rest) == 2 and method == "POST":
+				return self.create(child, body, (entity, rest[0]))
+			if len(rest) == 2 and method in ("PATCH", "PUT"):
+				return self.update(child, body)
+			if method == "GET":
+				if len(rest) == 3:
+					return self.get(child, rest[2])
+				field = PARENT_FIELDS.get(entity, entity.rstrip("s") + "ID")
+				return self.query(child, {"filter": [{"op": "eq", "field": field, "value": rest[0]}]})
+		if not rest and method == "POST":
+			return self.create(entity, body)
+		if not rest and method in ("PATCH", "PUT"):
+			return self.update(entity, body)
+		if len(rest) == 1 and method == "GET":
+			return self.get(entity, rest[0])
+		raise MockError(404, "No route for " + method + " " + path)
+
+	# Server
+	@property
+	def url(self):
+		"""REST url to pass an atSite as base_url"""
+		return "http://%s:%d%s" % (self.host, self.port, API_PATH)
+
+	@property
+	def zone_url(self):
+		"""zoneInformation url to pass atSite.from_zone"""
+		return self.url + "zoneInformation"
+
+	def start(self):
+		"""Serve on a background thread"""
+		self._server = ThreadingHTTPServer((self.host, self.port), _make_handler(self))
+		self._server.daemon_threads = True
+		self.port = self._server.server_address[1]
+		# stop() waits up to a poll interval for the serving thread
+		self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), name="mock-autotask",
+										daemon=True)
+		self._thread.start()
+		return self
+
+	def stop(self):
+		if self._server is not None:
+			self._server.shutdown()
+			self._server.server_close()
+			self._server = None
+
+	def __enter__(self):
+		return self.start()
+
+	def __exit__(self, *exc):
+		self.stop()
+
+	def _admit(self):
+		"""Count a request in, returning the throttling error to answer it with, if any"""
+		with self._lock:
+			self.requests += 1
+			if self.max_concurrent is not None and self._in_flight >= self.max_concurrent:
+				self.throttled += 1
+				return THREAD_THRESHOLD_ERROR
+			if self.throttle_rate and self._random.random() < self.throttle_rate:
+				self.throttled += 1
+				return "Too many requests"
+			self._in_flight += 1
+			return None
+
+	def serve(self, method, path, params, headers, body):
+		"""Answer a request, returning (status, headers, response object)"""
+		throttled = self._admit()
+		if throttled is not None:
+			extra = {"Retry-After": str(self.retry_after)} if self.retry_after is not None else {}
+			return 429, extra, {"errors": [throttled]}
+		try:
+			delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+			if delay:
+				time.sleep(delay)
+			if not path.endswith("/zoneInformation") and not headers.get("ApiIntegrationCode"):
+				raise MockError(401, "Missing ApiIntegrationCode header")
+			with self._lock:
+				return 200, {}, self.handle(method, path, params, body)
+		except MockError as err:
+			return err.status, {}, {"errors": [str(err)]}
+		except (ValueError, TypeError, KeyError) as err:
+			return 500, {}, {"errors": [repr(err)]}
+		finally:
+			with self._lock:
+				self._in_flight -= 1
+
+
+def _make_handler(mock):
+
+	class Handler(BaseHTTPRequestHandler):
+
+		"""Hands requests to the MockAutotask"""
+
+		protocol_version = "HTTP/1.1"
+		# headers and body go out in separate writes, don't let them wait on delayed acks
+		disable_nagle_algorithm = True
+
+		def log_message(self, *args):  # pylint: disable=arguments-differ
+			pass
+
+		def _handle(self):
+			url = urllib.parse.urlsplit(self.path)
+			length = int(self.headers.get("Content-Length") or 0)
+			raw = self.rfile.read(length) if length else b""
+			try:
+				body = json.loads(raw) if raw else {}
+			except ValueError:
+				status, headers, obj = 400, {}, {"errors": ["Request body is not JSON"]}
+			else:
+				status, headers, obj = mock.serve(
+					self.command, url.path, urllib.parse.parse_qs(url.query), self.headers, body)
+			data = json.dumps(obj).encode()
+			self.send_response(status)
+			self.send_header("Content-Type", "application/json; charset=utf-8")
+			self.send_header("Content-Length", str(len(data)))
+			for header, value in headers.items():
+				self.send_header(header, value)
+			self.end_headers()
+			self.wfile.write(data)
+
+		do_GET = do_POST = do_PATCH = do_PUT = _handle
+
+	return Handler
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Serve a mock Autotask REST API")
+	parser.add_argument("--host", default="127.0.0.1")
+	parser.add_argument("--port", type=int, default=8000)
+	parser.add_argument("--cis", type=int, default=1000)
+	parser.add_argument("--companies", type=int, default=50)
+	parser.add_argument("--tickets", type=int, default=0)
+	parser.add_argument("--service-calls", type=int, default=0)
+	parser.add_argument("--latency", type=float, default=0.0, help="seconds per request")
+	parser.add_argument("--throttle", type=float, default=0.0, help="fraction of requests answered 429")
+	parser.add_argument("--max-concurrent", type=int, default=None)
+	args = parser.parse_args()
+	mock = MockAutotask(cis=args.cis, companies=args.companies, tickets=args.tickets,
+						service_calls=args.service_calls, latency=args.latency, throttle_rate=args.throttle,
+						max_concurrent=args.max_concurrent, host=args.host, port=args.port)
+	mock.start()
+	print("Serving " + mock.url)
+	try:
+		mock._thread.join()  # pylint: disable=protected-access
+	except KeyboardInterrupt:
+		mock.stop()
+
+
+if __name__ == "__main__":
+	main()
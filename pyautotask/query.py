@@ -0,0 +1,176 @@
+"""
+Structured queries for the Autotask REST API
+
+Build filters with the helpers and compile them into a Query once:
+>>> BY_SERIAL = Query(eq("serialNumber", Param("serial")), include_fields=["id", "companyID"])
+>>> site.get_cis(BY_SERIAL.bind(serial="ABC'123"))
+
+Values are JSON encoded, so quotes and other special characters are safe.
+"""
+import json
+
+
+class Param:
+
+	"""Placeholder for a value supplied each time a compiled Query runs"""
+
+	def __init__(self, name):
+		self.name = name
+
+	def __repr__(self):
+		return "Param(%r)" % self.name
+
+
+class Filter:
+
+	"""One filter condition, or an 'and'/'or' group of them"""
+
+	def __init__(self, op, field=None, value=None, udf=False, items=None):
+		self.op = op
+		self.field = field
+		self.value = value
+		self.udf = udf
+		self.items = items
+
+	def to_dict(self):
+		if self.items is not None:
+			return {"op": self.op, "items": [item.to_dict() for item in self.items]}
+		condition = {"op": self.op, "field": self.field}
+		if self.udf:
+			condition["udf"] = True
+		if self.op not in ("exist", "notExist"):
+			condition["value"] = self.value
+		return condition
+
+	def render(self):
+		"""Return the condition as JSON"""
+		return json.dumps(self.to_dict())
+
+	def __and__(self, other):
+		return and_(self, other)
+
+	def __or__(self, other):
+		return or_(self, other)
+
+
+def eq(field, value, udf=False):
+	return Filter("eq", field, value, udf)
+
+
+def noteq(field, value, udf=False):
+	return Filter("noteq", field, value, udf)
+
+
+def gt(field, value, udf=False):
+	return Filter("gt", field, value, udf)
+
+
+def gte(field, value, udf=False):
+	return Filter("gte", field, value, udf)
+
+
+def lt(field, value, udf=False):
+	return Filter("lt", field, value, udf)
+
+
+def lte(field, value, udf=False):
+	return Filter("lte", field, value, udf)
+
+
+def begins_with(field, value, udf=False):
+	return Filter("beginsWith", field, value, udf)
+
+
+def contains(field, value, udf=False):
+	return Filter("contains", field, value, udf)
+
+
+def exist(field, udf=False):
+	return Filter("exist", field, udf=udf)
+
+
+def not_exist(field, udf=False):
+	return Filter("notExist", field, udf=udf)
+
+
+def in_(field, values, udf=False):
+	"""field equals any of values, values may be a Param bound to a list"""
+	return Filter("in", field, values if isinstance(values, Param) else list(values), udf)
+
+
+def not_in(field, values, udf=False):
+	return Filter("notIn", field, values if isinstance(values, Param) else list(values), udf)
+
+
+def and_(*filters):
+	return Filter("and", items=list(filters))
+
+
+def or_(*filters):
+	return Filter("or", items=list(filters))
+
+
+class Query:
+
+	"""Query body compiled to JSON once and reused with different Params
+
+	The filters are and-ed together like Autotask does at the top level.
+	"""
+
+	def __init__(self, *filters, include_fields=None, max_records=None):
+		"""
+		:param filters: Filter conditions, at least one is required by Autotask
+		:param include_fields: only return these fields of each record
+		:param max_records: return at most this many records per page
+		"""
+		self.filters = filters
+		body = {"filter": [item.to_dict() for item in filters]}
+		if include_fields:
+			body["IncludeFields"] = list(include_fields)
+		if max_records:
+			body["MaxRecords"] = max_records
+
+		# Params become marker strings, the JSON is then split around them
+		names = []
+
+		def marker(param):
+			if not isinstance(param, Param):
+				raise TypeError("Can't encode %r in a query" % param)
+			names.append(param.name)
+			return "\0param\0"
+
+		compiled = json.dumps(body, default=marker, separators=(",", ":"))
+		self._parts = compiled.split(json.dumps("\0param\0"))
+		self._names = names
+
+	def render(self, **params):
+		"""Return the JSON body with params filled in"""
+		if len(self._parts) == 1:
+			return self._parts[0]
+		try:
+			values = [json.dumps(params[name]) for name in self._names]
+		except KeyError as err:
+			raise TypeError("Missing query param " + str(err)) from None
+		body = [self._parts[0]]
+		for value, part in zip(values, self._parts[1:]):
+			body.append(value)
+			body.append(part)
+		return "".join(body)
+
+	def bind(self, **params):
+		"""Return the query with params, ready to pass where a filter is taken"""
+		return BoundQuery(self, params)
+
+	__call__ = bind
+
+
+class BoundQuery:
+
+	"""A compiled Query with its Params supplied"""
+
+	def __init__(self, query, params):
+		self.query = query
+		self.params = params
+
+	def render(self):
+		return self.query.render(**self.params)
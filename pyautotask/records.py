@@ -0,0 +1,89 @@
+"""
+Compact, read-only records for holding large result sets in memory
+"""
+from collections.abc import Mapping
+
+
+class RecordSchema:
+
+	"""Field and User Defined Field names shared by many CompactRecords"""
+
+	__slots__ = ("fields", "index", "udf_names")
+
+	def __init__(self, fields, udf_names):
+		self.fields = fields
+		self.index = {field: position for position, field in enumerate(fields)}
+		self.udf_names = udf_names
+
+
+class CompactRecord(Mapping):
+
+	"""Tuple backed stand-in for a record dict
+
+	Field names live once in a shared RecordSchema, each record only keeps
+	its values. userDefinedFields is stored as bare values too and only
+	built into the usual list of {'name', 'value'} dicts when read.
+	"""
+
+	__slots__ = ("_schema", "_values", "_udf_values")
+
+	def __init__(self, schema, values, udf_values):
+		self._schema = schema
+		self._values = values
+		self._udf_values = udf_values
+
+	def __getitem__(self, field):
+		position = self._schema.index.get(field)
+		if position is not None:
+			return self._values[position]
+		if field == "userDefinedFields" and self._udf_values is not None:
+			return [{"name": name, "value": value}
+					for name, value in zip(self._schema.udf_names, self._udf_values)]
+		raise KeyError(field)
+
+	def __iter__(self):
+		yield from self._schema.fields
+		if self._udf_values is not None:
+			yield "userDefinedFields"
+
+	def __len__(self):
+		return len(self._values) + (self._udf_values is not None)
+
+	@property
+	def udf(self):
+		"""User Defined Fields as a name to value dict"""
+		return dict(zip(self._schema.udf_names, self._udf_values or ()))
+
+	def to_dict(self):
+		"""Return the record as a plain dict"""
+		return {field: self[field] for field in self}
+
+	def __repr__(self):
+		return "CompactRecord(%r)" % self.to_dict()
+
+
+def jsonable(obj):
+	"""json.dumps default writing CompactRecords as plain dicts"""
+	if isinstance(obj, CompactRecord):
+		return obj.to_dict()
+	raise TypeError("Object of type " + type(obj).__name__ + " is not JSON serializable")
+
+
+def compact(items, schemas=None):
+	"""Turn decoded record dicts into CompactRecords
+	:param schemas: dict reused across calls so pages share their schemas
+	"""
+	if schemas is None:
+		schemas = {}
+	records = []
+	for item in items:
+		udfs = item.pop("userDefinedFields", None)
+		fields = tuple(item)
+		udf_names = tuple(udf["name"] for udf in udfs) if udfs else ()
+		key = (fields, udf_names)
+		schema = schemas.get(key)
+		if schema is None:
+			schema = schemas.setdefault(key, RecordSchema(fields, udf_names))
+		udf_values = None if udfs is None else tuple(udf.get("value") for udf in udfs)
+		records.append(CompactRecord(schema, tuple(item.values()), udf_values))
+	return records
@@ -0,0 +1,148 @@
+"""
+Pacing, concurrency limits and retries for requests to the Autotask API
+"""
+import contextlib
+import random
+import threading
+import time
+
+# Autotask allows 10,000 requests an hour per database
+HOURLY_REQUEST_LIMIT = 10000
+
+# statuses worth retrying when repeating the request is safe
+RETRY_STATUSES = (500, 502, 503, 504)
+
+# Autotask rejects requests over the per integration thread limit with this
+THREAD_THRESHOLD = "thread threshold"
+
+
+class TokenBucket:
+
+	"""Thread-safe token bucket, rate tokens a second up to burst"""
+
+	def __init__(self, rate, burst):
+		self.rate = rate
+		self.burst = burst
+		self._tokens = burst
+		self._last = time.monotonic()
+		self._lock = threading.Lock()
+
+	def reserve(self):
+		"""Take a token, returning the seconds to wait until it is due"""
+		with self._lock:
+			now = time.monotonic()
+			self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+			self._last = now
+			# tokens may go negative, callers then queue up behind each other
+			self._tokens -= 1
+			return max(0.0, -self._tokens / self.rate)
+
+
+class RequestScheduler:
+
+	"""Central policy every request of a site goes through
+
+	Requests are paced by a token bucket, at most max_concurrent run at once
+	and throttled or failed ones are retried with exponential backoff and
+	jitter. Throttling (429 or Autotask's thread threshold error) means the
+	request was rejected, so it is retried for any method. Server errors and
+	connection failures are only retried for idempotent requests.
+	"""
+
+	def __init__(  # pylint: disable=r0913
+			self,
+			rate=HOURLY_REQUEST_LIMIT * 0.9 / 3600,
+			burst=50,
+			max_concurrent=None,
+			retries=5,
+			backoff=0.5,
+			max_backoff=60,
+			timeout=(10, 120)
+	):
+		"""
+		:param rate: requests a second, defaults to just under Autotask's hourly
+			limit. None disables pacing.
+		:param burst: requests allowed back to back before pacing starts
+		:param max_concurrent: requests in flight at once, None for no cap
+		:param retries: attempts after the first before giving up
+		:param backoff: base delay in seconds, doubled every attempt
+		:param max_backoff: longest delay between attempts
+		:param timeout: (connect, read) seconds for each request
+		"""
+		self.bucket = TokenBucket(rate, burst) if rate else None
+		self.max_concurrent = max_concurrent
+		self.retries = retries
+		self.backoff = backoff
+		self.max_backoff = max_backoff
+		self.timeout = timeout
+		self._slots = threading.BoundedSemaphore(max_concurrent) if max_concurrent else None
+		# requests retried and those retried because they were throttled
+		self.retried = 0
+		self.throttled = 0
+		self._counter_lock = threading.Lock()
+
+	def pace(self):
+		"""Return the seconds to wait before the next request may start"""
+		return self.bucket.reserve() if self.bucket else 0.0
+
+	def delay(self, attempt, retry_after=None):
+		"""Return the seconds to wait before retry number attempt + 1
+
+		Full jitter over the exponential backoff, but never sooner than the
+		server's Retry-After.
+		"""
+		delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+		try:
+			return max(delay, float(retry_after))
+		except (TypeError, ValueError):
+			return delay
+
+	def check(self, status, headers, body, idempotent, attempt):
+		"""Return the seconds to wait before retrying a response, or None to keep it
+		:param body: response body, str or bytes
+		"""
+		if attempt >= self.retries or status < 400:
+			return None
+		if isinstance(body, bytes):
+			body = body.decode("utf-8", "replace")
+		if status == 429 or THREAD_THRESHOLD in body.lower():
+			with self._counter_lock:
+				self.throttled += 1
+			return self.delay(attempt, headers.get("Retry-After"))
+		if idempotent and status in RETRY_STATUSES:
+			return self.delay(attempt, headers.get("Retry-After"))
+		return None
+
+	def count_retry(self):
+		"""Count a request about to be retried, callable from any thread"""
+		with self._counter_lock:
+			self.retried += 1
+
+	def slot(self):
+		"""Context manager holding one of the max_concurrent slots"""
+		return self._slots if self._slots else contextlib.nullcontext()
+
+	def call(self, send, idempotent=True, errors=()):
+		"""Run send() under the policy and return its response
+		:param send: makes the request, returns a requests style response
+		:param idempotent: the request is safe to repeat after an error
+		:param errors: connection exceptions of send worth retrying
+		"""
+		attempt = 0
+		while True:
+			time.sleep(self.pace())
+			with self.slot():
+				try:
+					response = send()
+				except errors:
+					if not idempotent or attempt >= self.retries:
+						raise
+					delay = self.delay(attempt)
+				else:
+					delay = self.check(response.status_code, response.headers,
+									   response.content, idempotent, attempt)
+					if delay is None:
+						return response
+			attempt += 1
+			self.count_retry()
+			time.sleep(delay)
@@ -0,0 +1,170 @@
+"""
+Write-behind queue coalescing many small updates into few PATCHes
+"""
+import atexit
+import contextvars
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class PendingWrite:
+
+	"""Fields and User Defined Fields waiting to be PATCHed to one record"""
+
+	__slots__ = ("url", "fields", "udfs", "futures", "since", "context")
+
+	def __init__(self, url, since):
+		self.url = url
+		self.fields = {}
+		self.udfs = {}
+		self.futures = []
+		self.since = since
+		# the PATCH is sent in the context of the first update, ie its RequestMetrics.operation
+		self.context = contextvars.copy_context()
+
+	def merge(self, params):
+		"""Add an update, its values replace earlier ones field by field"""
+		for field, value in params.items():
+			if field == "userDefinedFields":
+				for udf in value or ():
+					self.udfs[udf["name"]] = dict(udf)
+			else:
+				self.fields[field] = value
+
+	def params(self):
+		params = dict(self.fields)
+		if self.udfs:
+			params["userDefinedFields"] = list(self.udfs.values())
+		return params
+
+
+class WriteBehindQueue:
+
+	"""Queue updates and send them merged per record in the background
+
+	Updates to the same url and id made before their PATCH goes out are
+	merged, the last value of each field and User Defined Field wins, so a
+	loop setting one metric at a time costs one PATCH per record. Pending
+	writes go out once max_pending records are waiting or the oldest has
+	waited max_delay seconds, on at most max_workers threads. A record's
+	next PATCH only starts after its previous one finished. Updates still
+	queued when the interpreter exits are sent before it does.
+	>>> writes = site.write_behind()
+	>>> future = site.update_ci_just_udf(company_id, ci_id, udf, deferred=True)
+	>>> site.close()  # sends whatever is still queued
+
+	Safe to share between threads.
+	"""
+
+	def __init__(self, site, max_pending=100, max_delay=1.0, max_workers=None):
+		"""
+		:param site: atSite to send the PATCHes with
+		:param max_pending: records waiting before everything queued is sent
+		:param max_delay: longest seconds an update waits to be sent
+		:param max_workers: concurrent PATCHes, capped at the site's max_threads
+		"""
+		self.site = site
+		self.max_pending = max_pending
+		self.max_delay = max_delay
+		self.max_workers = min(max_workers or site.max_threads, site.max_threads)
+		# updates accepted, and PATCHes they were merged into
+		self.queued = 0
+		self.sent = 0
+		self._pending = {}
+		self._in_flight = set()
+		self._flushing = False
+		self._closed = False
+		self._cond = threading.Condition()
+		self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="write-behind")
+		self._flusher = threading.Thread(target=self._flush_loop, name="write-behind", daemon=True)
+		self._flusher.start()
+		# scripts ending without site.close() don't lose their updates
+		atexit.register(self.close)
+
+	def update(self, url, params):
+		"""Queue a PATCH of params, which has the record's id, to the entity url
+		:param url: entity url as for _api_update, ie "ConfigurationItems"
+		:returns: Future of the response of the PATCH the update is sent in
+		"""
+		future = Future()
+		key = (url, str(params["id"]))
+		with self._cond:
+			if self._closed:
+				raise RuntimeError("WriteBehindQueue is closed")
+			pending = self._pending.get(key)
+			if pending is None:
+				pending = self._pending[key] = PendingWrite(url, time.monotonic())
+			pending.merge(params)
+			pending.futures.append(future)
+			self.queued += 1
+			if len(self._pending) == 1 or len(self._pending) >= self.max_pending:
+				self._cond.notify_all()
+		return future
+
+	def flush(self):
+		"""Send everything queued now and wait until it is written"""
+		with self._cond:
+			self._flushing = True
+			self._cond.notify_all()
+			while self._pending or self._in_flight:
+				self._cond.wait()
+			self._flushing = False
+
+	def close(self):
+		"""Send everything still queued, then stop"""
+		with self._cond:
+			if self._closed:
+				return
+			self._closed = True
+			self._cond.notify_all()
+		atexit.unregister(self.close)
+		self._flusher.join()
+		self._executor.shutdown(wait=True)
+
+	def __len__(self):
+		with self._cond:
+			return len(self._pending)
+
+	def _due(self, now):
+		"""Return the keys to send now and the seconds until the next one is due"""
+		ready = [key for key in self._pending if key not in self._in_flight]
+		if self._closed or self._flushing or len(self._pending) >= self.max_pending:
+			return ready, None
+		due = [key for key in ready if now - self._pending[key].since >= self.max_delay]
+		waiting = [self._pending[key].since + self.max_delay - now for key in ready if key not in due]
+		return due, min(waiting, default=None)
+
+	def _flush_loop(self):
+		with self._cond:
+			while True:
+				due, timeout = self._due(time.monotonic())
+				for key in due:
+					self._in_flight.add(key)
+					self._submit(key, self._pending.pop(key))
+				if self._closed and not self._pending and not self._in_flight:
+					return
+				if not due:
+					self._cond.wait(timeout)
+
+	def _submit(self, key, pending):
+		try:
+			self._executor.submit(pending.context.run, self._send, key, pending)
+		except RuntimeError:
+			# the interpreter is exiting and executors take no more work
+			pending.context.run(self._send, key, pending)
+
+	def _send(self, key, pending):
+		try:
+			response = self.site._api_update(pending.url, pending.params())  # pylint: disable=protected-access
+		except Exception as err:  # pylint: disable=broad-except
+			for future in pending.futures:
+				future.set_exception(err)
+		else:
+			for future in pending.futures:
+				future.set_result(response)
+		finally:
+			with self._cond:
+				self._in_flight.discard(key)
+				self.sent += 1
+				self._cond.notify_all()
@@ -12,4 +12,5 @@ setup(name='pyautotask',
       scripts=[],
       classifiers=[],
       install_requires=['requests'],
+      extras_require={'async': ['aiohttp'], 'parquet': ['pyarrow']},
       )
@@ -0,0 +1,54 @@
+"""
+Fixtures running the clients against a local MockAutotask
+"""
+import pytest
+
+from pyautotask.atsite import atSite
+from pyautotask.mockserver import MockAutotask
+from pyautotask.scheduler import RequestScheduler
+
+
+def fast_scheduler(**kwargs):
+	"""RequestScheduler without pacing and with short backoffs"""
+	options = dict(rate=None, max_concurrent=3, backoff=0.01, max_backoff=0.05)
+	options.update(kwargs)
+	return RequestScheduler(**options)
+
+
+@pytest.fixture
+def mock():
+	"""A small tenant, override with make_mock for other sizes"""
+	with MockAutotask(cis=1200, companies=10, tickets=40, service_calls=900, page_size=100) as server:
+		yield server
+
+
+@pytest.fixture
+def make_mock():
+	"""Start MockAutotask(**kwargs), stopped after the test"""
+	servers = []
+
+	def make(**kwargs):
+		servers.append(MockAutotask(**kwargs).start())
+		return servers[-1]
+	yield make
+	for server in servers:
+		server.stop()
+
+
+@pytest.fixture
+def make_site():
+	"""Return an atSite on a mock, closed after the test"""
+	sites = []
+
+	def make(server, **kwargs):
+		kwargs.setdefault("scheduler", fast_scheduler())
+		sites.append(atSite(None, "user", "secret", "code", base_url=server.url, **kwargs))
+		return sites[-1]
+	yield make
+	for site in sites:
+		site.close()
+
+
+@pytest.fixture
+def site(mock, make_site):
+	return make_site(mock)
@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+from pyautotask.atsite import APIError
+from pyautotask.query import exist
+from pyautotask.scheduler import RequestScheduler
+
+aio = pytest.importorskip("pyautotask.aio")
+
+
+def run(mock, coroutine_function):
+	"""Run coroutine_function(site) with an AsyncAtSite on mock"""
+	async def main():
+		scheduler = RequestScheduler(rate=None, backoff=0.01, max_backoff=0.05)
+		async with aio.AsyncAtSite(None, "user", "secret", "code", base_url=mock.url, scheduler=scheduler) as site:
+			return await coroutine_function(site)
+	return asyncio.run(main())
+
+
+def test_queries(mock):
+	async def queries(site):
+		first = await site.get_cis(exist("id"))
+		every = await site.get_cis(exist("id"), all_pages=True)
+		iterated = [ci["id"] async for ci in site.iter_query("ConfigurationItems", exist("id"))]
+		return first, every, iterated
+	first, every, iterated = run(mock, queries)
+	assert len(first) == 100
+	assert [ci["id"] for ci in every] == iterated == list(range(1, 1201))
+
+
+def test_gathered_pushes(mock):
+	async def pushes(site):
+		return await asyncio.gather(
+			site.ci_push_by_serialNumber(3, 2, 1, 2, "Renamed", "SN00000001", []),
+			*[site.ci_push_by_serialNumber(3, 1, 1, 1, "New %d" % index, "NEW%d" % index, []) for index in range(10)])
+	results = run(mock, pushes)
+	assert results[0] == {"itemId": 1}
+	assert mock.data["ConfigurationItems"][1]["referenceTitle"] == "Renamed"
+	assert len(mock.data["ConfigurationItems"]) == 1210
+	assert {result["itemId"] for result in results[1:]} == set(range(1201, 1211))
+
+
+def test_errors_raise(mock):
+	async def missing(site):
+		return await site._api_update("ConfigurationItems", {"id": 99999})  # pylint: disable=protected-access
+	with pytest.raises(APIError):
+		run(mock, missing)
@@ -0,0 +1,43 @@
+from concurrent.futures import ThreadPoolExecutor
+
+
+def open_tickets(mock, ci_id, title):
+	return [ticket for ticket in mock.data["Tickets"].values()
+			if ticket.get("configurationItemID") == ci_id and ticket.get("title") == title and ticket["status"] != 5]
+
+
+def test_duplicate_alerts_create_one_ticket(site, mock):
+	engine = site.alert_tickets()
+	with ThreadPoolExecutor(max_workers=8) as executor:
+		tickets = list(executor.map(lambda _alert: engine.send("Device down", "No response", 1, 7), range(20)))
+	assert len({ticket["id"] for ticket in tickets}) == 1
+	assert len(open_tickets(mock, 7, "Device down")) == 1
+	assert engine.created == 1 and engine.coalesced == 19
+
+
+def test_open_tickets_are_reused(site, mock):
+	ticket = next(ticket for ticket in mock.data["Tickets"].values() if ticket["status"] != 5)
+	engine = site.alert_tickets()
+	requests = mock.requests
+	assert engine.send(ticket["title"], "", 1, ticket["configurationItemID"])["id"] == ticket["id"]
+	# only the load of the index
+	assert mock.requests == requests + 1
+
+
+def test_refresh_sees_completed_tickets(site, mock):
+	engine = site.alert_tickets(refresh_interval=0)
+	first = engine.send("Device down", "No response", 1, 8)
+	mock.data["Tickets"][first["id"]]["status"] = 5
+	mock.data["Tickets"][first["id"]]["lastActivityDate"] = "2099-01-01T00:00:00.000Z"
+	second = engine.send("Device down", "No response", 1, 8)
+	assert second["id"] != first["id"]
+	assert len(open_tickets(mock, 8, "Device down")) == 1
+
+
+def test_send_generic_alert_ticket_looks_for_open_tickets(site, mock):
+	created = site.send_generic_alert_ticket("Device down", "No response", 1, 9)
+	ticket = mock.data["Tickets"][created["itemId"]]
+	assert (ticket["issueType"], ticket["queueID"]) == ("14", "8")
+	existing = site.send_generic_alert_ticket("Device down", "No response", 1, 9)
+	assert existing[0]["id"] == ticket["id"]
+	assert existing[0]["description"] == "No response" and existing[0]["companyID"] == 1
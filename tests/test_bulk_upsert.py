@@ -0,0 +1,74 @@
+NEW_CI = {"companyID": 1, "configurationItemType": 1, "configurationItemCategoryID": 3, "productID": 1}
+
+
+def test_creates_updates_and_skips(site, mock):
+	records = [
+		{"serialNumber": "SN00000001", "referenceTitle": "Device 1"},
+		{"serialNumber": "SN00000002", "referenceTitle": "Renamed 2"},
+		dict(NEW_CI, serialNumber="NEW1", referenceTitle="New 1",
+			 userDefinedFields=[{"name": "UDF 0", "value": "x"}]),
+	]
+	report = site.bulk_upsert_cis(records)
+	assert [row["action"] for row in report] == ["unchanged", "updated", "created"]
+	assert [row["key"] for row in report] == ["SN00000001", "SN00000002", "NEW1"]
+	assert report[2]["id"] == 1201
+	assert mock.data["ConfigurationItems"][2]["referenceTitle"] == "Renamed 2"
+	assert mock.data["ConfigurationItems"][1201]["userDefinedFields"] == [{"name": "UDF 0", "value": "x"}]
+
+
+def test_duplicate_keys_create_once(site, mock):
+	records = [dict(NEW_CI, serialNumber="NEW1", referenceTitle="First"),
+			   dict(NEW_CI, serialNumber="NEW1", referenceTitle="Second")]
+	report = site.bulk_upsert_cis(records)
+	assert [row["action"] for row in report] == ["created", "updated"]
+	assert report[0]["id"] == report[1]["id"]
+	assert len(mock.data["ConfigurationItems"]) == 1201
+	assert mock.data["ConfigurationItems"][report[0]["id"]]["referenceTitle"] == "Second"
+
+
+def test_failures_are_reported_per_record(site):
+	report = site.bulk_upsert_cis([{"referenceTitle": "No serial"}, {"serialNumber": "SN00000003", "referenceTitle": "Ok"}])
+	assert isinstance(report[0]["error"], KeyError)
+	assert report[1]["action"] == "updated" and report[1]["error"] is None
+
+
+def test_lookups_are_batched(site, mock):
+	records = [{"serialNumber": "SN%08d" % index, "referenceTitle": "Device %d" % index} for index in range(1, 451)]
+	report = site.bulk_upsert_cis(records)
+	assert {row["action"] for row in report} == {"unchanged"}
+	# three 'in' queries of at most 200 serials, two pages each on the mock, and no writes
+	assert mock.requests == 5
+
+
+def test_failed_udf_patch_after_create_keeps_the_id(site, mock, monkeypatch):
+	update = site._update  # pylint: disable=protected-access
+	failures = []
+
+	def failing(url, params=None):
+		if params.get("userDefinedFields") and not failures:
+			failures.append(params["id"])
+			raise ConnectionError("PATCH failed")
+		return update(url, params)
+	monkeypatch.setattr(site, "_update", failing)
+	udf = [{"name": "UDF 0", "value": "x"}]
+	records = [dict(NEW_CI, serialNumber="NEW", referenceTitle="New", userDefinedFields=udf),
+			   dict(NEW_CI, serialNumber="NEW", referenceTitle="New", userDefinedFields=udf)]
+	report = site.bulk_upsert_cis(records)
+	assert report[0]["id"] == 1201 and report[0]["action"] == "created"
+	assert isinstance(report[0]["error"], ConnectionError)
+	# the second record updates the CI, sending the UDFs that failed
+	assert report[1] == {"key": "NEW", "id": 1201, "action": "updated", "error": None}
+	assert len(mock.data["ConfigurationItems"]) == 1201
+	assert mock.data["ConfigurationItems"][1201]["userDefinedFields"] == udf
+
+
+def test_keys_match_ignoring_case(site, mock):
+	report = site.bulk_upsert_cis([{"serialNumber": "sn00000004", "referenceTitle": "Renamed"},
+								   dict(NEW_CI, serialNumber="New1", referenceTitle="New"),
+								   dict(NEW_CI, serialNumber="NEW1", referenceTitle="New")])
+	# the second spelling of NEW1 is the same CI, its serial is rewritten
+	assert [row["action"] for row in report] == ["updated", "created", "updated"]
+	assert report[0]["id"] == 4 and report[0]["key"] == "sn00000004"
+	assert report[1]["id"] == report[2]["id"] == 1201
+	assert len(mock.data["ConfigurationItems"]) == 1201
+	assert mock.data["ConfigurationItems"][1201]["serialNumber"] == "NEW1"
@@ -0,0 +1,63 @@
+import time
+
+from pyautotask.cache import MISSING, DiskCache, MemoryCache
+
+
+def test_memory_cache_ttl_and_lru():
+	cache = MemoryCache(max_entries=2)
+	cache.set("Products:a", [1], 60)
+	cache.set("Products:b", [2], 0.01)
+	time.sleep(0.02)
+	assert cache.get("Products:b") is MISSING
+	cache.set("Roles:c", [3], 60)
+	cache.set("Roles:d", [4], 60)
+	assert cache.get("Products:a") is MISSING
+	assert cache.get("Roles:d") == [4]
+	assert cache.stats() == {"hits": 1, "misses": 2, "size": 2}
+
+
+def test_memory_cache_returns_copies():
+	cache = MemoryCache()
+	cache.set("Products:a", [{"id": 1}], 60)
+	cache.get("Products:a")[0]["id"] = 2
+	assert cache.get("Products:a") == [{"id": 1}]
+
+
+def test_disk_cache_survives_reopening(tmp_path):
+	path = str(tmp_path / "cache.db")
+	cache = DiskCache(path)
+	cache.set("Products:a", {"id": 1}, 60)
+	cache.set("Roles:b", None, 60)
+	cache.close()
+	cache = DiskCache(path)
+	assert cache.get("Products:a") == {"id": 1}
+	assert cache.get("Roles:b") is None
+	cache.invalidate("Products")
+	assert cache.get("Products:a") is MISSING
+	assert len(cache) == 1
+	cache.close()
+
+
+def test_lookups_are_cached(site, mock):
+	assert site.get_product_by_name("Product 3")[0]["id"] == 3
+	requests = mock.requests
+	assert site.get_product_by_name("Product 3")[0]["id"] == 3
+	assert mock.requests == requests
+	assert site.cache.stats()["hits"] == 1
+
+
+def test_writes_invalidate_their_entity(site, mock):
+	site.get_product_by_name("Product 3")
+	site.get_ci_type_by_name("Network Device")
+	site._api_update("Products", {"id": 3, "name": "Renamed"})  # pylint: disable=protected-access
+	assert site.get_product_by_name("Product 3") == []
+	requests = mock.requests
+	site.get_ci_type_by_name("Network Device")
+	assert mock.requests == requests
+
+
+def test_cache_can_be_disabled(mock, make_site):
+	site = make_site(mock, cache=False)
+	site.get_product_by_name("Product 3")
+	site.get_product_by_name("Product 3")
+	assert mock.requests == 2
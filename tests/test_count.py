@@ -0,0 +1,26 @@
+from pyautotask.query import eq, exist
+
+
+def test_count_matches_without_fetching(site, mock):
+	assert site.count("ConfigurationItems", exist("id")) == 1200
+	assert site.count("ConfigurationItems", eq("companyID", 2)) == 120
+	open_tickets = sum(1 for ticket in mock.data["Tickets"].values() if ticket["status"] == 1)
+	assert site.count_new_unassigned_tickets() == open_tickets
+	assert mock.requests == 3
+	assert site.metrics.summary()["endpoints"]["Tickets count"]["pages"] == 0
+
+
+def test_count_defaults_to_active_items(site, mock):
+	mock.data["ConfigurationItems"][3]["isActive"] = False
+	assert site.count("ConfigurationItems") == 1199
+
+
+def test_exists(site):
+	assert site.exists("ConfigurationItems", eq("serialNumber", "SN00000009"))
+	assert not site.exists("ConfigurationItems", eq("serialNumber", "missing"))
+
+
+def test_push_companies_alerts_checks_for_existing(site, mock):
+	site.push_companies_alerts(4, {"alertText": "First"})
+	site.push_companies_alerts(4, {"alertText": "Second"})
+	assert [alert["alertText"] for alert in mock.data["CompanyAlerts"].values()] == ["First"]
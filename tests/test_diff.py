@@ -0,0 +1,42 @@
+from pyautotask.atsite import atSiteBase
+
+
+def test_diff_fields_normalises_values():
+	current = {"id": 1, "isActive": True, "productID": 5, "referenceTitle": "A", "description": None}
+	desired = {"isActive": "true", "productID": "5.0", "referenceTitle": "B", "description": ""}
+	assert atSiteBase.diff_fields(current, desired) == {"referenceTitle": "B"}
+
+
+def test_diff_udfs():
+	current = [{"name": "A", "value": "1"}, {"name": "B", "value": None}]
+	desired = [{"name": "A", "value": 1}, {"name": "B", "value": ""}, {"name": "C", "value": "3"}]
+	assert atSiteBase.diff_udfs(current, desired) == [{"name": "C", "value": "3"}]
+
+
+def test_unchanged_update_is_skipped(site, mock):
+	ci = site.get_ci_by_id(1)[0]
+	udf = [dict(ci["userDefinedFields"][0])]
+	requests = mock.requests
+	assert site.update_ci_udf(1, ci["productID"], udf, current=ci) == {"itemId": 1}
+	assert mock.requests == requests
+	assert site.skipped_writes == 1
+
+
+def test_only_changes_are_sent(site, mock):
+	ci = site.get_ci_by_id(1)[0]
+	before = mock.data["ConfigurationItems"][1]["userDefinedFields"]
+	requests = mock.requests
+	site.update_ci_udf(1, ci["productID"], [{"name": "UDF 1", "value": "changed"}], current=ci)
+	assert mock.requests == requests + 1
+	after = {udf["name"]: udf["value"] for udf in mock.data["ConfigurationItems"][1]["userDefinedFields"]}
+	assert after["UDF 1"] == "changed"
+	assert after["UDF 0"] == before[0]["value"]
+
+
+def test_ci_push_skips_matching_device(site, mock):
+	ci = mock.data["ConfigurationItems"][4]
+	args = (ci["configurationItemCategoryID"], ci["companyID"], ci["configurationItemType"], ci["productID"],
+			ci["referenceTitle"], ci["serialNumber"], ci["userDefinedFields"][:1])
+	assert site.ci_push_by_serialNumber(*args) == {"itemId": 4}
+	assert site.skipped_writes == 1
+	assert mock.requests == 1
@@ -0,0 +1,114 @@
+import csv
+import json
+import os
+
+import pytest
+
+from pyautotask.export import Export
+from pyautotask.query import Query, exist
+
+
+def read_ndjson(path):
+	with open(path, encoding="utf-8") as file:
+		return [json.loads(line) for line in file]
+
+
+def interrupt_after(monkeypatch, site, pages):
+	"""Make the export fail reading page pages + 1"""
+	read_page = site._read_page  # pylint: disable=protected-access
+	calls = []
+
+	def failing(url):
+		calls.append(url)
+		if len(calls) >= pages:
+			raise ConnectionError("interrupted")
+		return read_page(url)
+	monkeypatch.setattr(site, "_read_page", failing)
+
+
+def test_ndjson(site, mock, tmp_path):
+	path = str(tmp_path / "cis.ndjson")
+	assert site.export("ConfigurationItems", path) == 1200
+	rows = read_ndjson(path)
+	assert [row["id"] for row in rows] == list(range(1, 1201))
+	assert rows[0]["userDefinedFields"] == mock.data["ConfigurationItems"][1]["userDefinedFields"]
+	assert os.listdir(str(tmp_path)) == ["cis.ndjson"]
+
+
+def test_csv_flattens_udfs(site, mock, tmp_path):
+	path = str(tmp_path / "cis.csv")
+	site.export("ConfigurationItems", path, include_fields=["serialNumber", "userDefinedFields"])
+	with open(path, encoding="utf-8", newline="") as file:
+		rows = list(csv.DictReader(file))
+	assert len(rows) == 1200
+	assert list(rows[0]) == ["id", "serialNumber"] + ["udf." + name for name in mock.udf_names]
+	assert rows[4]["udf.UDF 1"] == mock.data["ConfigurationItems"][5]["userDefinedFields"][1]["value"]
+
+
+@pytest.mark.parametrize("name", ["cis.ndjson", "cis.csv"])
+def test_resume_after_interruption(site, mock, tmp_path, monkeypatch, name):
+	path = str(tmp_path / name)
+	interrupt_after(monkeypatch, site, 5)
+	with pytest.raises(ConnectionError):
+		site.export("ConfigurationItems", path)
+	assert not os.path.exists(path) and os.path.exists(path + ".state")
+	monkeypatch.undo()
+	requests = mock.requests
+	assert site.export("ConfigurationItems", path) == 1200
+	# the five pages written before are not fetched again
+	assert mock.requests - requests == 7
+	if name.endswith(".csv"):
+		with open(path, encoding="utf-8", newline="") as file:
+			ids = [int(row["id"]) for row in csv.DictReader(file)]
+	else:
+		ids = [row["id"] for row in read_ndjson(path)]
+	assert ids == list(range(1, 1201))
+	assert not os.path.exists(path + ".state")
+
+
+def test_resume_after_paging_url_expired(site, mock, tmp_path, monkeypatch):
+	path = str(tmp_path / "cis.ndjson")
+	interrupt_after(monkeypatch, site, 3)
+	with pytest.raises(ConnectionError):
+		site.export("ConfigurationItems", path)
+	monkeypatch.undo()
+	mock._cursors.clear()  # pylint: disable=protected-access
+	assert site.export("ConfigurationItems", path) == 1200
+	assert [row["id"] for row in read_ndjson(path)] == list(range(1, 1201))
+
+
+def test_compiled_query_resumes_after_paging_url_expired(site, mock, tmp_path, monkeypatch):
+	path = str(tmp_path / "cis.ndjson")
+	query = Query(exist("id"), include_fields=["serialNumber"])
+	interrupt_after(monkeypatch, site, 3)
+	with pytest.raises(ConnectionError):
+		site.export("ConfigurationItems", path, query)
+	monkeypatch.undo()
+	mock._cursors.clear()  # pylint: disable=protected-access
+	assert site.export("ConfigurationItems", path, query) == 1200
+	rows = read_ndjson(path)
+	assert [row["id"] for row in rows] == list(range(1, 1201))
+	assert rows[0] == {"id": 1, "serialNumber": "SN00000001"}
+
+
+def test_changed_query_starts_over(site, tmp_path, monkeypatch):
+	path = str(tmp_path / "cis.ndjson")
+	interrupt_after(monkeypatch, site, 3)
+	with pytest.raises(ConnectionError):
+		site.export("ConfigurationItems", path)
+	monkeypatch.undo()
+	assert site.export("ConfigurationItems", path, '{"op":"lte","field":"id","value":"250"}') == 250
+	assert len(read_ndjson(path)) == 250
+
+
+def test_parquet(site, tmp_path):
+	parquet = pytest.importorskip("pyarrow.parquet")
+	path = str(tmp_path / "cis.parquet")
+	assert site.export("ConfigurationItems", path) == 1200
+	table = parquet.read_table(path)
+	assert table.num_rows == 1200 and "udf.UDF 0" in table.column_names
+
+
+def test_unknown_format(site):
+	with pytest.raises(ValueError):
+		Export(site, "ConfigurationItems", "cis.xlsx")
@@ -0,0 +1,21 @@
+def test_fan_out_in_few_queries(make_mock, make_site):
+	server = make_mock(cis=0, companies=450)
+	site = make_site(server)
+	contacts = site.get_contacts_by_company_ids(list(range(1, 451)) + [999])
+	assert len(contacts) == 451
+	assert [contact["id"] for contact in contacts[3]] == [5, 6]
+	assert contacts[999] == []
+	# 'in' filters of 200, 200 and 51 ids
+	assert server.requests == 3
+
+
+def test_fan_out_keeps_caller_ids_and_filters(site):
+	contacts = site.get_contacts_by_company_ids(["2", "3"], filter_fields='{"op":"eq","field":"lastName","value":"4"}')
+	assert contacts == {"2": [site.get_contacts('{"op":"eq","field":"id","value":"4"}')[0]], "3": []}
+
+
+def test_fan_out_children(site, mock):
+	site.push_companies_alerts(2, {"alertText": "Check in"})
+	alerts = site.fan_out_children([1, 2], "Alerts")
+	assert alerts[1] == [] and alerts[2][0]["alertText"] == "Check in"
+	assert site.get_alerts_by_company_ids([1, 2])[2][0]["companyID"] == 2
@@ -0,0 +1,46 @@
+import pytest
+
+from pyautotask.metadata import Picklist
+
+FIELDS = {"fields": [
+	{"name": "status", "isPickList": True, "picklistValues": [
+		{"value": 1, "label": "New", "isActive": True},
+		{"value": 9, "label": "New", "isActive": False},
+		{"value": 5, "label": "Complete", "isActive": True}]},
+	{"name": "title", "isPickList": False},
+]}
+
+
+def test_picklist_lookups():
+	picklist = Picklist.from_fields("Tickets", FIELDS, "status")
+	assert picklist.value("New") == "1"
+	assert picklist.value("complete") == "5"
+	assert picklist.label(9) == "New"
+	assert "COMPLETE" in picklist and "Closed" not in picklist
+	with pytest.raises(KeyError):
+		picklist.value("Closed")
+	with pytest.raises(KeyError):
+		Picklist.from_fields("Tickets", FIELDS, "title")
+	with pytest.raises(KeyError):
+		Picklist.from_fields("Tickets", FIELDS, "missing")
+
+
+def test_site_picklists_are_built_once(site, mock):
+	assert site.get_issueType_by_name("Alert") == "14"
+	assert site.get_queue_by_name("level i support") == "6"
+	assert site.picklist_label("Tickets", "priority", 3) == "Low"
+	assert mock.requests == 1
+
+
+def test_entity_information_is_cached(site, mock):
+	udfs = site.get_ci_udf()
+	assert [udf["name"] for udf in udfs["fields"]] == mock.udf_names
+	site.get_entity_udfs("ConfigurationItems")
+	assert mock.requests == 1
+
+
+def test_alert_tickets_take_labels(site, mock):
+	created = site.send_generic_alert_ticket("Device down", "No response", 1, 9, issue_type="Incident",
+											 queue="Level I Support")
+	ticket = mock.data["Tickets"][created["itemId"]]
+	assert (ticket["issueType"], ticket["queueID"]) == ("8", "6")
@@ -0,0 +1,78 @@
+import logging
+
+from conftest import fast_scheduler
+from pyautotask.metrics import RequestMetrics, log_exporter, percentile
+from pyautotask.query import exist
+
+
+def test_percentile():
+	samples = list(range(1, 101))
+	assert percentile(samples, 0.5) == 50 and percentile(samples, 0.95) == 95
+	assert percentile([], 0.5) is None
+
+
+def test_requests_are_counted_per_endpoint(site):
+	site.get_cis(exist("id"), all_pages=True)
+	site.count("Tickets")
+	site.get_ci_by_id(1)
+	site._api_read("Companies/1")  # pylint: disable=protected-access
+	summary = site.metrics.summary()
+	query = summary["endpoints"]["ConfigurationItems query"]
+	assert query["calls"] == 13 and query["pages"] == 13 and query["errors"] == 0
+	assert query["bytes"] > 0 and 0 < query["p50"] <= query["p95"] <= query["max"]
+	assert summary["endpoints"]["Tickets count"]["calls"] == 1
+	assert summary["endpoints"]["Companies GET"]["calls"] == 1
+	assert summary["calls"] == 15
+
+
+def test_throttled_attempts_are_recorded(make_mock, make_site):
+	server = make_mock(cis=10, throttle_rate=0.5, retry_after=0, seed=3)
+	site = make_site(server, scheduler=fast_scheduler(retries=20))
+	for ci_id in range(1, 11):
+		site.get_ci_by_id(ci_id)
+	stats = site.metrics.summary()["endpoints"]["ConfigurationItems query"]
+	assert stats["calls"] == server.requests
+	assert stats["throttled"] == stats["errors"] == server.throttled > 0
+
+
+def test_operations_and_hooks(site):
+	events = []
+	site.metrics.add_hook(events.append)
+	site.metrics.add_hook(lambda event: 1 / 0)
+	with site.metrics.operation("nightly"):
+		site.get_ci_by_id(1)
+	site.get_ci_by_id(2)
+	assert [event.operation for event in events] == ["nightly", None]
+	assert events[0].entity == "ConfigurationItems" and events[0].status == 200
+	assert site.metrics.summary()["operations"] == {"nightly": 1}
+
+
+def test_exporter(mock, make_site, caplog):
+	metrics = RequestMetrics(exporter=log_exporter(), export_interval=0)
+	site = make_site(mock, metrics=metrics)
+	with caplog.at_level(logging.INFO, logger="pyautotask.metrics"):
+		site.get_ci_by_id(1)
+	assert "ConfigurationItems query: 1 calls" in caplog.text
+	metrics.reset()
+	assert metrics.summary()["calls"] == 0
+
+
+def test_metrics_can_be_disabled(mock, make_site):
+	site = make_site(mock, metrics=False)
+	assert site.metrics is None
+	assert site.get_ci_by_id(1)[0]["id"] == 1
+
+
+def test_operation_reaches_worker_threads(site, mock):
+	writes = site.write_behind(max_delay=60)
+	with site.metrics.operation("nightly"):
+		site.fan_out(range(1, 11), "Contracts")
+		site.fan_out_children(range(1, 4), "Alerts")
+		site.query_windowed("ServiceCalls", "startDateTime", "2023-01-01", "2024-01-01")
+		list(site.iter_query_sharded("ConfigurationItems", 1200, exist("id"), shards=3))
+		list(site.iter_query("ConfigurationItems", exist("id"), prefetch=2))
+		site.bulk_upsert_cis([{"serialNumber": "SN00000001", "referenceTitle": "Renamed"},
+							  {"serialNumber": "NEW1", "referenceTitle": "New", "companyID": 1}])
+		site.update_ci_just_udf(1, 5, [{"name": "UDF 0", "value": "v"}], deferred=True)
+	writes.flush()
+	assert site.metrics.summary()["operations"] == {"nightly": mock.requests}
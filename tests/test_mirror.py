@@ -0,0 +1,42 @@
+import pytest
+
+from pyautotask.mirror import Mirror
+
+
+@pytest.fixture
+def mirror(site, tmp_path):
+	mirror = Mirror(site, str(tmp_path / "mirror.db"))
+	yield mirror
+	mirror.close()
+
+
+def test_first_sync_loads_everything(mirror, mock):
+	assert mirror.sync("ConfigurationItems") == 1200
+	assert mirror.count("ConfigurationItems") == 1200
+	assert mirror.find("ConfigurationItems", serialNumber="SN00000005")[0]["id"] == 5
+	assert mirror.get("ConfigurationItems", 7)["dattoHostname"] == "host-7"
+	assert mirror.count("ConfigurationItems", companyID=2) == 120
+	assert mirror.watermark("ConfigurationItems") == mock.data["ConfigurationItems"][1200]["lastModifiedTime"]
+
+
+def test_later_syncs_fetch_changes(mirror, site):
+	mirror.sync("ConfigurationItems")
+	site.update_ci({"id": 3, "referenceTitle": "Changed"})
+	# the gte watermark refetches the newest record too
+	assert mirror.sync("ConfigurationItems") == 2
+	assert mirror.get("ConfigurationItems", 3)["referenceTitle"] == "Changed"
+	assert mirror.count("ConfigurationItems") == 1200
+
+
+def test_full_sync_drops_deleted_records(mirror, mock):
+	mirror.sync("ConfigurationItems")
+	del mock.data["ConfigurationItems"][9]
+	mirror.sync("ConfigurationItems", full=True)
+	assert mirror.get("ConfigurationItems", 9) is None
+
+
+def test_rejects_bad_names(mirror):
+	with pytest.raises(ValueError):
+		mirror.find("Configuration Items")
+	with pytest.raises(ValueError):
+		mirror.find("ConfigurationItems", **{"id) OR (1": 1})
@@ -0,0 +1,68 @@
+import json
+
+import requests
+
+from pyautotask.mockserver import THREAD_THRESHOLD_ERROR, matches, prepare
+
+HEADERS = {"ApiIntegrationCode": "code", "UserName": "user", "Secret": "secret"}
+
+
+def test_matches_filter_ops():
+	record = {"id": 5, "serialNumber": "SN5", "isActive": True, "userDefinedFields": [{"name": "Site", "value": "HQ"}]}
+	assert matches(record, prepare([{"op": "eq", "field": "id", "value": "5"}]))
+	assert matches(record, prepare([{"op": "gt", "field": "id", "value": 4}, {"op": "lte", "field": "id", "value": 5}]))
+	assert matches(record, prepare([{"op": "in", "field": "serialNumber", "value": ["SN1", "SN5"]}]))
+	assert matches(record, prepare([{"op": "eq", "field": "isActive", "value": "1"}]))
+	assert matches(record, prepare([{"op": "eq", "field": "Site", "udf": True, "value": "HQ"}]))
+	assert matches(record, prepare([{"op": "or", "items": [
+		{"op": "eq", "field": "id", "value": 1}, {"op": "beginsWith", "field": "serialNumber", "value": "sn"}]}]))
+	assert not matches(record, prepare([{"op": "exist", "field": "dattoHostname"}]))
+	assert not matches(record, prepare([{"op": "noteq", "field": "id", "value": 5}]))
+
+
+def test_query_pages_and_count(mock):
+	body = {"filter": [{"op": "exist", "field": "id"}]}
+	page = requests.post(mock.url + "ConfigurationItems/query", json=body, headers=HEADERS).json()
+	assert len(page["items"]) == 100
+	ids = [item["id"] for item in page["items"]]
+	while page["pageDetails"]["nextPageUrl"]:
+		page = requests.get(page["pageDetails"]["nextPageUrl"], headers=HEADERS).json()
+		ids.extend(item["id"] for item in page["items"])
+	assert ids == list(range(1, 1201))
+	count = requests.post(mock.url + "ConfigurationItems/query/count", json=body, headers=HEADERS).json()
+	assert count == {"queryCount": 1200}
+
+
+def test_create_update_and_child_routes(mock):
+	created = requests.post(mock.url + "Companies/3/Alerts", json={"alertText": "x"}, headers=HEADERS).json()
+	alert = mock.data["CompanyAlerts"][created["itemId"]]
+	assert alert["companyID"] == 3
+	requests.patch(mock.url + "ConfigurationItems", headers=HEADERS,
+				   json={"id": 1, "userDefinedFields": [{"name": "UDF 0", "value": "new"}]})
+	udfs = {udf["name"]: udf["value"] for udf in mock.data["ConfigurationItems"][1]["userDefinedFields"]}
+	assert udfs["UDF 0"] == "new" and len(udfs) == 5
+
+
+def test_errors_and_throttling(make_mock):
+	server = make_mock(cis=10, throttle_rate=1.0, retry_after=2)
+	response = requests.get(server.url + "ConfigurationItems/1", headers=HEADERS)
+	assert response.status_code == 429 and response.headers["Retry-After"] == "2"
+	server.throttle_rate = 0
+	assert requests.get(server.url + "ConfigurationItems/1").status_code == 401
+	response = requests.post(server.url + "ConfigurationItems", data="not json", headers=HEADERS)
+	assert response.status_code == 400 and "errors" in response.json()
+	response = requests.post(server.url + "Companies/1/Alerts/5", json={}, headers=HEADERS)
+	assert response.status_code == 404 and json.loads(response.text)["errors"]
+
+
+def test_thread_threshold(make_mock):
+	server = make_mock(cis=10, max_concurrent=0)
+	response = requests.get(server.url + "ConfigurationItems/1", headers=HEADERS)
+	assert response.status_code == 429 and THREAD_THRESHOLD_ERROR in response.text
+
+
+def test_string_filters_ignore_case():
+	record = {"id": 5, "serialNumber": "ABC123"}
+	assert matches(record, prepare([{"op": "eq", "field": "serialNumber", "value": "abc123"}]))
+	assert matches(record, prepare([{"op": "in", "field": "serialNumber", "value": ["x", "aBc123"]}]))
+	assert not matches(record, prepare([{"op": "noteq", "field": "serialNumber", "value": "abc123"}]))
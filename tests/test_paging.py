@@ -0,0 +1,62 @@
+import time
+
+from pyautotask.atsite import atSiteBase
+from pyautotask.query import exist
+
+
+def test_create_query_first_page_by_default(site):
+	assert len(site.get_cis(exist("id"))) == 100
+
+
+def test_create_query_all_pages(site, mock, make_site):
+	assert [ci["id"] for ci in site.get_cis(exist("id"), all_pages=True)] == list(range(1, 1201))
+	paging_site = make_site(mock, all_pages=True)
+	assert len(paging_site.get_cis(exist("id"))) == 1200
+	assert len(paging_site.get_cis(exist("id"), all_pages=False)) == 100
+
+
+def test_iter_pages_is_lazy(site, mock):
+	pages = site.iter_pages("ConfigurationItems", exist("id"))
+	assert mock.requests == 0
+	assert len(next(pages)) == 100
+	assert mock.requests == 1
+	assert sum(len(page) for page in pages) == 1100
+	assert mock.requests == 12
+
+
+def test_iter_query_filters_and_fields(site):
+	items = list(site.iter_query("ConfigurationItems", '{"op":"lte","field":"id","value":"150"}',
+								 include_fields=["serialNumber"]))
+	assert len(items) == 150
+	assert items[0] == {"id": 1, "serialNumber": "SN00000001"}
+
+
+def test_iter_query_active_by_default(site, mock):
+	mock.data["ConfigurationItems"][7]["isActive"] = False
+	ids = [ci["id"] for ci in site.iter_query("ConfigurationItems")]
+	assert len(ids) == 1199 and 7 not in ids
+
+
+def test_prefetch_keeps_order(site):
+	ids = [ci["id"] for ci in site.iter_query("ConfigurationItems", exist("id"), prefetch=2)]
+	assert ids == list(range(1, 1201))
+
+
+def test_prefetch_stops_when_abandoned(site, mock):
+	pages = site.iter_pages("ConfigurationItems", exist("id"), prefetch=1)
+	next(pages)
+	pages.close()
+	time.sleep(0.3)
+	# the page being read and the one buffered, not the remaining ten
+	assert mock.requests <= 4
+
+
+def test_id_shards():
+	assert atSiteBase.id_shards(10, 3) == [(0, 4), (4, 8), (8, 10)]
+	assert atSiteBase.id_shards(2, 5) == [(0, 1), (1, 2)]
+
+
+def test_sharded_query_in_id_order(site, mock):
+	mock.data["ConfigurationItems"][1300] = dict(mock.data["ConfigurationItems"][1], id=1300)
+	ids = [ci["id"] for ci in site.iter_query_sharded("ConfigurationItems", 1200, exist("id"), shards=7)]
+	assert ids == list(range(1, 1201))
@@ -0,0 +1,41 @@
+import json
+
+import pytest
+
+from pyautotask.atsite import atSiteBase
+from pyautotask.query import Param, Query, eq, exist, gt, in_, lte
+
+
+def test_values_are_json_encoded():
+	query = Query(eq("serialNumber", Param("serial")), include_fields=["id"])
+	body = json.loads(query.render(serial='AB"C\\1'))
+	assert body == {"filter": [{"op": "eq", "field": "serialNumber", "value": 'AB"C\\1'}], "IncludeFields": ["id"]}
+
+
+def test_groups_and_udfs():
+	query = Query((eq("status", "1") | eq("status", "8")) & exist("Site", udf=True), max_records=10)
+	assert json.loads(query.render()) == {"filter": [{"op": "and", "items": [
+		{"op": "or", "items": [{"op": "eq", "field": "status", "value": "1"},
+							   {"op": "eq", "field": "status", "value": "8"}]},
+		{"op": "exist", "field": "Site", "udf": True}]}], "MaxRecords": 10}
+
+
+def test_missing_param():
+	with pytest.raises(TypeError):
+		Query(eq("id", Param("id"))).render()
+
+
+def test_query_body_combines_filters():
+	body = json.loads(atSiteBase._query_body([gt("id", 5), '{"op":"eq","field":"a","value":"b"}'], "id, a"))
+	assert body == {"filter": [{"op": "gt", "field": "id", "value": 5}, {"op": "eq", "field": "a", "value": "b"}],
+					"IncludeFields": ["id", "a"]}
+	with pytest.raises(TypeError):
+		atSiteBase._filter_string([Query(exist("id"))])
+
+
+def test_bound_queries_run_on_the_mock(site):
+	by_ids = Query(in_("id", Param("ids")), lte("id", Param("max")), include_fields=["serialNumber"])
+	cis = site.get_cis(by_ids(ids=[1, 5, 9, 2000], max=6))
+	assert cis == [{"id": 1, "serialNumber": "SN00000001"}, {"id": 5, "serialNumber": "SN00000005"}]
+	assert site.get_ci_by_serial("SN00000003")[0]["id"] == 3
+	assert site.get_ci_by_serial('SN"1') == []
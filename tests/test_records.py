@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+from pyautotask.cache import DiskCache
+from pyautotask.mirror import Mirror
+from pyautotask.query import exist
+from pyautotask.records import CompactRecord, compact, jsonable
+
+
+def test_compact_records_read_like_dicts():
+	items = [{"id": 1, "name": "a", "userDefinedFields": [{"name": "Site", "value": "HQ"}]},
+			 {"id": 2, "name": "b", "userDefinedFields": [{"name": "Site", "value": None}]}]
+	schemas = {}
+	records = compact([dict(item) for item in items], schemas)
+	assert [record.to_dict() for record in records] == items
+	assert records[0]["name"] == "a" and records[0].get("missing") is None
+	assert records[1].udf == {"Site": None}
+	assert len(schemas) == 1
+	with pytest.raises(TypeError):
+		records[0]["name"] = "c"
+
+
+def test_jsonable():
+	record = compact([{"id": 1}])[0]
+	assert json.loads(json.dumps([record], default=jsonable)) == [{"id": 1}]
+	with pytest.raises(TypeError):
+		json.dumps(object(), default=jsonable)
+
+
+def test_site_returns_compact_records(mock, make_site):
+	site = make_site(mock, compact_records=True)
+	cis = site.get_cis(exist("id"), all_pages=True)
+	assert len(cis) == 1200 and all(isinstance(ci, CompactRecord) for ci in cis)
+	assert cis[4]["serialNumber"] == "SN00000005"
+	assert isinstance(next(site.iter_query("ConfigurationItems")), CompactRecord)
+
+
+def test_compact_records_mirror(mock, make_site, tmp_path):
+	site = make_site(mock, compact_records=True)
+	mirror = Mirror(site, str(tmp_path / "mirror.db"))
+	try:
+		assert mirror.sync("ConfigurationItems") == 1200
+		assert mirror.get("ConfigurationItems", 5) == mock.data["ConfigurationItems"][5]
+	finally:
+		mirror.close()
+
+
+def test_compact_records_disk_cache(mock, make_site, tmp_path):
+	cache = DiskCache(str(tmp_path / "cache.db"))
+	site = make_site(mock, compact_records=True, cache=cache)
+	assert site.get_product_by_name("Product 3")[0]["sku"] == "SKU-3"
+	requests = mock.requests
+	assert site.get_product_by_name("Product 3") == [mock.data["Products"][3]]
+	assert mock.requests == requests
+	cache.close()
+
+
+def test_compact_records_memory_cache(mock, make_site):
+	site = make_site(mock, compact_records=True)
+	site.get_product_by_name("Product 3")
+	assert site.get_product_by_name("Product 3")[0]["sku"] == "SKU-3"
+	assert site.cache.stats()["hits"] == 1
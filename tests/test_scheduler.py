@@ -0,0 +1,86 @@
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+from conftest import fast_scheduler
+from pyautotask.atsite import APIError
+from pyautotask.query import exist
+from pyautotask.scheduler import RequestScheduler, TokenBucket
+
+
+def test_token_bucket_paces_after_burst():
+	bucket = TokenBucket(rate=100, burst=2)
+	assert bucket.reserve() == 0 and bucket.reserve() == 0
+	assert 0.005 < bucket.reserve() <= 0.01
+	assert 0.015 < bucket.reserve() <= 0.02
+
+
+def test_check_policy():
+	scheduler = RequestScheduler(backoff=0.01, max_backoff=0.01)
+	assert scheduler.check(200, {}, b"", True, 0) is None
+	assert scheduler.check(404, {}, b"", True, 0) is None
+	assert scheduler.check(500, {}, b"", False, 0) is None
+	assert scheduler.check(500, {}, b"", True, 0) is not None
+	assert scheduler.check(429, {"Retry-After": "3"}, b"", False, 0) == 3
+	assert scheduler.check(500, {}, b'{"errors":["thread threshold exceeded"]}', False, 0) is not None
+	assert scheduler.check(429, {}, b"", True, scheduler.retries) is None
+	assert scheduler.throttled == 2
+
+
+def test_throttled_requests_are_retried(make_mock, make_site):
+	server = make_mock(cis=500, page_size=100, throttle_rate=0.3, retry_after=0, seed=1)
+	site = make_site(server, scheduler=fast_scheduler(retries=10))
+	assert len(site.get_cis(exist("id"), all_pages=True)) == 500
+	# creates are retried too, a 429 means the request was never run
+	for index in range(10):
+		site.add_ticket({"title": "Ticket %d" % index})
+	assert len(server.data["Tickets"]) == 10
+	assert site.scheduler.throttled == server.throttled > 0
+	assert site.scheduler.retried == server.throttled
+
+
+def test_thread_threshold_is_retried(make_mock, make_site):
+	server = make_mock(cis=300, page_size=100, max_concurrent=1, latency=0.01)
+	site = make_site(server, scheduler=fast_scheduler(retries=20, max_concurrent=None))
+	with ThreadPoolExecutor(max_workers=4) as executor:
+		results = list(executor.map(site.get_ci_by_id, range(1, 41)))
+	assert [ci[0]["id"] for ci in results] == list(range(1, 41))
+	assert server.throttled > 0 and site.scheduler.throttled == server.throttled
+
+
+def test_gives_up_after_retries(make_mock, make_site):
+	server = make_mock(cis=10, throttle_rate=1.0)
+	site = make_site(server, scheduler=fast_scheduler(retries=2))
+	with pytest.raises(APIError):
+		site.get_ci_by_id(1)
+	assert server.requests == 3
+
+
+def test_connection_errors_retried_when_idempotent(make_site):
+	with socket.socket() as sock:
+		sock.bind(("127.0.0.1", 0))
+		port = sock.getsockname()[1]
+
+	class Closed:
+		url = "http://127.0.0.1:%d/ATServicesRest/V1.0/" % port
+	site = make_site(Closed, scheduler=fast_scheduler(retries=2))
+	with pytest.raises(requests.ConnectionError):
+		site.get_ci_by_id(1)
+	assert site.scheduler.retried == 2
+	with pytest.raises(requests.ConnectionError):
+		site.add_ticket({"title": "Not retried"})
+	assert site.scheduler.retried == 2
+
+
+def test_retry_counters_are_thread_safe():
+	scheduler = RequestScheduler()
+	threads = [threading.Thread(target=lambda: [scheduler.count_retry() for _retry in range(20000)])
+			   for _thread in range(8)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	assert scheduler.retried == 160000
@@ -0,0 +1,35 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from pyautotask.atsite import atSite
+
+
+def test_shared_returns_one_site_per_credentials(mock):
+	site = atSite.shared(None, "shared-user", "secret", "code", base_url=mock.url)
+	try:
+		assert atSite.shared(None, "shared-user", "secret", "code") is site
+		assert atSite.shared(None, "other-user", "secret", "code", base_url=mock.url) is not site
+	finally:
+		atSite._shared.clear()  # pylint: disable=protected-access
+
+
+def test_pool_settings(mock, make_site):
+	site = make_site(mock, max_threads=12, keep_alive=False)
+	adapter = site.session.get_adapter(mock.url)
+	assert adapter._pool_maxsize == 12 and adapter._pool_block  # pylint: disable=protected-access
+	assert site.session.headers["Connection"] == "close"
+	assert site.session.headers["ApiIntegrationCode"] == "code"
+
+
+def test_threads_share_the_session(site):
+	with ThreadPoolExecutor(max_workers=3) as executor:
+		results = list(executor.map(site.get_ci_by_id, range(1, 31)))
+	assert [ci[0]["id"] for ci in results] == list(range(1, 31))
+	pool = site.session.get_adapter(site.url).poolmanager.connection_from_url(site.url)
+	assert pool.num_connections <= 3
+
+
+def test_context_manager_closes(mock):
+	with atSite(None, "user", "secret", "code", base_url=mock.url) as site:
+		site.get_ci_by_id(1)
+		adapter = site.session.get_adapter(mock.url)
+	assert not adapter.poolmanager.pools
@@ -0,0 +1,75 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+
+import pytest
+import requests
+
+import pyautotask
+from conftest import fast_scheduler
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def python(*args, env=None):
+	environment = dict(os.environ, PYTHONPATH=ROOT)
+	environment.update(env or {})
+	return subprocess.run([sys.executable] + list(args), env=environment, capture_output=True, text=True, timeout=60)
+
+
+def test_import_and_construction_defer_heavy_modules():
+	code = ("import sys; from pyautotask.atsite import atSite; atSite('host', 'user', 'secret', 'code'); "
+			"print(json.dumps(sorted(m for m in ('requests', 'sqlite3', 'urllib.request', 'orjson') if m in sys.modules)))")
+	result = python("-c", "import json; " + code)
+	assert result.returncode == 0, result.stderr
+	assert json.loads(result.stdout) == []
+
+
+def test_package_attributes_load_on_use():
+	assert pyautotask.atSite is pyautotask.atsite.atSite
+	assert pyautotask.Query is pyautotask.query.Query
+	assert "MockAutotask" in dir(pyautotask)
+	with pytest.raises(AttributeError):
+		pyautotask.Missing  # pylint: disable=pointless-statement
+
+
+def test_injected_session_retries_connection_errors(make_site):
+	with socket.socket() as sock:
+		sock.bind(("127.0.0.1", 0))
+		port = sock.getsockname()[1]
+
+	class Closed:
+		url = "http://127.0.0.1:%d/ATServicesRest/V1.0/" % port
+	site = make_site(Closed, scheduler=fast_scheduler(retries=3))
+	site.session = requests.Session()
+	with pytest.raises(requests.ConnectionError):
+		site.get_ci_by_id(1)
+	assert site.scheduler.retried == 3
+
+
+def test_cli(mock):
+	env = {"AUTOTASK_USERNAME": "user", "AUTOTASK_SECRET": "secret", "AUTOTASK_INTEGRATION_CODE": "code",
+		   "AUTOTASK_BASE_URL": mock.url}
+	result = python("-m", "pyautotask", "count", "ConfigurationItems", "--where", "companyID=2", env=env)
+	assert result.returncode == 0, result.stderr
+	assert result.stdout == "120\n"
+	result = python("-m", "pyautotask", "--timing", "query", "ConfigurationItems", "--all", "--fields", "serialNumber",
+					env=env)
+	rows = [json.loads(line) for line in result.stdout.splitlines()]
+	assert len(rows) == 1200 and rows[0] == {"id": 1, "serialNumber": "SN00000001"}
+	assert "total" in result.stderr
+	result = python("-m", "pyautotask", "get", "ConfigurationItems", "5", env=env)
+	assert json.loads(result.stdout)["item"]["serialNumber"] == "SN00000005"
+	mock.data["ConfigurationItems"][7]["isActive"] = False
+	result = python("-m", "pyautotask", "count", "ConfigurationItems", env=env)
+	assert result.stdout == "1200\n"
+	result = python("-m", "pyautotask", "count", "Tickets", "--filter", "{not json", env=env)
+	assert result.returncode == 2 and "--filter" in result.stderr
+
+
+def test_cli_checks_its_environment():
+	env = {"AUTOTASK_USERNAME": "", "AUTOTASK_SECRET": "", "AUTOTASK_INTEGRATION_CODE": ""}
+	result = python("-m", "pyautotask", "zone", env=env)
+	assert result.returncode == 2 and "AUTOTASK_USERNAME" in result.stderr
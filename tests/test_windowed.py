@@ -0,0 +1,67 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from pyautotask.atsite import atSiteBase
+
+
+def ids(items):
+	return [item["id"] for item in items]
+
+
+def by_start(items):
+	return sorted(items, key=lambda item: (item["startDateTime"], item["id"]))
+
+
+def test_time_windows():
+	start = datetime(2024, 1, 1)
+	windows = atSiteBase.time_windows(start, start + timedelta(days=3), 3)
+	assert windows == [(start, start + timedelta(days=1)), (start + timedelta(days=1), start + timedelta(days=2)),
+					   (start + timedelta(days=2), start + timedelta(days=3))]
+	assert atSiteBase.parse_date("2024-01-01T08:00:00+02:00") == datetime(2024, 1, 1, 6)
+	assert atSiteBase.format_date(datetime(2024, 1, 1, 6, 0, 0, 5000)) == "2024-01-01T06:00:00.005Z"
+
+
+def test_windowed_matches_plain_query(make_mock, make_site):
+	server = make_mock(cis=0, companies=5, service_calls=400)
+	site = make_site(server)
+	plain = site.get_servicecalls("2023-01-01", "2024-01-01")
+	assert len(plain) == 400
+	assert ids(site.get_servicecalls("2023-01-01", "2024-01-01", windowed=True)) == ids(by_start(plain))
+	plain = site.get_appointments("2023-01-01", "2024-01-01")
+	assert site.get_appointments("2023-01-01", "2024-01-01", windowed=True) == plain == []
+
+
+def test_dense_windows_are_split(site, mock):
+	every = site.create_query("ServiceCalls", '{"op":"exist","field":"id"}', all_pages=True)
+	requests = mock.requests
+	windowed = site.get_servicecalls("2023-01-01", "2024-01-01", windowed=True)
+	assert ids(windowed) == ids(by_start(every))
+	# 900 calls on 100 item pages need more than the 3 first windows
+	assert mock.requests - requests > 9
+
+
+def test_windowed_keeps_filters_and_bounds(site, mock):
+	incomplete = [call for call in mock.data["ServiceCalls"].values() if not call["isComplete"]]
+	start = by_start(incomplete)[10]["startDateTime"]
+	windowed = site.get_servicecalls_incomplete(start, windowed=True)
+	assert ids(windowed) == ids([call for call in by_start(incomplete) if call["startDateTime"] > start])
+	windowed = site.query_windowed("ServiceCalls", "startDateTime", start, "2024-01-01")
+	assert windowed[0]["startDateTime"] == start
+
+
+def test_async_windowed(mock):
+	aio = pytest.importorskip("pyautotask.aio")
+
+	async def windowed():
+		async with aio.AsyncAtSite(None, "user", "secret", "code", base_url=mock.url) as site:
+			return await site.get_servicecalls("2023-01-01", "2024-01-01", windowed=True)
+	assert ids(asyncio.run(windowed())) == ids(by_start(mock.data["ServiceCalls"].values()))
+
+
+def test_window_field_is_fetched_for_ordering(site, mock):
+	windowed = site.query_windowed("ServiceCalls", "startDateTime", "2023-01-01", "2024-01-01",
+								   include_fields="companyID")
+	assert ids(windowed) == ids(by_start(mock.data["ServiceCalls"].values()))
+	assert set(windowed[0]) == {"id", "companyID", "startDateTime"}
@@ -0,0 +1,85 @@
+import asyncio
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def udfs(mock, ci_id):
+	return {udf["name"]: udf["value"] for udf in mock.data["ConfigurationItems"][ci_id]["userDefinedFields"]}
+
+
+def test_updates_to_a_record_are_merged(site, mock):
+	writes = site.write_behind(max_delay=60)
+	futures = [site.update_ci_just_udf(1, 5, [{"name": "UDF %d" % udf, "value": "v%d" % udf}], deferred=True)
+			   for udf in range(3)]
+	futures.append(site.update_ci_just_udf(1, 5, [{"name": "UDF 0", "value": "last"}], deferred=True))
+	futures.append(site.update_ci_just_udf(1, 6, [{"name": "UDF 0", "value": "other"}], deferred=True))
+	assert len(writes) == 2 and mock.requests == 0
+	writes.flush()
+	assert [future.result() for future in futures] == [{"itemId": 5}] * 4 + [{"itemId": 6}]
+	assert writes.queued == 5 and writes.sent == 2 and mock.requests == 2
+	assert udfs(mock, 5)["UDF 0"] == "last" and udfs(mock, 5)["UDF 2"] == "v2"
+	assert udfs(mock, 6)["UDF 0"] == "other"
+
+
+def test_sent_after_max_delay_or_max_pending(site, mock):
+	writes = site.write_behind(max_delay=0.05, max_pending=3)
+	site.update_ci_just_udf(1, 1, [{"name": "UDF 0", "value": "x"}], deferred=True).result(timeout=5)
+	futures = [site.update_ci_just_udf(1, ci_id, [{"name": "UDF 0", "value": "y"}], deferred=True)
+			   for ci_id in range(2, 5)]
+	assert [future.result(timeout=5)["itemId"] for future in futures] == [2, 3, 4]
+	assert writes.sent == 4
+
+
+def test_unchanged_updates_are_not_queued(site, mock):
+	ci = site.get_ci_by_id(2)[0]
+	future = site.update_ci_udf(2, ci["productID"], ci["userDefinedFields"], current=ci, deferred=True)
+	assert future.result() == {"itemId": 2}
+	assert site.write_behind().queued == 0
+
+
+def test_errors_reach_the_futures(site):
+	future = site.update_ci_just_udf(1, 99999, [{"name": "UDF 0", "value": "x"}], deferred=True)
+	site.write_behind().flush()
+	with pytest.raises(Exception):
+		future.result()
+
+
+def test_close_sends_what_is_queued(site, mock):
+	writes = site.write_behind(max_delay=60)
+	future = site.update_company_udf(3, [{"name": "Tier", "value": "Gold"}], deferred=True)
+	site.close()
+	assert future.result(timeout=0) == {"itemId": 3}
+	assert mock.data["Companies"][3]["userDefinedFields"] == [{"name": "Tier", "value": "Gold"}]
+	with pytest.raises(RuntimeError):
+		writes.update("Companies", {"id": 3})
+
+
+def test_interpreter_exit_sends_what_is_queued(mock):
+	script = textwrap.dedent("""
+		import sys
+		from pyautotask.atsite import atSite
+		site = atSite(None, "user", "secret", "code", base_url=sys.argv[1])
+		site.write_behind(max_delay=60)
+		site.update_ci_just_udf(1, 7, [{"name": "UDF 0", "value": "at exit"}], deferred=True)
+	""")
+	env = dict(os.environ, PYTHONPATH=ROOT)
+	subprocess.run([sys.executable, "-c", script, mock.url], env=env, check=True, timeout=30)
+	assert udfs(mock, 7)["UDF 0"] == "at exit"
+
+
+def test_async_site_has_no_deferred_updates(mock):
+	aio = pytest.importorskip("pyautotask.aio")
+
+	async def update():
+		async with aio.AsyncAtSite(None, "user", "secret", "code", base_url=mock.url) as site:
+			with pytest.raises(TypeError):
+				site.update_ci_just_udf(1, 7, [], deferred=True)
+			return await site.update_ci_just_udf(1, 7, [{"name": "UDF 0", "value": "async"}])
+	assert asyncio.run(update()) == {"itemId": 7}
+	assert udfs(mock, 7)["UDF 0"] == "async"
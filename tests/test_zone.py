@@ -0,0 +1,46 @@
+import time
+
+import pytest
+
+from pyautotask.atsite import APIError, atSite, discover_zone
+
+
+def test_from_zone_uses_the_reported_zone(mock, tmp_path):
+	site = atSite.from_zone("user", "secret", "code", zone_url=mock.zone_url, cache_path=str(tmp_path / "zones.db"))
+	assert site.url == mock.url
+	assert site.host == "127.0.0.1:%d" % mock.port
+	assert site.get_ci_by_id(1)[0]["id"] == 1
+
+
+def test_cache_hit_skips_the_lookup(mock, tmp_path):
+	path = str(tmp_path / "zones.db")
+	assert discover_zone("user", mock.zone_url, path) == mock.url
+	assert mock.requests == 1
+	# a later startup, ie a new process, reads the zone from disk
+	site = atSite.from_zone("user", "secret", "code", zone_url=mock.zone_url, cache_path=path)
+	assert site.url == mock.url
+	assert mock.requests == 1
+	discover_zone("other-user", mock.zone_url, path)
+	assert mock.requests == 2
+
+
+def test_expired_zone_is_looked_up_again(mock, tmp_path):
+	path = str(tmp_path / "zones.db")
+	discover_zone("user", mock.zone_url, path, ttl=0.05)
+	time.sleep(0.1)
+	assert atSite.from_zone("user", "secret", "code", zone_url=mock.zone_url, cache_path=path, ttl=0.05).url == mock.url
+	assert mock.requests == 2
+
+
+def test_no_cache_path_always_looks_up(mock, monkeypatch):
+	def no_cache(path):
+		raise AssertionError("opened a zone cache at " + path)
+	monkeypatch.setattr("pyautotask.atsite.DiskCache", no_cache)
+	atSite.from_zone("user", "secret", "code", zone_url=mock.zone_url, cache_path=None)
+	atSite.from_zone("user", "secret", "code", zone_url=mock.zone_url, cache_path=None)
+	assert mock.requests == 2
+
+
+def test_lookup_failure_raises(mock):
+	with pytest.raises(APIError):
+		discover_zone("user", mock.url + "nowhere/zoneInformation", None)